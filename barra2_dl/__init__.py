@@ -1 +1,67 @@
-from . import convert, download, mapping, merge
+"""Bulk download and processing of BARRA2 point data.
+
+Submodules are imported on first attribute access, e.g. barra2_dl.download, so importing the package, the command
+line interface or the URL planner does not load pandas, numpy or requests until they are used.
+"""
+import importlib
+import sys
+from types import ModuleType
+from typing import TYPE_CHECKING
+
+__all__ = [
+    'analytics',
+    'cache',
+    'compression',
+    'convert',
+    'distribute',
+    'download',
+    'estimate',
+    'gridstore',
+    'instrument',
+    'inventory',
+    'manifest',
+    'mapping',
+    'merge',
+    'panel',
+    'profiling',
+    'query',
+    'resample',
+    'storage',
+    'validate',
+]
+
+if TYPE_CHECKING:
+    from . import (
+        analytics,
+        cache,
+        compression,
+        convert,
+        distribute,
+        download,
+        estimate,
+        gridstore,
+        instrument,
+        inventory,
+        manifest,
+        mapping,
+        merge,
+        panel,
+        profiling,
+        query,
+        resample,
+        storage,
+        validate,
+    )
+
+
+def __getattr__(name: str) -> ModuleType:
+    """Import a submodule on first access."""
+    if name in __all__:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__() -> list[str]:
+    """Module attributes including the lazily imported submodules."""
+    # the barra2_dl.globals submodule shadows the globals builtin once imported
+    return sorted(set(vars(sys.modules[__name__])) | set(__all__))
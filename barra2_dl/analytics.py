@@ -0,0 +1,532 @@
+"""This module contains the barra2 wind analytics function(s).
+
+The functions work on the output of barra2_dl.convert.convert_wind_components, using the wind speed columns
+f'v{height}m[unit="m s-1"]' and direction columns f'v{height}m_phi_met[unit="degrees"]' for all heights at once.
+Statistics by period and site are computed with group sums over all rows, so long records can also be processed in
+chunks with WindStatsAccumulator, e.g. from pd.read_csv(..., chunksize=...).
+"""
+import logging
+import math
+import re
+from collections.abc import Iterable
+
+import numpy as np
+import pandas as pd
+
+from barra2_dl.instrument import EventCallback, stage
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'speed_heights',
+    'shear_exponent',
+    'hub_height_speed',
+    'weibull_fit',
+    'wind_rose',
+    'period_statistics',
+    'WindStatsAccumulator',
+]
+
+_SPEED_PATTERN = re.compile(r'^v(\d+)m\[')
+_DIRECTION_PATTERN = re.compile(r'^v(\d+)m_phi_met\[')
+
+_WEIBULL_ITERATIONS = 25
+
+_SPEED_BINS = (0, 2, 4, 6, 8, 10, 12, 15, 20, np.inf)
+
+
+def _height_columns(
+    df: pd.DataFrame,
+    pattern: re.Pattern[str],
+) -> dict[int, str]:
+    """Columns matching pattern by height in metres, sorted by height."""
+    columns = {}
+    for column in df.columns:
+        match = pattern.match(str(column))
+        if match is not None:
+            columns[int(match[1])] = column
+    return dict(sorted(columns.items()))
+
+
+def speed_heights(
+    df: pd.DataFrame,
+) -> pd.DataFrame:
+    """Select the converted wind speed columns, renamed to their height in metres.
+
+    Args:
+        df (pd.DataFrame): Output of convert_wind_components.
+
+    Returns:
+        pd.DataFrame: Wind speed with one float column per height, sorted by height.
+
+    Raises:
+        ValueError: If there are no converted wind speed columns.
+    """
+    columns = _height_columns(df, _SPEED_PATTERN)
+    if not columns:
+        raise ValueError('No converted wind speed columns, run convert_wind_components first.')
+    return df[list(columns.values())].set_axis(list(columns), axis=1).astype(float)
+
+
+def _log_speeds(
+    speeds: np.ndarray,
+) -> np.ndarray:
+    """Natural log of speeds, NaN for zero or missing speeds."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(speeds > 0, np.log(speeds), np.nan)
+
+
+def shear_exponent(
+    df: pd.DataFrame,
+) -> pd.DataFrame:
+    """Power law wind shear exponents between heights, v2 / v1 = (h2 / h1) ** alpha.
+
+    Args:
+        df (pd.DataFrame): Output of convert_wind_components with at least two heights.
+
+    Returns:
+        pd.DataFrame: Columns f'alpha_{h1}m_{h2}m' for each pair of adjacent heights, and 'alpha' fitted to all heights
+        by least squares of log speed on log height. NaN where a speed is zero or missing.
+
+    Raises:
+        ValueError: If there are fewer than two heights.
+    """
+    df_speed = speed_heights(df)
+    heights = np.array(df_speed.columns, dtype=float)
+    if len(heights) < 2:
+        raise ValueError(f'Shear needs at least two heights, got {list(df_speed.columns)}.')
+    log_heights = np.log(heights)
+    log_speeds = _log_speeds(df_speed.to_numpy())
+
+    alphas = np.diff(log_speeds, axis=1) / np.diff(log_heights)
+    columns = [f'alpha_{h1}m_{h2}m' for h1, h2 in zip(df_speed.columns[:-1], df_speed.columns[1:], strict=True)]
+    df_shear = pd.DataFrame(alphas, index=df.index, columns=columns)
+
+    # slope of the least squares fit per row, rows with any missing speed are NaN
+    centred = log_heights - log_heights.mean()
+    df_shear['alpha'] = (log_speeds @ centred) / (centred @ centred)
+    return df_shear
+
+
+def hub_height_speed(
+    df: pd.DataFrame,
+    hub_height: float,
+) -> pd.Series:
+    """Interpolate wind speed to hub height with the power law between the two nearest heights.
+
+    Hub heights below or above the available heights are extrapolated with the lowest or highest pair.
+
+    Args:
+        df (pd.DataFrame): Output of convert_wind_components.
+        hub_height (float): Hub height in metres.
+
+    Returns:
+        pd.Series: Wind speed at hub height named f'v{hub_height}m[unit="m s-1"]'.
+    """
+    df_speed = speed_heights(df)
+    heights = np.array(df_speed.columns, dtype=float)
+    speeds = df_speed.to_numpy()
+    name = f'v{hub_height:g}m[unit="m s-1"]'
+    if len(heights) == 1 or hub_height in heights:
+        column = int(np.argmin(np.abs(heights - hub_height)))
+        return pd.Series(speeds[:, column], index=df.index, name=name)
+
+    upper = int(np.clip(np.searchsorted(heights, hub_height), 1, len(heights) - 1))
+    lower = upper - 1
+    log_speeds = _log_speeds(speeds[:, [lower, upper]])
+    alpha = (log_speeds[:, 1] - log_speeds[:, 0]) / np.log(heights[upper] / heights[lower])
+    hub_speed = speeds[:, lower] * (hub_height / heights[lower]) ** alpha
+    # calm at the lower height has no shear, fall back to linear interpolation
+    calm = ~np.isfinite(alpha)
+    weight = (hub_height - heights[lower]) / (heights[upper] - heights[lower])
+    hub_speed[calm] = (speeds[calm, lower] + weight * (speeds[calm, upper] - speeds[calm, lower])).clip(min=0)
+    return pd.Series(hub_speed, index=df.index, name=name)
+
+
+def _group_sum(
+    values: np.ndarray,
+    codes: np.ndarray,
+    ngroups: int,
+) -> np.ndarray:
+    """Sum the columns of a 2d array by group code, returning an array of shape (ngroups, columns)."""
+    return np.stack(
+        [np.bincount(codes, weights=values[:, column], minlength=ngroups) for column in range(values.shape[1])],
+        axis=1,
+    )
+
+
+def _weibull_moments(
+    mean: np.ndarray,
+    std: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Weibull shape and scale from the mean and standard deviation with the empirical method of Justus."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shape = (std / mean) ** -1.086
+    lgamma = np.frompyfunc(math.lgamma, 1, 1)
+    gamma = np.exp(np.asarray(lgamma(1 + 1 / np.where(shape > 0, shape, np.nan)), dtype=float))
+    return shape, mean / gamma
+
+
+def _weibull_mle(
+    speeds: np.ndarray,
+    codes: np.ndarray,
+    ngroups: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Maximum likelihood Weibull shape and scale for each group and column, by Newton iteration from the moments fit.
+
+    Zero and missing speeds are excluded from the fit.
+    """
+    valid = np.isfinite(speeds) & (speeds > 0)
+    log_speeds = np.where(valid, np.log(np.where(valid, speeds, 1)), 0)
+    count = _group_sum(valid.astype(float), codes, ngroups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_log = _group_sum(log_speeds, codes, ngroups) / count
+        mean = _group_sum(np.where(valid, speeds, 0), codes, ngroups) / count
+        std = np.sqrt(_group_sum(np.where(valid, speeds ** 2, 0), codes, ngroups) / count - mean ** 2)
+    shape, _scale = _weibull_moments(mean, std)
+    shape = np.where(np.isfinite(shape), shape, 2.0)
+
+    for _iteration in range(_WEIBULL_ITERATIONS):
+        powered = np.where(valid, np.exp(shape[codes] * log_speeds), 0)
+        sum_powered = _group_sum(powered, codes, ngroups)
+        sum_log = _group_sum(powered * log_speeds, codes, ngroups)
+        sum_log2 = _group_sum(powered * log_speeds ** 2, codes, ngroups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = sum_log / sum_powered
+            residual = ratio - 1 / shape - mean_log
+            slope = sum_log2 / sum_powered - ratio ** 2 + 1 / shape ** 2
+            step = np.where(slope > 0, residual / slope, 0)
+        shape = np.clip(shape - np.nan_to_num(step), 0.1, 50)
+        if np.nanmax(np.abs(step), initial=0) < 1e-8:
+            break
+
+    powered = np.where(valid, np.exp(shape[codes] * log_speeds), 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = (_group_sum(powered, codes, ngroups) / count) ** (1 / shape)
+    shape = np.where(count > 1, shape, np.nan)
+    return shape, np.where(count > 1, scale, np.nan)
+
+
+def weibull_fit(
+    speeds: pd.DataFrame | pd.Series,
+    method: str = 'mle',
+) -> pd.DataFrame:
+    """Fit Weibull distributions to each column of wind speeds.
+
+    Args:
+        speeds (pd.DataFrame | pd.Series): Wind speeds, e.g. from speed_heights or hub_height_speed.
+        method (str): 'mle' for maximum likelihood or 'moments' for the empirical method of Justus.
+
+    Returns:
+        pd.DataFrame: Index 'k' (shape) and 'c' (scale) with a column per column of speeds.
+
+    Raises:
+        ValueError: If the method is not supported.
+
+    Example:
+        >>> rng = np.random.default_rng(0)
+        >>> fit = weibull_fit(pd.Series(8 * rng.weibull(2.0, 100_000), name='v'))
+        >>> fit['v'].round(1).tolist()
+        [2.0, 8.0]
+    """
+    df_speed = speeds.to_frame() if isinstance(speeds, pd.Series) else speeds
+    values = df_speed.to_numpy(dtype=float)
+    codes = np.zeros(len(values), dtype=np.intp)
+    match method:
+        case 'mle':
+            shape, scale = _weibull_mle(values, codes, 1)
+        case 'moments':
+            shape, scale = _weibull_moments(np.nanmean(values, axis=0), np.nanstd(values, axis=0))
+        case _:
+            raise ValueError(f'Unsupported Weibull fit method: {method}')
+    return pd.DataFrame(np.vstack([np.ravel(shape), np.ravel(scale)]), index=['k', 'c'], columns=df_speed.columns)
+
+
+def _rose_codes(
+    speed: np.ndarray,
+    direction: np.ndarray,
+    sectors: int,
+    speed_bins: tuple[float, ...],
+) -> tuple[np.ndarray, np.ndarray]:
+    """Flat sector and speed bin code of each row, and a mask of valid rows."""
+    width = 360 / sectors
+    sector = (np.mod(direction + width / 2, 360) // width).astype(np.intp, copy=False)
+    speed_bin = np.searchsorted(np.asarray(speed_bins, dtype=float), speed, side='right') - 1
+    valid = np.isfinite(speed) & np.isfinite(direction) & (speed_bin >= 0) & (speed_bin < len(speed_bins) - 1)
+    return sector * (len(speed_bins) - 1) + speed_bin, valid
+
+
+def _rose_frame(
+    counts: np.ndarray,
+    sectors: int,
+    speed_bins: tuple[float, ...],
+) -> pd.DataFrame:
+    """Wind rose frame of counts by sector and speed bin."""
+    width = 360 / sectors
+    return pd.DataFrame(
+        counts.reshape(sectors, len(speed_bins) - 1),
+        index=pd.Index(np.arange(sectors) * width, name='sector'),
+        columns=pd.IntervalIndex.from_breaks(speed_bins, closed='left', name='speed'),
+    )
+
+
+def wind_rose(
+    df: pd.DataFrame,
+    height: int,
+    sectors: int = 16,
+    speed_bins: tuple[float, ...] = _SPEED_BINS,
+    normalize: bool = True,
+) -> pd.DataFrame:
+    """Joint frequency of wind direction sector and speed bin at a height.
+
+    Args:
+        df (pd.DataFrame): Output of convert_wind_components.
+        height (int): Height in metres.
+        sectors (int): Number of direction sectors, centred on north.
+        speed_bins (tuple[float, ...]): Speed bin edges in m/s, closed on the left.
+        normalize (bool): If True return fractions of all valid rows, else counts.
+
+    Returns:
+        pd.DataFrame: Index of sector centre in degrees and columns of speed intervals.
+
+    Raises:
+        ValueError: If the speed or direction at the height is not in df.
+    """
+    speed_columns = _height_columns(df, _SPEED_PATTERN)
+    direction_columns = _height_columns(df, _DIRECTION_PATTERN)
+    if height not in speed_columns or height not in direction_columns:
+        raise ValueError(f'No converted wind speed and direction at {height}m.')
+    codes, valid = _rose_codes(
+        df[speed_columns[height]].to_numpy(dtype=float),
+        df[direction_columns[height]].to_numpy(dtype=float),
+        sectors,
+        speed_bins,
+    )
+    counts = np.bincount(codes[valid], minlength=sectors * (len(speed_bins) - 1))
+    df_rose = _rose_frame(counts, sectors, speed_bins)
+    return df_rose / max(int(counts.sum()), 1) if normalize else df_rose
+
+
+def _time_index(
+    df: pd.DataFrame,
+) -> pd.DatetimeIndex:
+    """Time of each row from a DatetimeIndex or the time column."""
+    if isinstance(df.index, pd.DatetimeIndex):
+        return df.index
+    return pd.DatetimeIndex(pd.to_datetime(df['time']))
+
+
+def _group_keys(
+    df: pd.DataFrame,
+    freq: str | None,
+    by: str | list[str] | None,
+) -> list[pd.Index]:
+    """Named group keys of each row, the by columns or index levels then the start of the period."""
+    keys = []
+    if by is not None:
+        for key in [by] if isinstance(by, str) else by:
+            values = df.index.get_level_values(key) if key in df.index.names else df[key]
+            keys.append(pd.Index(values, name=key))
+    if freq is not None:
+        time_index = _time_index(df)
+        if time_index.tz is not None:
+            time_index = time_index.tz_convert(None)
+        keys.append(time_index.to_period(freq).to_timestamp().rename('period'))
+    return keys
+
+
+def period_statistics(
+    df: pd.DataFrame,
+    freq: str | None = 'M',
+    by: str | list[str] | None = None,
+    hub_height: float | None = None,
+    method: str = 'mle',
+    callback: EventCallback | None = None,
+    quiet: bool = True,
+) -> pd.DataFrame:
+    """Mean wind speed, Weibull fit and shear for each period, and optionally each site, at all heights at once.
+
+    Args:
+        df (pd.DataFrame): Output of convert_wind_components, with a DatetimeIndex or time column.
+        freq (str | None): Period frequency as for pd.DatetimeIndex.to_period, e.g. 'M', 'Q' or 'Y', None for the
+            whole record.
+        by (str | list[str] | None): Optional columns or index levels to group by, e.g. 'site'.
+        hub_height (float | None): Optional hub height to add the interpolated speed as height hub_height.
+        method (str): Weibull fit method, 'mle' or 'moments'.
+        callback (EventCallback | None): Optional callable receiving a StageEvent for the analytics.
+        quiet (bool): If True nothing is written to stdout.
+
+    Returns:
+        pd.DataFrame: One row per group with columns count, mean, std, k and c for each height as
+        f'{statistic}_{height}m', and alpha, the mean of the fitted shear exponent.
+    """
+    with stage('analytics', detail=f'Wind statistics by {freq}', callback=callback, quiet=quiet) as analytics_stage:
+        analytics_stage.rows = len(df)
+        df_speed = speed_heights(df)
+        if hub_height is not None and hub_height not in df_speed.columns:
+            df_speed[hub_height] = hub_height_speed(df, hub_height).to_numpy()
+            df_speed = df_speed.sort_index(axis=1)
+        keys = _group_keys(df, freq, by)
+        if keys:
+            grouper = pd.MultiIndex.from_arrays(keys) if len(keys) > 1 else pd.Index(keys[0])
+            codes, groups = pd.factorize(grouper, sort=True)
+            groups = groups.set_names(grouper.names)
+        else:
+            codes, groups = np.zeros(len(df), dtype=np.intp), pd.Index(['all'])
+
+        speeds = df_speed.to_numpy()
+        valid = np.isfinite(speeds)
+        count = _group_sum(valid.astype(float), codes, len(groups))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = _group_sum(np.where(valid, speeds, 0), codes, len(groups)) / count
+            std = np.sqrt(np.maximum(_group_sum(np.where(valid, speeds ** 2, 0), codes, len(groups)) / count
+                                     - mean ** 2, 0))
+        if method == 'moments':
+            shape, scale = _weibull_moments(mean, std)
+        else:
+            shape, scale = _weibull_mle(speeds, codes, len(groups))
+
+        statistics = {'count': count, 'mean': mean, 'std': std, 'k': shape, 'c': scale}
+        df_stats = pd.DataFrame(
+            {f'{name}_{height:g}m': values[:, column] for name, values in statistics.items()
+             for column, height in enumerate(df_speed.columns)},
+            index=groups,
+        )
+        if len(_height_columns(df, _SPEED_PATTERN)) > 1:
+            alpha = shear_exponent(df)['alpha'].to_numpy()
+            alpha_valid = np.isfinite(alpha)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                df_stats['alpha'] = (np.bincount(codes, np.where(alpha_valid, alpha, 0), len(groups))
+                                     / np.bincount(codes, alpha_valid, len(groups)))
+    return df_stats
+
+
+class WindStatsAccumulator:
+    """Streaming wind statistics by period and site for records too long to hold in memory.
+
+    Chunks of the output of convert_wind_components are added with update, which keeps only the sums needed for the
+    mean, standard deviation, mean shear and a wind rose per group. Weibull fits use the empirical method of Justus,
+    as the maximum likelihood fit needs all the speeds.
+
+    Example:
+        >>> chunks = pd.read_csv('converted.csv', chunksize=100_000)  # doctest: +SKIP
+        >>> stats = WindStatsAccumulator(freq='M', rose_height=100).update_all(chunks).result()  # doctest: +SKIP
+    """
+
+    def __init__(
+        self,
+        freq: str | None = 'M',
+        by: str | list[str] | None = None,
+        rose_height: int | None = None,
+        sectors: int = 16,
+        speed_bins: tuple[float, ...] = _SPEED_BINS,
+    ):
+        """Create an empty accumulator.
+
+        Args:
+            freq (str | None): Period frequency as for pd.DatetimeIndex.to_period, e.g. 'M', 'Q' or 'Y', None for
+                the whole record.
+            by (str | list[str] | None): Optional columns or index levels to group by, e.g. 'site'.
+            rose_height (int | None): Optional height in metres to accumulate a wind rose for.
+            sectors (int): Number of wind rose direction sectors.
+            speed_bins (tuple[float, ...]): Wind rose speed bin edges in m/s.
+        """
+        self.freq = freq
+        self.by = by
+        self.rose_height = rose_height
+        self.sectors = sectors
+        self.speed_bins = speed_bins
+        self.heights: list[int] | None = None
+        self._sums: pd.DataFrame | None = None
+        self._rose = np.zeros(sectors * (len(speed_bins) - 1), dtype=np.int64)
+
+    def update(
+        self,
+        df: pd.DataFrame,
+    ) -> 'WindStatsAccumulator':
+        """Add a chunk of converted rows.
+
+        Args:
+            df (pd.DataFrame): Chunk of the output of convert_wind_components.
+
+        Returns:
+            WindStatsAccumulator: self, to chain calls.
+
+        Raises:
+            ValueError: If the heights differ from previous chunks.
+        """
+        df_speed = speed_heights(df)
+        heights = [int(height) for height in df_speed.columns]
+        if self.heights is None:
+            self.heights = heights
+        elif heights != self.heights:
+            raise ValueError(f'Chunk heights {heights} differ from {self.heights}.')
+
+        speeds = df_speed.to_numpy()
+        valid = np.isfinite(speeds)
+        sums = {}
+        for column, height in enumerate(self.heights):
+            sums[f'count_{height}m'] = valid[:, column]
+            sums[f'sum_{height}m'] = np.where(valid[:, column], speeds[:, column], 0)
+            sums[f'sum2_{height}m'] = np.where(valid[:, column], speeds[:, column] ** 2, 0)
+        if len(self.heights) > 1:
+            alpha = shear_exponent(df)['alpha'].to_numpy()
+            sums['count_alpha'] = np.isfinite(alpha)
+            sums['sum_alpha'] = np.where(np.isfinite(alpha), alpha, 0)
+        df_sums = pd.DataFrame(sums).astype(float)
+        keys = _group_keys(df, self.freq, self.by)
+        df_sums = df_sums.groupby(keys, sort=False).sum() if keys else df_sums.sum().to_frame('all').T
+        self._sums = df_sums if self._sums is None else self._sums.add(df_sums, fill_value=0)
+
+        if self.rose_height is not None:
+            codes, valid_rose = _rose_codes(
+                df[_height_columns(df, _SPEED_PATTERN)[self.rose_height]].to_numpy(dtype=float),
+                df[_height_columns(df, _DIRECTION_PATTERN)[self.rose_height]].to_numpy(dtype=float),
+                self.sectors,
+                self.speed_bins,
+            )
+            self._rose += np.bincount(codes[valid_rose], minlength=len(self._rose))
+        return self
+
+    def update_all(
+        self,
+        chunks: Iterable[pd.DataFrame],
+    ) -> 'WindStatsAccumulator':
+        """Add each chunk of an iterable, e.g. pd.read_csv(..., chunksize=...)."""
+        for chunk in chunks:
+            self.update(chunk)
+        return self
+
+    def result(self) -> pd.DataFrame:
+        """Statistics by group in the format of period_statistics, with Weibull fits by the method of moments.
+
+        Raises:
+            ValueError: If no chunks have been added.
+        """
+        if self._sums is None or self.heights is None:
+            raise ValueError('No chunks added to the accumulator.')
+        df_sums = self._sums.sort_index()
+        statistics = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for height in self.heights:
+                count = df_sums[f'count_{height}m'].to_numpy()
+                mean = df_sums[f'sum_{height}m'].to_numpy() / count
+                std = np.sqrt(np.maximum(df_sums[f'sum2_{height}m'].to_numpy() / count - mean ** 2, 0))
+                shape, scale = _weibull_moments(mean, std)
+                statistics.update({
+                    f'count_{height}m': count, f'mean_{height}m': mean, f'std_{height}m': std,
+                    f'k_{height}m': shape, f'c_{height}m': scale,
+                })
+            if 'sum_alpha' in df_sums:
+                statistics['alpha'] = df_sums['sum_alpha'].to_numpy() / df_sums['count_alpha'].to_numpy()
+        columns = [f'{name}_{height}m' for name in ('count', 'mean', 'std', 'k', 'c') for height in self.heights]
+        return pd.DataFrame(statistics, index=df_sums.index)[columns + [col for col in statistics if col == 'alpha']]
+
+    def rose(
+        self,
+        normalize: bool = True,
+    ) -> pd.DataFrame:
+        """Wind rose at rose_height of all chunks, see wind_rose."""
+        df_rose = _rose_frame(self._rose, self.sectors, self.speed_bins)
+        return df_rose / max(int(self._rose.sum()), 1) if normalize else df_rose
@@ -0,0 +1,343 @@
+"""This module contains the barra2 cache inventory and completeness function(s).
+
+Cached files are named f'{fileout_prefix}_{var}_{YYYYMMDD}_{YYYYMMDD}.csv' by barra2_dl.download, so the site,
+variable and period of each file can be read from its name. The number of data rows of each downloaded file is
+recorded in the cache manifest, see barra2_dl.manifest, so missing and partial months are found without parsing or
+reading the csv files. Rows of files not recorded, or changed since they were downloaded, are counted from their line
+breaks. Compressed files, e.g. .csv.gz, are listed by their planned name, see barra2_dl.compression.
+
+Frames derived from cached files, e.g. aggregates, can be stored in a FrameCache keyed by fingerprint_files, which
+changes when any of the source files is added, removed or rewritten.
+"""
+import fnmatch
+import hashlib
+import logging
+import os
+from collections.abc import Iterable
+from dataclasses import dataclass
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from barra2_dl.compression import open_cached, plain_name
+from barra2_dl.download import URLFilenamePair
+from barra2_dl.manifest import _MANIFEST_NAME, CacheManifest
+from barra2_dl.storage import LocalStorage
+from barra2_dl.validate import _count_data_rows, parse_filename
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'parse_filename',
+    'count_rows',
+    'scan_cache',
+    'CompletenessReport',
+    'check_completeness',
+    'fingerprint_files',
+    'FrameCache',
+]
+
+_CHUNK_SIZE = 1 << 20
+
+
+def count_rows(
+    path: str | Path,
+) -> int:
+    """Count the data rows of a csv file by counting its line breaks, reading through the file in chunks.
+
+    Args:
+        path (str | Path): Path of the csv file, uncompressed or compressed.
+
+    Returns:
+        int: Number of data rows, excluding the header line.
+    """
+    with open_cached(path) as file:
+        return _count_data_rows(iter(lambda: file.read(_CHUNK_SIZE), b''))
+
+
+def _recorded_rows(
+    folder: Path,
+) -> dict[str, tuple[int | None, int | None]]:
+    """Content length and number of data rows of the files recorded in the manifest of a cache folder, if any."""
+    if not (folder / _MANIFEST_NAME).is_file():
+        return {}
+    return {file_name: (validators.content_length, validators.rows)
+            for file_name, validators in CacheManifest(folder).items().items()}
+
+
+def _expected_rows(
+    df_files: pd.DataFrame,
+) -> pd.Series:
+    """Hours from the start to the end of the period of each file."""
+    hours = pd.to_timedelta(df_files['end'] - df_files['start']) // pd.Timedelta(hours=1)
+    return (hours + 1).astype(np.int64)
+
+
+def scan_cache(
+    folder_path: str | Path,
+    filename_pattern: str = '*.csv',
+    max_workers: int = 8,
+) -> pd.DataFrame:
+    """Scan a cache folder and count the rows of each cached file.
+
+    Args:
+        folder_path (str | Path): Cache folder.
+        filename_pattern (str): Filename matching pattern.
+        max_workers (int): Number of threads used to count rows.
+
+    Returns:
+        pd.DataFrame: One row per matched file with columns file_name, the planned name without a compression
+        suffix, prefix, var, start, end, size on disk, rows, expected_rows and complete.
+    """
+    folder = Path(folder_path)
+    recorded = _recorded_rows(folder)
+    entries = []
+    with os.scandir(folder) as scan:
+        for entry in scan:
+            file_name = plain_name(entry.name)
+            if not entry.is_file() or not fnmatch.fnmatch(file_name, filename_pattern):
+                continue
+            parsed = parse_filename(file_name)
+            if parsed is not None:
+                size = entry.stat().st_size
+                # rows recorded at download time are used for uncompressed files of the recorded size
+                length, rows = recorded.get(entry.name, (None, None))
+                entries.append({'file_name': file_name, **parsed, 'size': size,
+                                'rows': rows if length == size else None, 'path': entry.path})
+
+    counted = [parsed for parsed in entries if parsed['rows'] is None]
+    with ThreadPool(max_workers) as pool:
+        for parsed, rows in zip(counted, pool.map(count_rows, [parsed['path'] for parsed in counted]), strict=True):
+            parsed['rows'] = rows
+
+    df_files = pd.DataFrame(entries, columns=['file_name', 'prefix', 'var', 'start', 'end', 'size', 'rows'])
+    df_files['rows'] = df_files['rows'].astype(np.int64)
+    df_files['expected_rows'] = _expected_rows(df_files)
+    df_files['complete'] = df_files['rows'] >= df_files['expected_rows']
+    df_files['prefix'] = df_files['prefix'].astype('category')
+    df_files['var'] = df_files['var'].astype('category')
+    return df_files.sort_values(['prefix', 'var', 'start'], ignore_index=True)
+
+
+@dataclass
+class CompletenessReport:
+    """Completeness of a cache folder for a download plan.
+
+    Attributes:
+        files (pd.DataFrame): One row per planned file, see scan_cache, with rows 0 for missing files and columns
+            url, cached and complete.
+        missing (list[URLFilenamePair]): Planned files not in the cache.
+        partial (list[URLFilenamePair]): Cached files with fewer rows than hours in the period.
+        folder_path (Path | None): The cache folder.
+    """
+    files: pd.DataFrame
+    missing: list[URLFilenamePair]
+    partial: list[URLFilenamePair]
+    folder_path: Path | None = None
+
+    @property
+    def is_complete(self) -> bool:
+        """True if no files are missing or partial."""
+        return not self.missing and not self.partial
+
+    def redownload_plan(self) -> list[URLFilenamePair]:
+        """Minimal list of URLFilenamePairs to download to complete the cache.
+
+        Partial files must be deleted with delete_partial before downloading again, as existing files are not
+        downloaded.
+        """
+        return self.missing + self.partial
+
+    def delete_partial(self) -> int:
+        """Delete the partial files from the cache folder and forget their validators, so they are downloaded again.
+
+        Returns:
+            int: Number of files deleted.
+
+        Raises:
+            ValueError: If the report has no cache folder.
+        """
+        if self.folder_path is None:
+            raise ValueError('The report has no cache folder, use check_completeness.')
+        storage = LocalStorage(self.folder_path)
+        manifest = CacheManifest(self.folder_path) if (self.folder_path / _MANIFEST_NAME).is_file() else None
+        deleted = 0
+        for _url, file_name in self.partial:
+            cached = storage.cached_name(file_name)
+            if cached is not None:
+                storage.delete(cached)
+                deleted += 1
+            if manifest is not None:
+                manifest.remove(file_name)
+        logger.info(f'Deleted {deleted} partial files from <{self.folder_path}>.')
+        return deleted
+
+    def coverage(self) -> tuple[np.ndarray, pd.Index, pd.Index, pd.DatetimeIndex]:
+        """Bitmap of complete hourly coverage by node (file prefix), variable and hour.
+
+        Hours of partial files are not counted as covered.
+
+        Returns:
+            tuple: (bitmap, nodes, variables, hours), bitmap is a np.packbits packed uint8 array of shape
+            (len(nodes), len(variables), ceil(len(hours) / 8)),
+            unpack with np.unpackbits(bitmap, axis=2, count=len(hours)).
+        """
+        nodes = pd.Index(self.files['prefix'].cat.categories)
+        variables = pd.Index(self.files['var'].cat.categories)
+        if self.files.empty:
+            return np.zeros((len(nodes), len(variables), 0), dtype=np.uint8), nodes, variables, pd.DatetimeIndex([])
+        hours = pd.date_range(self.files['start'].min(), self.files['end'].max(), freq='h')
+        covered = np.zeros((len(nodes), len(variables), len(hours)), dtype=bool)
+        complete = self.files[self.files['complete']]
+        node_index = nodes.get_indexer(pd.Index(complete['prefix']))
+        var_index = variables.get_indexer(pd.Index(complete['var']))
+        start = hours.get_indexer(pd.Index(complete['start']))
+        end = hours.get_indexer(pd.Index(complete['end'])) + 1
+        for node, var, first, last in zip(node_index, var_index, start, end, strict=True):
+            covered[node, var, first:last] = True
+        return np.packbits(covered, axis=2), nodes, variables, hours
+
+    def summary(self) -> pd.DataFrame:
+        """Number of planned, missing, partial and complete files and missing hours by node and variable."""
+        files = self.files.assign(
+            missing=~self.files['cached'],
+            partial=self.files['cached'] & ~self.files['complete'],
+            missing_hours=(self.files['expected_rows'] - self.files['rows']).clip(lower=0),
+        )
+        return files.groupby(['prefix', 'var'], observed=True).agg(
+            planned=('file_name', 'size'),
+            missing=('missing', 'sum'),
+            partial=('partial', 'sum'),
+            complete=('complete', 'sum'),
+            missing_hours=('missing_hours', 'sum'),
+        )
+
+
+def check_completeness(
+    urlfilenames: Iterable[URLFilenamePair],
+    folder_path: str | Path,
+    max_workers: int = 8,
+) -> CompletenessReport:
+    """Check a cache folder against a download plan, reading only file metadata and row counts.
+
+    Args:
+        urlfilenames (Iterable[URLFilenamePair]): The download plan, e.g. from point_data_urlfilenames.
+        folder_path (str | Path): Cache folder.
+        max_workers (int): Number of threads used to count rows.
+
+    Returns:
+        CompletenessReport: Missing and partial files and the re-download plan.
+    """
+    df_plan = pd.DataFrame(list(urlfilenames), columns=['url', 'file_name'])
+    parsed = [parse_filename(file_name) or {} for file_name in df_plan['file_name']]
+    df_plan = df_plan.join(pd.DataFrame(parsed, columns=['prefix', 'var', 'start', 'end']))
+
+    df_cached = scan_cache(folder_path, max_workers=max_workers)[['file_name', 'size', 'rows']]
+    df_files = df_plan.merge(df_cached, on='file_name', how='left', indicator='cached')
+    df_files['cached'] = df_files['cached'] == 'both'
+    df_files['size'] = df_files['size'].fillna(0).astype(np.int64)
+    df_files['rows'] = df_files['rows'].fillna(0).astype(np.int64)
+    df_files['expected_rows'] = _expected_rows(df_files)
+    df_files['complete'] = df_files['cached'] & (df_files['rows'] >= df_files['expected_rows'])
+    df_files['prefix'] = df_files['prefix'].astype('category')
+    df_files['var'] = df_files['var'].astype('category')
+
+    pairs = list(zip(df_files['url'], df_files['file_name'], strict=True))
+    missing = [pair for pair, cached in zip(pairs, df_files['cached'], strict=True) if not cached]
+    partial = [pair for pair, cached, complete in zip(pairs, df_files['cached'], df_files['complete'], strict=True)
+               if cached and not complete]
+    if missing or partial:
+        logger.warning(f'Cache <{folder_path}> has {len(missing)} missing and {len(partial)} partial files.')
+    return CompletenessReport(df_files, missing, partial, Path(folder_path))
+
+
+def fingerprint_files(
+    paths: Iterable[str | Path],
+    *parts: object,
+) -> str:
+    """Fingerprint a set of files from their names, sizes and modification times, without reading them.
+
+    Args:
+        paths (Iterable[str | Path]): The files.
+        *parts (object): Optional further values included in the fingerprint, e.g. parameters of a derived frame.
+
+    Returns:
+        str: Hex digest that changes if a file is added, removed or rewritten, or parts change.
+    """
+    digest = hashlib.sha1(usedforsecurity=False)
+    for path in sorted(Path(path) for path in paths):
+        stat = path.stat()
+        digest.update(f'{path.name}|{stat.st_size}|{stat.st_mtime_ns}\n'.encode())
+    for part in parts:
+        digest.update(f'{part!r}\n'.encode())
+    return digest.hexdigest()[:20]
+
+
+class FrameCache:
+    """Folder of pickled DataFrames keyed by fingerprint, keeping attrs.
+
+    Frames can be stored in a group, e.g. the frames of a source file with given options, whose key changes when the
+    file is rewritten. Storing a frame deletes the frames stored before in its group, so superseded frames do not
+    accumulate.
+
+    Attributes:
+        folder_path (Path): Folder of the cached frames, created on the first put.
+    """
+
+    def __init__(self, folder_path: str | Path):
+        """Create a cache in folder_path."""
+        self.folder_path = Path(folder_path)
+
+    def _path(self, key: str, group: str | None = None) -> Path:
+        return self.folder_path / (f'{group}-{key}.pkl' if group is not None else f'{key}.pkl')
+
+    def get(
+        self,
+        key: str,
+        group: str | None = None,
+    ) -> pd.DataFrame | None:
+        """Cached frame for key in group, or None if not cached."""
+        path = self._path(key, group)
+        if not path.exists():
+            return None
+        logger.debug(f'Cache hit <{path}>')
+        df: pd.DataFrame = pd.read_pickle(path)
+        return df
+
+    def put(
+        self,
+        key: str,
+        df: pd.DataFrame,
+        group: str | None = None,
+    ) -> None:
+        """Store a frame for key, replacing the file atomically so readers never see a partial file.
+
+        Args:
+            key (str): Key of the frame, e.g. from fingerprint_files.
+            df (pd.DataFrame): The frame.
+            group (str | None): Optional group of the frame, other frames of the group are deleted as superseded.
+        """
+        self.folder_path.mkdir(parents=True, exist_ok=True)
+        path = self._path(key, group)
+        partial = path.with_suffix(f'.{os.getpid()}.tmp')
+        df.to_pickle(partial)
+        os.replace(partial, path)
+        if group is not None:
+            for superseded in self.folder_path.glob(f'{group}-*.pkl'):
+                if superseded != path:
+                    logger.debug(f'Evicting superseded <{superseded}>')
+                    superseded.unlink(missing_ok=True)
+
+    def clear(self) -> int:
+        """Delete all cached frames.
+
+        Returns:
+            int: Number of frames deleted.
+        """
+        paths = list(self.folder_path.glob('*.pkl')) if self.folder_path.exists() else []
+        for path in paths:
+            path.unlink()
+        return len(paths)
@@ -0,0 +1,481 @@
+"""This module contains the barra2-dl command line interface.
+
+Runs the plan, download, merge and convert chain for each site in a TOML or YAML job file, e.g.::
+
+    dataset = "AUS-11"
+    variables = ["ua50m", "va50m", "ta50m"]
+    start = "2023-01-01T00:00:00"
+    end = "2023-03-31T23:00:00"
+    cache_dir = "cache"
+    compression = "gzip"
+    output_dir = "output"
+    formats = ["csv"]
+    workers = 4
+    rate_limit = 5.0
+    compact = true
+    float32 = true
+    resample = ["D", "MS"]
+
+    [[sites]]
+    name = "demo"
+    latitude = -23.5527472
+    longitude = 133.3961111
+
+Usage::
+
+    barra2-dl run job.toml [--dry-run] [--probe] [--workers N] [--adaptive] [--rate-limit R] [--serial] [--shard I/N]
+        [--refresh] [--offline] [--quiet]
+
+Offline usage, on hosts without network access, serves the plan from the cache and fails fast if files are missing::
+
+    barra2-dl run job.toml --offline
+
+Distributed usage, with the queue and cache_dir on storage shared by all workers::
+
+    barra2-dl enqueue job.toml --queue shared/queue.sqlite
+    barra2-dl work job.toml --queue shared/queue.sqlite      # on each worker process or host
+    barra2-dl merge job.toml --queue shared/queue.sqlite     # waits for the queue, then merges and converts
+"""
+import argparse
+import logging
+import sys
+import threading
+import tomllib
+from collections.abc import Sequence
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Any
+
+from barra2_dl import distribute, download, estimate, inventory
+from barra2_dl.compression import COMPRESSIONS, plain_name
+from barra2_dl.globals import BARRA2_INDEX, BARRA2_URLS, BARRA2_VAR_WIND_DEFAULT
+from barra2_dl.instrument import DownloadEvent, Event
+from barra2_dl.mapping import Latitude, LatLonPoint, Longitude
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'Site',
+    'Job',
+    'load_job',
+    'main',
+]
+
+_OUTPUT_FORMATS = ('csv', 'parquet', 'dataset')
+
+
+@dataclass
+class Site:
+    """Download location.
+
+    Attributes:
+        name (str): Site name, used as the fileout_prefix.
+        latitude (float): Site latitude.
+        longitude (float): Site longitude.
+    """
+    name: str
+    latitude: float
+    longitude: float
+
+    def __post_init__(self) -> None:
+        """Check latitude and longitude limits."""
+        point = LatLonPoint(Latitude(self.latitude), Longitude(self.longitude))
+        self.latitude, self.longitude = point.lat, point.lon
+
+
+@dataclass
+class Job:
+    """Bulk download job read from a job file.
+
+    Attributes:
+        sites (list[Site]): Download locations.
+        dataset (str): BARRA2 dataset, 'AUS-11' or 'AUST-04'.
+        variables (list[str]): BARRA2 variables to download.
+        start (str): Start of inclusive download period.
+        end (str): End of inclusive download period.
+        cache_dir (str): Folder for downloaded files.
+        compression (str | None): Store downloaded files compressed, 'gzip' or 'zstd', see barra2_dl.compression.
+        output_dir (str): Folder for merged and converted outputs.
+        formats (list[str]): Output file formats, 'csv' and/or 'parquet' per site, and 'dataset' for a Parquet
+            dataset of all sites partitioned by site and year. Empty to skip merge and convert.
+        workers (int | None): Number of download threads. Defaults to the number of cpus - 1.
+        adaptive (bool): Adapt the number of requests in flight from 1 up to workers to the server latency and
+            throttling, see download.AdaptiveConcurrency.
+        rate_limit (float | None): Optional maximum number of requests per second.
+        compact (bool): Merge to a compact frame indexed by time to reduce memory, see merge.compact_barra2_frame.
+        float32 (bool): Store variables as float32 in the compact frame.
+        memoise (bool): Memoise merges and resampled chunks in cache_dir/_merged and cache_dir/_resampled, so
+            outputs of an unchanged cache are written without parsing the csv files again. Memoised frames are
+            pickles that are never evicted, so only enable this for a cache_dir you trust, and clear them with
+            cache.FrameCache.clear.
+        resample (list[str]): Pandas frequencies of additional resampled outputs, e.g. '10min', 'D' or 'MS',
+            see resample.resample_files.
+    """
+    sites: list[Site]
+    start: str
+    end: str
+    dataset: str = 'AUS-11'
+    variables: list[str] = field(default_factory=lambda: list(BARRA2_VAR_WIND_DEFAULT))
+    cache_dir: str = 'cache'
+    compression: str | None = None
+    output_dir: str = 'output'
+    formats: list[str] = field(default_factory=lambda: ['csv'])
+    workers: int | None = None
+    adaptive: bool = False
+    rate_limit: float | None = None
+    compact: bool = False
+    float32: bool = False
+    memoise: bool = False
+    resample: list[str] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        """Validate dataset, formats and compression."""
+        # TOML parses unquoted dates as datetime
+        self.start, self.end = str(self.start), str(self.end)
+        if self.dataset not in BARRA2_URLS:
+            raise ValueError(f'Unknown dataset <{self.dataset}>, use one of {list(BARRA2_URLS)}.')
+        unsupported = set(self.formats) - set(_OUTPUT_FORMATS)
+        if unsupported:
+            raise ValueError(f'Unsupported output formats {sorted(unsupported)}, use {list(_OUTPUT_FORMATS)}.')
+        if self.compression is not None and self.compression not in COMPRESSIONS:
+            raise ValueError(f'Unsupported compression <{self.compression}>, use one of {list(COMPRESSIONS)}.')
+        if not self.sites:
+            raise ValueError('Job must contain at least one site.')
+
+    @classmethod
+    def from_dict(cls, config: dict[str, Any]) -> 'Job':
+        """Create a job from a parsed job file.
+
+        Args:
+            config (dict[str, Any]): Job settings.
+
+        Returns:
+            Job: The job.
+
+        Raises:
+            ValueError: If the settings contain unknown keys or are invalid.
+        """
+        known = {job_field.name for job_field in fields(cls)}
+        unknown = set(config) - known
+        if unknown:
+            raise ValueError(f'Unknown job settings {sorted(unknown)}.')
+        config = dict(config)
+        config['sites'] = [Site(**site) for site in config.get('sites', [])]
+        return cls(**config)
+
+    def urlfilenames(self, site: Site) -> list[download.URLFilenamePair]:
+        """Download plan for a site."""
+        return download.point_data_urlfilenames(
+            barra2_url=BARRA2_URLS[self.dataset],
+            barra2_vars=self.variables,
+            latitude=site.latitude,
+            longitude=site.longitude,
+            start_datetime=self.start,
+            end_datetime=self.end,
+            fileout_prefix=site.name,
+        )
+
+
+def load_job(
+    path: str | Path,
+) -> Job:
+    """Load a job from a TOML or YAML file.
+
+    Args:
+        path (str | Path): Job file ending in .toml, .yaml or .yml.
+
+    Returns:
+        Job: The job.
+
+    Raises:
+        ValueError: If the file type is not supported.
+        ImportError: If a YAML file is used and PyYAML is not installed.
+    """
+    path = Path(path)
+    match path.suffix.lower():
+        case '.toml':
+            with path.open('rb') as file:
+                config = tomllib.load(file)
+        case '.yaml' | '.yml':
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('PyYAML is required to read YAML job files, use a TOML job file.') from None
+            config = yaml.safe_load(path.read_text())
+        case _:
+            raise ValueError(f'Unsupported job file type <{path.suffix}>, use .toml or .yaml.')
+    return Job.from_dict(config)
+
+
+class _Progress:
+    """Event callback writing downloads as [done/total] progress lines."""
+
+    def __init__(self, total: int, quiet: bool = False):
+        self.total = total
+        self.done = 0
+        self.quiet = quiet
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Event) -> None:
+        if not isinstance(event, DownloadEvent):
+            return
+        with self._lock:
+            self.done += 1
+            if not self.quiet:
+                sys.stdout.write(f'[{self.done}/{self.total}] {event.message()}\n')
+
+
+def _parse_shard(
+    value: str,
+) -> tuple[int, int]:
+    """Parse a shard argument I/N into (shard_index, num_shards)."""
+    try:
+        shard_index, num_shards = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Shard must be I/N, e.g. 0/4, got <{value}>.') from None
+    return shard_index, num_shards
+
+
+def _job_urlfilenames(
+    job: Job,
+) -> download.PointDataPlan:
+    """Lazy download plan for all sites in a job."""
+    return download.PointDataPlan(
+        barra2_url=BARRA2_URLS[job.dataset],
+        barra2_vars=job.variables,
+        latitude=[site.latitude for site in job.sites],
+        longitude=[site.longitude for site in job.sites],
+        start_datetime=job.start,
+        end_datetime=job.end,
+        fileout_prefix=[site.name for site in job.sites],
+    )
+
+
+def _download(
+    job: Job,
+    urlfilenames: Sequence[download.URLFilenamePair],
+    serial: bool,
+    quiet: bool,
+    refresh: bool = False,
+) -> None:
+    """Download a plan with progress output."""
+    progress = _Progress(len(urlfilenames), quiet)
+    if serial:
+        download.download_serial(urlfilenames, job.cache_dir, callback=progress, quiet=True,
+                                 rate_limit=job.rate_limit, refresh=refresh, compression=job.compression)
+    else:
+        concurrency = None
+        if job.adaptive:
+            concurrency = download.AdaptiveConcurrency(ceiling=job.workers or 1, callback=progress, quiet=quiet)
+        download.download_multithread(urlfilenames, job.cache_dir, callback=progress, quiet=True,
+                                      max_workers=job.workers, rate_limit=job.rate_limit, concurrency=concurrency,
+                                      refresh=refresh, compression=job.compression)
+
+
+def _site_files(
+    job: Job,
+    cache: inventory.CacheInventory,
+    site: Site,
+) -> list[Path]:
+    """Cached files of the plan of a site in filename order, skipping planned files that are not cached."""
+    paths = (cache.path(file_name) for _url, file_name in job.urlfilenames(site))
+    return sorted((path for path in paths if path is not None), key=lambda path: plain_name(path.name))
+
+
+def _write_outputs(
+    job: Job,
+    site: Site,
+    files: list[Path],
+    quiet: bool,
+) -> None:
+    """Merge and convert the cached files of a single site and write the outputs."""
+    from barra2_dl import convert, merge, resample
+
+    formats = [fmt for fmt in job.formats if fmt != 'dataset']
+    if not formats:
+        return
+    df_merged = merge.merge_files_to_df(files, BARRA2_INDEX, quiet=quiet, compact=job.compact, float32=job.float32,
+                                        cache_dir=Path(job.cache_dir) / '_merged' if job.memoise else None)
+    df_converted = convert.convert_wind_components(df_merged, quiet=quiet)
+    period = f"{job.start[:10].replace('-', '')}_{job.end[:10].replace('-', '')}"  # e.g. 20230101_20230331
+    outputs = [('merged', df_merged, job.compact), ('converted', df_converted, job.compact)]
+    for freq in job.resample:
+        df_resampled = resample.resample_files(
+            files, freq, cache_dir=Path(job.cache_dir) / '_resampled' if job.memoise else None, quiet=quiet,
+        )
+        outputs.append((f'converted_{freq}', df_resampled, True))
+    for fmt in formats:
+        for label, df, index in outputs:
+            path = Path(job.output_dir) / f'{site.name}_{label}_{period}.{fmt}'
+            if fmt == 'csv':
+                df.to_csv(path, index=index)
+            else:
+                df.to_parquet(path, index=index)
+            logger.info(f'Wrote <{path}>')
+
+
+def _write_all_outputs(
+    job: Job,
+    quiet: bool,
+) -> None:
+    """Write the outputs of each site, then the dataset of all sites."""
+    from barra2_dl import panel
+
+    Path(job.output_dir).mkdir(parents=True, exist_ok=True)
+    cache = inventory.CacheInventory.scan(job.cache_dir)
+    files = {site.name: _site_files(job, cache, site) for site in job.sites}
+    for site in job.sites:
+        _write_outputs(job, site, files[site.name], quiet)
+    if 'dataset' in job.formats:
+        # only the planned files of each site, not other months or sites sharing its prefix
+        path = panel.write_panel_parquet_files(files, Path(job.output_dir) / 'dataset', float32=job.float32,
+                                               quiet=quiet)
+        logger.info(f'Wrote <{path}>')
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='barra2-dl', description='Bulk download BARRA2 point data.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='Run the plan, download, merge and convert chain for a job file.')
+    run.add_argument('job_file', type=Path, help='TOML or YAML job file.')
+    run.add_argument('--dry-run', action='store_true', help='Print the request plan and estimated bytes only.')
+    run.add_argument('--probe', action='store_true',
+                     help='Download one file per variable first to estimate bytes, time and workers.')
+    run.add_argument('--workers', type=int, help='Number of download threads, overrides the job file.')
+    run.add_argument('--adaptive', action='store_true',
+                     help='Adapt the requests in flight, up to the workers, to server latency and throttling.')
+    run.add_argument('--rate-limit', type=float, help='Maximum requests per second, overrides the job file.')
+    run.add_argument('--serial', action='store_true', help='Download serially in a single thread.')
+    run.add_argument('--shard', type=_parse_shard, metavar='I/N',
+                     help='Only download shard I of N, outputs are then written with the merge command.')
+    run.add_argument('--refresh', action='store_true',
+                     help='Revalidate cached files with conditional requests and download only revised files.')
+    run.add_argument('--offline', action='store_true',
+                     help='Serve the plan from the cache without network access, failing if any file is missing.')
+    run.add_argument('--quiet', action='store_true', help='Do not write progress to stdout.')
+
+    enqueue = subparsers.add_parser('enqueue', help='Add the job download plan to a shared work queue.')
+    enqueue.add_argument('job_file', type=Path, help='TOML or YAML job file.')
+    enqueue.add_argument('--queue', type=Path, required=True, help='SQLite work queue on shared storage.')
+
+    work = subparsers.add_parser('work', help='Download tasks from a shared work queue until it is empty.')
+    work.add_argument('job_file', type=Path, help='TOML or YAML job file.')
+    work.add_argument('--queue', type=Path, required=True, help='SQLite work queue on shared storage.')
+    work.add_argument('--worker-id', help='Unique worker name, defaults to hostname-pid.')
+    work.add_argument('--batch-size', type=int, default=10, help='Number of tasks leased at a time.')
+    work.add_argument('--lease-seconds', type=float, default=600.0, help='Seconds until a lease expires.')
+    work.add_argument('--rate-limit', type=float, help='Maximum requests per second, overrides the job file.')
+    work.add_argument('--quiet', action='store_true', help='Do not write progress to stdout.')
+
+    merge_outputs = subparsers.add_parser('merge', help='Merge and convert the cached files of each site.')
+    merge_outputs.add_argument('job_file', type=Path, help='TOML or YAML job file.')
+    merge_outputs.add_argument('--queue', type=Path, help='Wait for this work queue to complete first.')
+    merge_outputs.add_argument('--poll-seconds', type=float, default=10.0, help='Seconds between queue checks.')
+    merge_outputs.add_argument('--offline', action='store_true',
+                               help='Check the plan is in the cache first, failing if any file is missing.')
+    merge_outputs.add_argument('--quiet', action='store_true', help='Do not write progress to stdout.')
+    return parser
+
+
+def _run(args: argparse.Namespace) -> int:
+    job = load_job(args.job_file)
+    if args.workers is not None:
+        job.workers = args.workers
+    if args.rate_limit is not None:
+        job.rate_limit = args.rate_limit
+    if args.adaptive:
+        job.adaptive = True
+    if args.offline and args.probe:
+        raise ValueError('--probe downloads sample files, it cannot be used with --offline.')
+
+    urlfilenames: Sequence[download.URLFilenamePair] = _job_urlfilenames(job)
+    if args.shard is not None:
+        urlfilenames = distribute.shard_urlfilenames(urlfilenames, args.shard[1], args.shard[0])
+
+    model = None
+    if args.probe:
+        Path(job.cache_dir).mkdir(parents=True, exist_ok=True)
+        model = estimate.probe_plan(urlfilenames, job.cache_dir)
+    plan_estimate = estimate.estimate_plan(urlfilenames, model, job.workers, job.rate_limit)
+
+    if args.dry_run:
+        for url, filename in urlfilenames:
+            sys.stdout.write(f'{filename} {url}\n')
+        sys.stdout.write(plan_estimate.summary() + '\n')
+        return 0
+
+    job.workers = plan_estimate.workers
+    if args.offline:
+        inventory.download_offline(urlfilenames, job.cache_dir, callback=_Progress(len(urlfilenames), args.quiet),
+                                   quiet=True)
+    else:
+        Path(job.cache_dir).mkdir(parents=True, exist_ok=True)
+        _download(job, urlfilenames, args.serial, args.quiet, args.refresh)
+    if args.shard is None or args.shard[1] == 1:
+        _write_all_outputs(job, args.quiet)
+    return 0
+
+
+def _enqueue(args: argparse.Namespace) -> int:
+    job = load_job(args.job_file)
+    added = distribute.WorkQueue(args.queue).add(_job_urlfilenames(job))
+    sys.stdout.write(f'Added {added} tasks to <{args.queue}>\n')
+    return 0
+
+
+def _work(args: argparse.Namespace) -> int:
+    job = load_job(args.job_file)
+    Path(job.cache_dir).mkdir(parents=True, exist_ok=True)
+    rate_limit = args.rate_limit if args.rate_limit is not None else job.rate_limit
+    distribute.run_worker(args.queue, job.cache_dir, worker_id=args.worker_id, batch_size=args.batch_size,
+                          lease_seconds=args.lease_seconds, rate_limit=rate_limit, quiet=args.quiet,
+                          compression=job.compression)
+    return 0
+
+
+def _merge(args: argparse.Namespace) -> int:
+    job = load_job(args.job_file)
+    if args.queue is not None:
+        counts = distribute.wait_until_complete(args.queue, poll_seconds=args.poll_seconds)
+        if counts['failed']:
+            logger.warning(f'{counts["failed"]} tasks failed in <{args.queue}>')
+            sys.stderr.write(f'barra2-dl: warning: {counts["failed"]} tasks failed, outputs are incomplete.\n')
+    if args.offline:
+        inventory.CacheInventory.scan(job.cache_dir).resolve(_job_urlfilenames(job))
+    _write_all_outputs(job, args.quiet)
+    return 0
+
+
+def main(
+    argv: list[str] | None = None,
+) -> int:
+    """Entry point for the barra2-dl console script.
+
+    Args:
+        argv (list[str] | None): Command line arguments, defaults to sys.argv.
+
+    Returns:
+        int: Exit code.
+    """
+    args = _build_parser().parse_args(argv)
+    try:
+        match args.command:
+            case 'run':
+                return _run(args)
+            case 'enqueue':
+                return _enqueue(args)
+            case 'work':
+                return _work(args)
+            case 'merge':
+                return _merge(args)
+    except (ValueError, FileNotFoundError, ImportError) as error:
+        logger.error(error)
+        sys.stderr.write(f'barra2-dl: error: {error}\n')
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""This module contains the barra2 compressed cache function(s).
+
+Thredds csv point data is very repetitive, every row repeats the station, latitude and longitude and a long ISO
+timestamp, so it compresses several fold. Downloads can be stored compressed at rest as gzip, or zstd which requires
+the zstandard package, by appending .gz or .zst to the planned file name, e.g. demo_ua50m_20230101_20230131.csv.gz.
+Cached files are found by their planned name in either form, and read directly by pandas and the cache functions.
+"""
+import gzip
+import importlib
+import io
+import logging
+from pathlib import Path
+from types import ModuleType
+from typing import BinaryIO, cast
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'COMPRESSIONS',
+    'compress_bytes',
+    'open_cached',
+    'plain_name',
+    'cached_path',
+    'cached_files',
+]
+
+# file name suffix of each supported compression
+COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+_GZIP_LEVEL = 6
+_ZSTD_LEVEL = 10
+
+
+def _optional_import(
+    module: str,
+    extra: str,
+    purpose: str,
+) -> ModuleType:
+    """Import a module of an optional dependency, failing with the extra that installs it.
+
+    Args:
+        module (str): Module name, e.g. 'pyarrow.csv'.
+        extra (str): barra2-dl extra that installs the dependency, e.g. 'arrow'.
+        purpose (str): What the dependency is required for, in the error message.
+
+    Returns:
+        ModuleType: The module.
+
+    Raises:
+        ImportError: If the dependency is not installed, naming the extra.
+    """
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        package = module.partition('.')[0]
+        raise ImportError(f'{package} is required for {purpose}, install barra2-dl[{extra}].') from None
+
+
+def compress_bytes(
+    content: bytes,
+    compression: str | None,
+) -> bytes:
+    """Compress content for storage in the cache.
+
+    Args:
+        content (bytes): Uncompressed content.
+        compression (str | None): 'gzip', 'zstd' or None for uncompressed.
+
+    Returns:
+        bytes: The compressed content, or content if compression is None.
+
+    Raises:
+        ValueError: If the compression is not supported.
+        ImportError: If compression is 'zstd' and zstandard is not installed.
+
+    Example:
+        >>> gzip.decompress(compress_bytes(b'time,station', 'gzip'))
+        b'time,station'
+    """
+    match compression:
+        case None:
+            return content
+        case 'gzip':
+            # mtime=0 so the same content always gives the same bytes
+            return gzip.compress(content, compresslevel=_GZIP_LEVEL, mtime=0)
+        case 'zstd':
+            zstandard = _optional_import('zstandard', 'zstd', 'zstd compression')
+            compressed: bytes = zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(content)
+            return compressed
+        case _:
+            raise ValueError(f'Unsupported compression <{compression}>, use one of {list(COMPRESSIONS)} or None.')
+
+
+def open_cached(
+    path: str | Path,
+) -> BinaryIO:
+    """Open a cached file for reading its uncompressed bytes, by the compression suffix of its name.
+
+    Args:
+        path (str | Path): Path of the cached file.
+
+    Returns:
+        BinaryIO: Binary file object, supporting read and readline.
+    """
+    path = Path(path)
+    match path.suffix:
+        case '.gz':
+            return cast(BinaryIO, gzip.open(path, 'rb'))
+        case '.zst':
+            zstandard = _optional_import('zstandard', 'zstd', 'zstd compression')
+            return io.BufferedReader(zstandard.open(path, 'rb'))
+        case _:
+            return open(path, 'rb')
+
+
+def plain_name(
+    file_name: str,
+) -> str:
+    """Planned file name of a cached file, without a compression suffix.
+
+    Example:
+        >>> plain_name('demo_ua50m_20230101_20230131.csv.gz')
+        'demo_ua50m_20230101_20230131.csv'
+    """
+    for suffix in COMPRESSIONS.values():
+        if file_name.endswith(suffix):
+            return file_name.removesuffix(suffix)
+    return file_name
+
+
+def cached_path(
+    folder_path: str | Path,
+    file_name: str,
+) -> Path | None:
+    """Path of a planned file in the cache, uncompressed or compressed, or None if not cached."""
+    folder = Path(folder_path)
+    for suffix in ('', *COMPRESSIONS.values()):
+        path = folder / f'{file_name}{suffix}'
+        if path.exists():
+            return path
+    return None
+
+
+def cached_files(
+    folder_path: str | Path,
+    filename_pattern: str = '*.csv',
+) -> list[Path]:
+    """Cached files whose planned name matches filename_pattern, uncompressed or compressed.
+
+    A file cached in more than one form is returned once, preferring the uncompressed file.
+
+    Args:
+        folder_path (str | Path): Cache folder.
+        filename_pattern (str): Filename matching pattern of the planned names, e.g. 'demo_*.csv'.
+
+    Returns:
+        list[Path]: The cached files sorted by planned name.
+    """
+    folder = Path(folder_path)
+    paths = {path for suffix in ('', *COMPRESSIONS.values()) for path in folder.glob(f'{filename_pattern}{suffix}')}
+    files: dict[str, Path] = {}
+    for path in sorted(paths, key=lambda path: (plain_name(path.name), len(path.name))):
+        files.setdefault(plain_name(path.name), path)
+    return list(files.values())
@@ -1,13 +1,20 @@
-"""This module contains the barra2 convert function(s)."""
+"""This module contains the barra2 convert function(s).
+
+Wind components are converted to speed and direction on NumPy arrays, either the columns of a DataFrame or the
+buffers of a pyarrow Table, which requires pyarrow, so Arrow data is converted without building a DataFrame.
+"""
 
 import logging
-import sys
-from typing import List
+from typing import TYPE_CHECKING, List
 
 import numpy as np
 import pandas as pd
 
 from barra2_dl.globals import BARRA2_WIND_VARS
+from barra2_dl.instrument import EventCallback, stage
+
+if TYPE_CHECKING:
+    import pyarrow as pa
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -18,6 +25,7 @@ __all__ = [
     'calculate_wind_direction',
     'wind_components_to_direction',
     'convert_wind_components',
+    'convert_wind_table',
 ]
 
 
@@ -115,13 +123,47 @@ def wind_components_to_direction(
         raise ValueError('Both arguments must be either both float/int or both lists of float/int.')
 
 
+def _wind_columns(
+    columns: list[str],
+) -> list[tuple[str, str, str]]:
+    """The ua and va column of each height in columns, with the height, e.g. '50m'."""
+    pairs = []
+    for ua_var, va_var, _label in BARRA2_WIND_VARS:
+        ua_columns = [column for column in columns if ua_var in column]
+        va_columns = [column for column in columns if va_var in column]
+        if ua_columns and va_columns:
+            pairs.append((ua_columns[0], va_columns[0], ua_var[2:]))
+    return pairs
+
+
+def _speed_direction(
+    ua: np.ndarray,
+    va: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Wind speed and meteorological direction, vectorised equivalent of wind_components_to_speed and direction."""
+    phi_met = np.mod(180 + np.rad2deg(np.arctan2(ua, va)), 360)
+    phi_met[(ua == 0) & (va == 0)] = 0
+    return np.hypot(ua, va), phi_met
+
+
+def _converted_names(
+    height: str,
+) -> tuple[str, str]:
+    """Speed and direction column names of a height."""
+    return 'v' + height + '[unit="m s-1"]', 'v' + height + '_' + 'phi_met[unit="degrees"]'
+
+
 def convert_wind_components(
     df_merged: pd.DataFrame,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
 ) -> pd.DataFrame:
     """Converts columns of wind components ua* and va* to v and phi.
 
     Args:
         df_merged: Dataframe with wind data ua and va columns to convert to v and phi
+        callback (EventCallback | None): Optional callable receiving a StageEvent for each converted height.
+        quiet (bool): If True nothing is written to stdout.
 
     Returns:
         Dataframe: With additional converted columns
@@ -133,40 +175,66 @@ def convert_wind_components(
         Add checks for ua and va components
         Update function as following leverages global variables
     """
-    # loop through all possible wind components
-    df_processed = df_merged
+    # loop through all possible wind components and collect the new columns for a single concat
+    converted = {}
+
+    for ua_column, va_column, height in _wind_columns(list(df_merged.columns)):
+        detail = 'Converted: ' + ua_column + ', ' + va_column
+        with stage('convert', detail=detail, callback=callback, quiet=quiet) as convert_stage:
+            convert_stage.rows = len(df_merged)
+            speed, direction = _speed_direction(df_merged[ua_column].to_numpy(), df_merged[va_column].to_numpy())
+            speed_column, direction_column = _converted_names(height)
+            converted[speed_column] = speed
+            converted[direction_column] = direction
 
-    for tup in BARRA2_WIND_VARS:
-        mask_wind_speed_h = tup[0][2:]
-        mask_ua = df_merged.columns.str.contains(tup[0])  # select the ua column header
-        mask_va = df_merged.columns.str.contains(tup[1])  # select the va column header
-
-        if np.any(mask_ua == True) and np.any(mask_va == True):
-            # create temporary dataframe for ua and va using the mask
-            df_merged_ua = df_merged.loc[:, mask_ua]
-            df_merged_va = df_merged.loc[:, mask_va]
+    # todo check if df_processed was updated
+    # if df_processed == df_merged:
+    #     raise ValueError('No ua or va values in the dataframe to convert.')
 
+    # Merge the converted columns with the merged DataFrame, retaining its index
+    df_processed = pd.concat([df_merged, pd.DataFrame(converted, index=df_merged.index)], axis=1)
+    df_processed.attrs = dict(df_merged.attrs)
 
-            df_processed_v = pd.DataFrame(
-                wind_components_to_speed(df_merged_ua.iloc[:, 0].tolist(), df_merged_va.iloc[:, 0].tolist()),
-                columns=['v' + mask_wind_speed_h + '[unit="m s-1"]'],
-            )
+    return df_processed
 
-            # instantiate a temp dataframe for the phi value
-            df_processed_phi_met = pd.DataFrame(
-                wind_components_to_direction(df_merged_ua.iloc[:, 0].tolist(), df_merged_va.iloc[:, 0].tolist()),
-                columns=['v' + mask_wind_speed_h + '_' + 'phi_met[unit="degrees"]'],
-            )
 
-            # Merge the current variable DataFrame with the combined DataFrame
-            df_processed = df_processed.join(df_processed_v)
-            df_processed = df_processed.join(df_processed_phi_met)
+def convert_wind_table(
+    table: 'pa.Table',
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+) -> 'pa.Table':
+    """Converts columns of wind components ua* and va* of a pyarrow Table to v and phi, see convert_wind_components.
 
-            sys.stdout.write('Converted: ' + df_merged_ua.columns.values[0] + ', ' + df_merged_va.columns.values[0])
-            sys.stdout.write('\n')
+    Each record batch is converted through NumPy views of its buffers, copied only where a column has nulls, and the
+    converted columns are appended as chunks of the same lengths, so the Table is never converted to pandas.
 
-    # todo check if df_processed was updated
-    # if df_processed == df_merged:
-    #     raise ValueError('No ua or va values in the dataframe to convert.')
+    Args:
+        table (pa.Table): Table with wind data ua and va columns, e.g. from merge.merge_csvs_to_table.
+        callback (EventCallback | None): Optional callable receiving a StageEvent for each converted height.
+        quiet (bool): If True nothing is written to stdout.
 
-    return df_processed
+    Returns:
+        pa.Table: With additional converted columns, null where either component is null.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    batches = table.to_batches()
+    for ua_column, va_column, height in _wind_columns(table.column_names):
+        detail = 'Converted: ' + ua_column + ', ' + va_column
+        with stage('convert', detail=detail, callback=callback, quiet=quiet) as convert_stage:
+            convert_stage.rows = table.num_rows
+            speed_chunks, direction_chunks = [], []
+            for batch in batches:
+                ua, va = batch.column(ua_column), batch.column(va_column)
+                nulls = pc.or_(ua.is_null(), va.is_null()).to_numpy(zero_copy_only=False) if (
+                    ua.null_count or va.null_count) else None
+                speed, direction = _speed_direction(ua.to_numpy(zero_copy_only=False),
+                                                    va.to_numpy(zero_copy_only=False))
+                speed_chunks.append(pa.array(speed, mask=nulls))
+                direction_chunks.append(pa.array(direction, mask=nulls))
+            speed_column, direction_column = _converted_names(height)
+            value_type = table.schema.field(ua_column).type
+            table = table.append_column(speed_column, pa.chunked_array(speed_chunks, value_type))
+            table = table.append_column(direction_column, pa.chunked_array(direction_chunks, value_type))
+    return table
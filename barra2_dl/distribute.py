@@ -0,0 +1,307 @@
+"""This module contains the barra2 distributed download classes and function(s).
+
+Large download plans can be split into deterministic shards with shard_urlfilenames, or shared between worker
+processes on one or more hosts through a WorkQueue, an SQLite database on shared storage. Workers lease a batch of
+tasks at a time, and leases of crashed workers expire so their tasks are picked up again by other workers. Once the
+queue is complete, wait_until_complete returns and the cache folder can be merged with barra2_dl.merge.
+"""
+import logging
+import os
+import socket
+import sqlite3
+import time
+import zlib
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from barra2_dl.download import URLFilenamePair, _download_file, _open_manifest, _RateLimiter
+from barra2_dl.instrument import EventCallback
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'shard_urlfilenames',
+    'WorkQueue',
+    'run_worker',
+    'wait_until_complete',
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    file_name TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_expires);
+"""
+
+
+def shard_urlfilenames(
+    urlfilenames: Iterable[URLFilenamePair],
+    num_shards: int,
+    shard_index: int,
+) -> list[URLFilenamePair]:
+    """Select the deterministic shard of a download plan for shard_index of num_shards.
+
+    Files are assigned by a stable hash of the filename, so every process or host computes the same shards
+    independently of the order of the plan and without duplicate downloads.
+
+    Args:
+        urlfilenames (Iterable[URLFilenamePair]): The download plan.
+        num_shards (int): Total number of shards.
+        shard_index (int): Zero based index of the shard to return.
+
+    Returns:
+        list[URLFilenamePair]: The URLFilenamePairs in the shard.
+
+    Raises:
+        ValueError: If shard_index is not in range(num_shards).
+
+    Example:
+        >>> plan = [('url_a', 'a.csv'), ('url_b', 'b.csv'), ('url_c', 'c.csv')]
+        >>> sorted(shard_urlfilenames(plan, 2, 0) + shard_urlfilenames(plan, 2, 1)) == plan
+        True
+    """
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        raise ValueError(f'shard_index must be from 0 to num_shards - 1, got {shard_index} of {num_shards}.')
+    return [
+        (url, file_name) for url, file_name in urlfilenames
+        if zlib.crc32(file_name.encode()) % num_shards == shard_index
+    ]
+
+
+class WorkQueue:
+    """Download work queue in an SQLite database shared between worker processes and hosts.
+
+    Tasks move from 'pending' to 'leased' when a worker leases them, then to 'done', or back to 'pending' on failure
+    until max_attempts is reached and they are marked 'failed'. Leased tasks whose lease has expired are treated as
+    pending, so tasks of crashed workers are retried.
+
+    Attributes:
+        path (Path): Path of the SQLite database.
+        timeout (float): Seconds to wait for a lock held by another worker.
+    """
+
+    def __init__(self, path: str | Path, timeout: float = 60.0):
+        """Open or create the queue database.
+
+        Args:
+            path (str | Path): Path of the SQLite database, on storage shared by all workers.
+            timeout (float): Seconds to wait for a lock held by another worker.
+        """
+        self.path = Path(path)
+        self.timeout = timeout
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Autocommit connection closed on exit, rolling back any open transaction."""
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def add(
+        self,
+        urlfilenames: Iterable[URLFilenamePair],
+    ) -> int:
+        """Add tasks to the queue, ignoring file names already queued.
+
+        Args:
+            urlfilenames (Iterable[URLFilenamePair]): The download plan.
+
+        Returns:
+            int: Number of tasks added.
+        """
+        with self._connect() as connection:
+            before = connection.total_changes
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'INSERT OR IGNORE INTO tasks (file_name, url) VALUES (?, ?)',
+                ((file_name, url) for url, file_name in urlfilenames),
+            )
+            connection.execute('COMMIT')
+            return connection.total_changes - before
+
+    def lease(
+        self,
+        worker_id: str,
+        batch_size: int = 1,
+        lease_seconds: float = 600.0,
+    ) -> list[URLFilenamePair]:
+        """Lease up to batch_size pending or expired tasks for a worker.
+
+        Args:
+            worker_id (str): Unique worker name.
+            batch_size (int): Maximum number of tasks to lease.
+            lease_seconds (float): Seconds until the lease expires if not completed.
+
+        Returns:
+            list[URLFilenamePair]: The leased tasks, empty if there are no tasks available.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(
+                "SELECT file_name, url FROM tasks WHERE status = 'pending' "
+                "OR (status = 'leased' AND lease_expires < ?) ORDER BY file_name LIMIT ?",
+                (now, batch_size),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                'WHERE file_name = ?',
+                ((worker_id, now + lease_seconds, file_name) for file_name, _url in rows),
+            )
+            connection.execute('COMMIT')
+        return [(url, file_name) for file_name, url in rows]
+
+    def complete(
+        self,
+        file_name: str,
+        worker_id: str,
+    ) -> bool:
+        """Mark a task leased by a worker as done.
+
+        Returns:
+            bool: False if the lease expired and the task was leased again by another worker, which then owns it.
+        """
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE tasks SET status = 'done', lease_expires = 0 "
+                "WHERE file_name = ? AND worker = ? AND status = 'leased'",
+                (file_name, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def fail(
+        self,
+        file_name: str,
+        worker_id: str,
+        max_attempts: int = 3,
+    ) -> bool:
+        """Return a task leased by a worker to pending, or mark it failed once it has been attempted max_attempts times.
+
+        Returns:
+            bool: False if the lease expired and the task was leased again by another worker, which then owns it.
+        """
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_expires = 0 WHERE file_name = ? AND worker = ? AND status = 'leased'",
+                (max_attempts, file_name, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def counts(self) -> dict[str, int]:
+        """Number of tasks by status, with expired leases counted as pending."""
+        now = time.time()
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT CASE WHEN status = 'leased' AND lease_expires < ? THEN 'pending' ELSE status END, count(*) "
+                'FROM tasks GROUP BY 1',
+                (now,),
+            ).fetchall()
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        counts.update(dict(rows))
+        return counts
+
+    def failed(self) -> list[URLFilenamePair]:
+        """Tasks that reached max_attempts."""
+        with self._connect() as connection:
+            rows = connection.execute("SELECT file_name, url FROM tasks WHERE status = 'failed'").fetchall()
+        return [(url, file_name) for file_name, url in rows]
+
+    def is_complete(self) -> bool:
+        """True if no tasks are pending or leased."""
+        counts = self.counts()
+        return counts['pending'] == 0 and counts['leased'] == 0
+
+
+def run_worker(
+    queue: WorkQueue | str | Path,
+    folder_path: str | Path,
+    worker_id: str | None = None,
+    batch_size: int = 10,
+    lease_seconds: float = 600.0,
+    max_attempts: int = 3,
+    rate_limit: float | None = None,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+    compression: str | None = None,
+) -> int:
+    """Lease and download tasks from a work queue until no tasks are available.
+
+    Args:
+        queue (WorkQueue | str | Path): The work queue or path of its database.
+        folder_path (str | Path): Cache folder shared by all workers.
+        worker_id (str | None): Unique worker name, defaults to hostname-pid.
+        batch_size (int): Number of tasks leased at a time.
+        lease_seconds (float): Seconds until a lease expires, longer than the time to download a batch.
+        max_attempts (int): Number of attempts before a task is marked failed.
+        rate_limit (float | None): Optional maximum number of requests per second for this worker.
+        callback (EventCallback | None): Optional callable receiving a DownloadEvent per file.
+        quiet (bool): If True nothing is written to stdout.
+        compression (str | None): Store files compressed, 'gzip' or 'zstd', see barra2_dl.compression.
+
+    Returns:
+        int: Number of tasks completed by this worker.
+    """
+    import requests
+
+    if not isinstance(queue, WorkQueue):
+        queue = WorkQueue(queue)
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    rate_limiter = _RateLimiter(rate_limit)
+    manifest = _open_manifest(folder_path)
+    completed = 0
+    while tasks := queue.lease(worker_id, batch_size, lease_seconds):
+        for url, file_name in tasks:
+            try:
+                event = _download_file(url, file_name, folder_path, callback, quiet, rate_limiter, manifest=manifest,
+                                       compression=compression)
+            except requests.RequestException as error:
+                # a connection error or timeout fails this task only, the worker carries on with the others
+                logger.warning(f'Download of <{file_name}> failed: {error}')
+                queue.fail(file_name, worker_id, max_attempts)
+                continue
+            if event.status == 'failed':
+                queue.fail(file_name, worker_id, max_attempts)
+            elif queue.complete(file_name, worker_id):
+                completed += 1
+    logger.info(f'Worker <{worker_id}> completed {completed} tasks')
+    return completed
+
+
+def wait_until_complete(
+    queue: WorkQueue | str | Path,
+    poll_seconds: float = 10.0,
+    timeout: float | None = None,
+) -> dict[str, int]:
+    """Block until no tasks are pending or leased, e.g. before the final merge.
+
+    Args:
+        queue (WorkQueue | str | Path): The work queue or path of its database.
+        poll_seconds (float): Seconds between checks of the queue.
+        timeout (float | None): Optional maximum seconds to wait.
+
+    Returns:
+        dict[str, int]: Final number of tasks by status.
+
+    Raises:
+        TimeoutError: If the queue is not complete within timeout.
+    """
+    if not isinstance(queue, WorkQueue):
+        queue = WorkQueue(queue)
+    t0 = time.monotonic()
+    while not queue.is_complete():
+        if timeout is not None and time.monotonic() - t0 > timeout:
+            raise TimeoutError(f'Work queue <{queue.path}> not complete after {timeout} seconds: {queue.counts()}')
+        time.sleep(poll_seconds)
+    return queue.counts()
@@ -1,31 +1,69 @@
 """This module contains the barra2 download function(s)."""
 import calendar
 import logging
-import sys
+import threading
 import time
-from datetime import datetime, timedelta
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from datetime import UTC, datetime, timedelta
+from email.utils import parsedate_to_datetime
+from functools import lru_cache, partial
 from multiprocessing import cpu_count
-from multiprocessing.pool import ThreadPool
+from numbers import Real
 from pathlib import Path
+from types import ModuleType
+from typing import TYPE_CHECKING, cast, overload
 
-import pandas as pd
-import requests
+from barra2_dl.compression import COMPRESSIONS, compress_bytes
+from barra2_dl.instrument import ConcurrencyEvent, DownloadEvent, EventCallback, emit, stage
+from barra2_dl.manifest import CacheManifest, Validators, _conditional_headers
+from barra2_dl.storage import LocalStorage, Storage
+from barra2_dl.validate import _count_data_rows, parse_filename, validate_csv_bytes
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
 __all__ = [
+    'PointDataPlan',
     'point_data_urlfilenames',
     'download_serial',
     'download_multithread',
+    'AdaptiveConcurrency',
 ]
 
 type URLFilenamePair = tuple[str, str]
 
+# Bytes from the start and end of a downloaded csv file checked by validate_csv_bytes
+_VALIDATE_BYTES = 4096
+
+# thredds compresses csv responses several fold, requests decompresses them as they are read
+_REQUEST_HEADERS = {'Accept-Encoding': 'gzip'}
+
+# Responses from a thredds server under load, 429 Too Many Requests and 503 Service Unavailable
+_THROTTLE_STATUS_CODES = frozenset({429, 503})
+
+# Seconds to connect and between bytes of a response, a month of hourly csv can take a while to start
+_REQUEST_TIMEOUT = (10.0, 120.0)
+
+# Seconds before the first retry of a throttled, server error or failed request, doubled for each further retry,
+# unless the response has a Retry-After header, and the longest wait before a retry
+_RETRY_BACKOFF = 1.0
+_MAX_RETRY_DELAY = 60.0
+
+
+def __getattr__(name: str) -> ModuleType:
+    """Import requests on first use, so planning downloads does not load it."""
+    if name == 'requests':
+        import requests
+        return requests
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 def _list_months(
-    start_datetime: str,
-    end_datetime: str,
+    start_datetime: str | datetime,
+    end_datetime: str | datetime,
     freq: str = 'MS',
 ) -> list:
     """Generate a list of months between the given start and end datetime.
@@ -46,6 +84,8 @@ def _list_months(
     Raises:
         ValueError: If the provided start_datetime or end_datetime are not valid datetime-like objects.
     """
+    import pandas as pd
+
     try:
         pd.to_datetime(start_datetime)
     except ValueError as error:
@@ -60,7 +100,7 @@ def _list_months(
 
 
 def _list_timestamp_range(
-    dataframe: pd.DataFrame,
+    dataframe: 'pd.DataFrame',
     timestamp_column: str,
 ) -> list:
     """Get a list containing the range between the first and last timestamp in the specified column of the DataFrame.
@@ -79,6 +119,8 @@ def _list_timestamp_range(
         Not implemented function for only downloading new data based on existing time range.
         Add valid csv file check for downloading files from last 3 months
     """
+    import pandas as pd
+
     if timestamp_column not in dataframe.columns:
         raise ValueError(f'Column <{timestamp_column}> does not exist in the DataFrame.')
 
@@ -95,6 +137,234 @@ def _list_timestamp_range(
     return [first_timestamp, last_timestamp]
 
 
+@lru_cache(maxsize=128)
+def _month_table(
+    start_datetime: str | datetime,
+    end_datetime: str | datetime,
+) -> tuple[tuple[int, int, str, str, str], ...]:
+    """Memoised table of (year, month, time_start_str, time_end_str, file date range) for each month in the period.
+
+    Args:
+        start_datetime (str | datetime): Start of inclusive period.
+        end_datetime (str | datetime): End of inclusive period.
+
+    Returns:
+        tuple: One row per month, shared by every variable and site planned for the same period.
+    """
+    table = []
+    for date in _list_months(start_datetime, end_datetime, freq='MS'):
+        # Get the number of days in the current month
+        days_in_month = calendar.monthrange(date.year, date.month)[1]
+        time_end = date + timedelta(days=days_in_month) + timedelta(hours=-1)
+        table.append((
+            date.year,
+            date.month,
+            date.isoformat() + 'Z',
+            time_end.isoformat() + 'Z',
+            f"{date.strftime('%Y%m%d')}_{time_end.strftime('%Y%m%d')}",
+        ))
+    return tuple(table)
+
+
+def _fileout_ext(
+    fileout_type: str,
+) -> str:
+    """File extension for fileout_type.
+
+    Raises:
+        ValueError: If not csv file set for export.
+    """
+    match fileout_type:
+        case 'csv_file':
+            return 'csv'
+        case _:
+            logger.error(f'Unsupported fileout_type: {fileout_type}')
+            raise ValueError(f'{fileout_type} is currently not supported.')
+
+
+def _plan_file_name(
+    fileout_prefix: str | None,
+    var: str,
+    file_dates: str,
+    ext: str,
+) -> str:
+    """File name of a month of a variable, f'{fileout_prefix}_{var}_{YYYYMMDD}_{YYYYMMDD}.{ext}'."""
+    return f'{fileout_prefix}_{var}_{file_dates}.{ext}'
+
+
+class PointDataPlan(Sequence[URLFilenamePair]):
+    """Lazy sequence of URLFilenamePairs for downloading barra2 point data for one or more sites.
+
+    The month table is computed once per period and URLs and filenames are only generated when items are accessed,
+    so plans for many sites and decades support len(), indexing, slicing and iteration without building the full
+    list. Items are ordered by site, then variable, then month, which matches point_data_urlfilenames for a single site.
+
+    Attributes:
+        barra2_url (str): Use from barra2-dl.globals
+        barra2_vars (tuple[str]): Variables in the plan.
+        latitudes (tuple[float]): Latitude of each site.
+        longitudes (tuple[float]): Longitude of each site.
+        fileout_prefixes (tuple[str]): Filename prefix of each site.
+        fileout_type (str): Output file option, 'csv_file'
+
+    Example:
+        >>> from barra2_dl.globals import BARRA2_URL_AUS11_1HR
+        >>> plan = PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m', 'va50m'], [-23.55, -30.0], [133.4, 140.0],
+        ...                      '1979-01-01', '2023-12-31', ['site_a', 'site_b'])
+        >>> len(plan)
+        2160
+        >>> plan[-1][1]
+        'site_b_va50m_20231201_20231231.csv'
+        >>> len(plan[540:1080:2])
+        270
+    """
+
+    def __init__(
+        self,
+        barra2_url: str,
+        barra2_vars: Sequence[str],
+        latitude: float | int | Sequence[float | int],
+        longitude: float | int | Sequence[float | int],
+        start_datetime: str | datetime,
+        end_datetime: str | datetime,
+        fileout_prefix: str | Sequence[str] | None = None,
+        fileout_type: str = 'csv_file',
+    ):
+        """Set up the plan.
+
+        Args:
+            barra2_url (str): Use from barra2-dl.globals
+            barra2_vars (Sequence[str]): Use from barra2-dl.globals or set explicitly
+            latitude (float | int | Sequence[float | int]): Point latitude, or a latitude for each site.
+            longitude (float | int | Sequence[float | int]): Point longitude, or a longitude for each site.
+            start_datetime (str | datetime): Used to define start of inclusive download period
+            end_datetime (str | datetime): Used to define end of inclusive download period
+            fileout_prefix (str | Sequence[str] | None): Optional prefix for downloaded file, or a prefix for each site.
+                A single prefix for several sites is numbered by site, e.g. 'farm_0' and 'farm_1'. Plans of several
+                sites need a prefix.
+            fileout_type (str): Output file option, 'csv_file'
+
+        Raises:
+            ValueError: If not csv file set for export, the number of sites do not match, or sites share a prefix.
+        """
+        self._ext = _fileout_ext(fileout_type)
+        self.barra2_url = barra2_url
+        self.barra2_vars = tuple(barra2_vars)
+        self.fileout_type = fileout_type
+        # numbers.Real includes numpy scalars, but does not narrow the argument types for type checkers
+        self.latitudes: tuple[float | int, ...]
+        self.longitudes: tuple[float | int, ...]
+        self.fileout_prefixes: tuple[str | None, ...]
+        if not isinstance(latitude, Real):
+            latitudes = cast(Sequence[float | int], latitude)
+            self.latitudes, self.longitudes = tuple(latitudes), tuple(cast(Sequence[float | int], longitude))
+        else:
+            self.latitudes, self.longitudes = (cast(float | int, latitude),), (cast(float | int, longitude),)
+        if isinstance(fileout_prefix, str) and len(self.latitudes) > 1:
+            # a single prefix is numbered by site, so the files of each site have their own names
+            self.fileout_prefixes = tuple(f'{fileout_prefix}_{site}' for site in range(len(self.latitudes)))
+        elif isinstance(fileout_prefix, str) or fileout_prefix is None:
+            self.fileout_prefixes = (fileout_prefix,) * len(self.latitudes)
+        else:
+            self.fileout_prefixes = tuple(fileout_prefix)
+        if not len(self.latitudes) == len(self.longitudes) == len(self.fileout_prefixes):
+            raise ValueError('latitude, longitude and fileout_prefix must have the same number of sites.')
+        if len(set(self.fileout_prefixes)) < len(self.fileout_prefixes):
+            raise ValueError('Each site needs its own fileout_prefix, or the files of the sites would have the same '
+                             'names.')
+        self._months = _month_table(start_datetime, end_datetime)
+        self._indices = range(len(self.latitudes) * len(self.barra2_vars) * len(self._months))
+
+    def __len__(self) -> int:
+        """Number of URLFilenamePairs in the plan."""
+        return len(self._indices)
+
+    @overload
+    def __getitem__(self, index: int) -> URLFilenamePair: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> 'PointDataPlan': ...
+
+    def __getitem__(self, index: int | slice) -> 'URLFilenamePair | PointDataPlan':
+        """URLFilenamePair at index, or a lazy plan for a slice."""
+        if isinstance(index, slice):
+            plan = object.__new__(PointDataPlan)
+            plan.__dict__.update(self.__dict__)
+            plan._indices = self._indices[index]
+            return plan
+        return self._pair(self._indices[index])
+
+    def __iter__(self) -> Iterator[URLFilenamePair]:
+        """Generate URLFilenamePairs in order."""
+        for index in self._indices:
+            yield self._pair(index)
+
+    def __repr__(self) -> str:
+        """Summary of the plan size."""
+        return (f'PointDataPlan(sites={len(self.latitudes)}, vars={len(self.barra2_vars)}, '
+                f'months={len(self._months)}, len={len(self)})')
+
+    def _pair(self, index: int) -> URLFilenamePair:
+        site_index, index = divmod(index, len(self.barra2_vars) * len(self._months))
+        var_index, month_index = divmod(index, len(self._months))
+        var = self.barra2_vars[var_index]
+        year, month, time_start_str, time_end_str, file_dates = self._months[month_index]
+
+        # update thredds_base_url and set as url for request
+        url = self.barra2_url.format(var=var,
+                                     year=year,
+                                     month=month,
+                                     latitude=self.latitudes[site_index],
+                                     longitude=self.longitudes[site_index],
+                                     time_start_str=time_start_str,
+                                     time_end_str=time_end_str,
+                                     fileout_type=self.fileout_type)
+        return url, _plan_file_name(self.fileout_prefixes[site_index], var, file_dates, self._ext)
+
+    def file_names(self) -> Iterator[str]:
+        """Generate the filenames of the plan in order, without formatting the URLs.
+
+        Example:
+            >>> from barra2_dl.globals import BARRA2_URL_AUS11_1HR
+            >>> plan = PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m'], -23.55, 133.4, '2023-01-01', '2023-02-28', 'a')
+            >>> list(plan.file_names())
+            ['a_ua50m_20230101_20230131.csv', 'a_ua50m_20230201_20230228.csv']
+        """
+        n_vars, n_months = len(self.barra2_vars), len(self._months)
+        for index in self._indices:
+            site_index, rest = divmod(index, n_vars * n_months)
+            var_index, month_index = divmod(rest, n_months)
+            yield _plan_file_name(self.fileout_prefixes[site_index], self.barra2_vars[var_index],
+                                  self._months[month_index][4], self._ext)
+
+    def to_frame(self) -> 'pd.DataFrame':
+        """Compact columnar plan table with one row per request.
+
+        Returns:
+            pd.DataFrame: Columns site (fileout_prefix), var, year and month as categorical/integer columns, and
+            file_name.
+        """
+        import numpy as np
+        import pandas as pd
+
+        n_vars, n_months = len(self.barra2_vars), len(self._months)
+        indices = np.asarray(self._indices)
+        site_index, rest = np.divmod(indices, n_vars * n_months)
+        var_index, month_index = np.divmod(rest, n_months)
+        months = np.array([row[:2] for row in self._months], dtype=np.int16).reshape(-1, 2)
+        file_dates = np.array([row[4] for row in self._months], dtype=object)
+        prefixes = np.array(self.fileout_prefixes, dtype=object)[site_index]
+        vars_ = np.array(self.barra2_vars, dtype=object)[var_index]
+        return pd.DataFrame({
+            'site': pd.Categorical(prefixes),
+            'var': pd.Categorical(vars_),
+            'year': months[month_index, 0],
+            'month': months[month_index, 1].astype(np.int8),
+            'file_name': [_plan_file_name(prefix, var, dates, self._ext) for prefix, var, dates in
+                          zip(prefixes, vars_, file_dates[month_index], strict=True)],
+        })
+
+
 def point_data_urlfilenames(
     barra2_url: str,
     barra2_vars: list,
@@ -111,7 +381,7 @@ def point_data_urlfilenames(
     List of URLs and filenames can be used to download files.
     URLs and filenames for each month between start and end datetime.
     filenames as f'{fileout_prefix}_{var}_{time_start[:10]}_{time_end[:10]}.{fileout_type}'
-    Currently limited to csv file download only.
+    Currently limited to csv file download only. Use PointDataPlan for a lazy plan of very large request sets.
 
     Args:
         barra2_url (str): Use from barra2-dl.globals
@@ -135,111 +405,373 @@ def point_data_urlfilenames(
         Set default fileout_prefix if not set by user
         Add option to name file_prefix using BARRA2 node if fileout_prefix is None
     """
-    # Set file extension based on fileout_type
-    match fileout_type:
-        case 'csv_file':
-            fileout_ext = 'csv'
-        case _:
-            logger.error(f'Unsupported fileout_type: {fileout_type}')
-            raise ValueError(f'{fileout_type} is currently not supported.')
-
-    # create empty list for url and filename
-    point_data_urlfilenamepair = []
-
-    # loop through each variable requested for download as each variable is saved in a separate url
-    for var in barra2_vars:
-        # loop through each month as each BARRA2 file is saved by month todo check index enumerate addition works
-        for date in _list_months(start_datetime, end_datetime, freq='MS'):
-            year = date.year
-            month = date.month
-            time_start = date
-            time_start_str = date.isoformat() + 'Z'
-            # Get the number of days in the current month
-            days_in_month = calendar.monthrange(year, month)[1]
-            time_end = date + timedelta(days=days_in_month) + timedelta(hours=-1)
-            time_end_str = time_end.isoformat() + 'Z'
-
-            # update thredds_base_url and set as url for request
-            url = barra2_url.format(var=var,
-                                  year=year,
-                                  month=month,
-                                  latitude=latitude,
-                                  longitude=longitude,
-                                  time_start_str=time_start_str,
-                                  time_end_str=time_end_str,
-                                  fileout_type=fileout_type)
-
-            # set fileout_name
-            fileout_name = (
-                f'{fileout_prefix}_'
-                f'{var}_'
-                f"{time_start.strftime('%Y%m%d')}_{time_end.strftime('%Y%m%d')}"
-                f'.{fileout_ext}'
-            )
-            # append url and filename as tuple
-            point_data_urlfilenamepair.append((url, fileout_name))
+    with stage('plan', quiet=True) as plan_stage:
+        point_data_urlfilenamepair = list(PointDataPlan(barra2_url, barra2_vars, latitude, longitude,
+                                                        start_datetime, end_datetime, fileout_prefix, fileout_type))
+        plan_stage.rows = len(point_data_urlfilenamepair)
 
     return point_data_urlfilenamepair
 
 
+class _RateLimiter:
+    """Thread safe limiter spacing requests at least 1 / rate_limit seconds apart."""
+
+    def __init__(self, rate_limit: float | None = None):
+        self.interval = 1 / rate_limit if rate_limit else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Block until the next request is allowed."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class AdaptiveConcurrency:
+    """Thread safe AIMD controller of the number of download requests in flight.
+
+    The limit starts at initial and is increased by one after each window of limit successful responses, so it grows
+    by about one per round trip while the server keeps up. It is multiplied by decrease on a 429 or 503 response, a
+    server error, a failed request or a latency above target_latency, and only once for the requests in flight when
+    the limit was last changed, so a burst of throttled responses is a single decrease. Other client errors, e.g. 404,
+    do not change the limit. Each change is reported as a ConcurrencyEvent, which Metrics exports as the
+    download_concurrency gauge.
+
+    Example:
+        >>> concurrency = AdaptiveConcurrency(floor=1, ceiling=8, initial=4, quiet=True)
+        >>> concurrency.record(concurrency.acquire(), status_code=503, latency=0.5)
+        >>> concurrency.limit
+        2
+    """
+
+    def __init__(
+        self,
+        floor: int = 1,
+        ceiling: int = 16,
+        initial: int | None = None,
+        target_latency: float | None = None,
+        decrease: float = 0.5,
+        callback: EventCallback | None = None,
+        quiet: bool = True,
+    ):
+        """Set up the controller.
+
+        Args:
+            floor (int): Minimum number of requests in flight.
+            ceiling (int): Maximum number of requests in flight, also the number of download threads.
+            initial (int | None): Starting number of requests in flight, defaults to the floor.
+            target_latency (float | None): Optional seconds per request above which the limit is decreased.
+            decrease (float): Factor applied to the limit on a decrease, from 0 to 1.
+            callback (EventCallback | None): Optional callable receiving a ConcurrencyEvent for each change.
+            quiet (bool): If True nothing is written to stdout.
+
+        Raises:
+            ValueError: If floor, ceiling, initial or decrease are out of range.
+        """
+        initial = floor if initial is None else initial
+        if not 1 <= floor <= initial <= ceiling:
+            raise ValueError(f'Concurrency must satisfy 1 <= floor <= initial <= ceiling, '
+                             f'got {floor}, {initial}, {ceiling}.')
+        if not 0 < decrease < 1:
+            raise ValueError(f'Concurrency decrease must be between 0 and 1, got {decrease}.')
+        self.floor = floor
+        self.ceiling = ceiling
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.callback = callback
+        self.quiet = quiet
+        self.limit = initial
+        self.in_flight = 0
+        self._successes = 0
+        # incremented on each change, responses to requests started before a change do not change the limit again
+        self._epoch = 0
+        self._condition = threading.Condition()
+        emit(ConcurrencyEvent(self.limit, 'start'), callback=callback, quiet=quiet)
+
+    def acquire(self) -> int:
+        """Block until a request is allowed in flight.
+
+        Returns:
+            int: Ticket passed to record when the request completes.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            return self._epoch
+
+    def record(
+        self,
+        ticket: int,
+        status_code: int | None,
+        latency: float,
+    ) -> None:
+        """Release a request slot and update the limit from its response.
+
+        Args:
+            ticket (int): Ticket returned by acquire.
+            status_code (int | None): HTTP status code of the response, None if the request failed.
+            latency (float): Seconds waiting on the request.
+        """
+        reason = None
+        limit = self.limit
+        with self._condition:
+            self.in_flight -= 1
+            if status_code in _THROTTLE_STATUS_CODES:
+                congestion = 'throttled'
+            elif status_code is None or status_code >= 500:
+                congestion = 'error'
+            elif self.target_latency is not None and latency > self.target_latency:
+                congestion = 'latency'
+            else:
+                congestion = None
+
+            if congestion is not None and ticket == self._epoch:
+                limit = max(int(self.limit * self.decrease), self.floor)
+                reason = congestion
+            elif congestion is None and status_code is not None and status_code < 400:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.ceiling:
+                    limit = self.limit + 1
+                    reason = 'increase'
+            if reason is not None:
+                self._epoch += 1
+                self._successes = 0
+                self.limit = limit
+            self._condition.notify_all()
+        if reason is not None:
+            emit(ConcurrencyEvent(limit, reason), callback=self.callback, quiet=self.quiet)
+
+
+def _validate_content(
+    content: bytes,
+    file_name: str,
+    callback: EventCallback | None = None,
+) -> str | None:
+    """Validate downloaded csv content against the variable and period in its file name, without parsing it.
+
+    Returns:
+        str | None: Description of the problem found, or None if valid or not a csv file.
+    """
+    if not file_name.endswith('.csv'):
+        return None
+    parsed = parse_filename(file_name) or {}
+    with stage('validate', detail=f'Validated: {file_name}', callback=callback, quiet=True) as validate_stage:
+        rows = content.count(b'\n') - 1 + (not content.endswith(b'\n'))
+        error = validate_csv_bytes(
+            content[:_VALIDATE_BYTES],
+            content[-_VALIDATE_BYTES:],
+            var=parsed.get('var'),
+            start=parsed.get('start'),
+            end=parsed.get('end'),
+            rows=rows,
+        )
+        validate_stage.nbytes = len(content)
+    return error
+
+
+def _retry_delay(
+    headers: Mapping[str, str],
+    retries: int,
+) -> float:
+    """Seconds to wait before a retry, the Retry-After header in seconds or as a date, else an exponential backoff."""
+    retry_after = headers.get('Retry-After', '').strip()
+    if retry_after.isdigit():
+        delay = float(retry_after)
+    elif retry_after:
+        try:
+            delay = (parsedate_to_datetime(retry_after) - datetime.now(UTC)).total_seconds()
+        except (TypeError, ValueError):
+            delay = _RETRY_BACKOFF * 2 ** retries
+    else:
+        delay = _RETRY_BACKOFF * 2 ** retries
+    return min(max(delay, 0.0), _MAX_RETRY_DELAY)
+
+
 def _download_file(
     url: str,
     file_name: str,
-    folder_path: str | Path,
-) -> None:
+    folder_path: str | Path | Storage,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+    rate_limiter: _RateLimiter | None = None,
+    max_retries: int = 2,
+    concurrency: AdaptiveConcurrency | None = None,
+    manifest: CacheManifest | None = None,
+    refresh: bool = False,
+    compression: str | None = None,
+) -> DownloadEvent:
     """Download the file from the url and save it as folder_path/filename.
 
     If the downloads folder does not exist, it will be created due to the
     create_folder argument.
 
+    csv files are validated before they are written, and requested again up to max_retries times if the response is
+    an error message or truncated, so invalid files are never written to the cache. Throttled (429, 503) and server
+    error responses, and requests failing with a connection error or timeout, are retried too, after the Retry-After
+    of the response or an exponential backoff. A request failing after all retries is reported as a failed event.
+
+    Files already in the cache are skipped, or revalidated with a conditional request if refresh is True. Unchanged
+    files are answered with 304 Not Modified and kept, revised files replace the cached file atomically.
+
+    Responses are transferred gzip compressed and validated uncompressed. With compression they are stored
+    compressed as folder_path/filename.gz or .zst, see barra2_dl.compression, and a file is cached in either form.
+
+    folder_path can be a Storage, e.g. barra2_dl.storage.S3Storage for a cache in object storage. Files in a Storage
+    other than a local folder have no manifest, so they are revalidated by their modification time.
+
     Args:
         url (str): The URL of the file to be downloaded.
         file_name (str): The name to save the downloaded file.
-        folder_path (str | Path): The path where the file should be saved.
+        folder_path (str | Path | Storage): The path or Storage where the file should be saved.
+        callback (EventCallback | None): Optional callable receiving a DownloadEvent for the file.
+        quiet (bool): If True the per-file status is not written to stdout.
+        rate_limiter (_RateLimiter | None): Optional limiter shared between downloads.
+        max_retries (int): Number of times a response that fails validation, is throttled or a server error, or a
+            failed request is requested again.
+        concurrency (AdaptiveConcurrency | None): Optional controller shared between downloads, each request waits
+            for a slot and its response updates the limit.
+        manifest (CacheManifest | None): Optional manifest recording the validators of downloaded files, used to
+            revalidate them on refresh.
+        refresh (bool): If True revalidate a cached file instead of skipping it.
+        compression (str | None): Store the file compressed, 'gzip' or 'zstd', or None for an uncompressed file.
 
-    Returns: None
+    Returns:
+        DownloadEvent: The event reported for the file.
 
     Raises:
         FileNotFoundError: If folder does not exist.
+        ValueError: If the compression is not supported.
     """
-    folder = Path(folder_path)
-    folder_file = folder / file_name
-
-    # Check if the folder exists
-    if not folder.exists():
-        logger.error(f'{folder_path} does not exist.')
-        raise FileNotFoundError(f'The folder {folder_path} does not exist. Create folder first.')
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f'Unsupported compression <{compression}>, use one of {list(COMPRESSIONS)} or None.')
+    stored_name = f'{file_name}{COMPRESSIONS[compression]}' if compression is not None else file_name
+    if isinstance(folder_path, Storage):
+        storage = folder_path
+    else:
+        # Check if the folder exists
+        if not Path(folder_path).exists():
+            logger.error(f'{folder_path} does not exist.')
+            raise FileNotFoundError(f'The folder {folder_path} does not exist. Create folder first.')
+        storage = LocalStorage(folder_path)
 
     # Check if the file already exists else download the url to the file
-    if folder_file.exists():
-        logger.info(f'<{file_name}> already exists in the <{folder_path}>. File not downloaded.')
-        sys.stdout.write(f'<{file_name}> already exists in the folder <{folder_path}>. File not downloaded.')
-        sys.stdout.write('\n')
+    cached = storage.cached_name(file_name)
+    if cached is not None and not refresh:
+        event = DownloadEvent(file_name, 'exists', folder_path=str(folder_path))
     else:
-        response = requests.get(url) #, timeout=20
-        # check file is not empty or contains server error 'FileNotFound: No such file or directory'
+        import requests
+
+        headers = dict(_REQUEST_HEADERS)
+        if cached is not None:
+            headers.update(_conditional_headers(cached, manifest.get(file_name) if manifest is not None else None,
+                                                storage.stat(cached)))
+        latency = 0.0
+        retries = 0
+        while True:
+            if rate_limiter is not None:
+                rate_limiter.wait()
+            ticket = concurrency.acquire() if concurrency is not None else 0
+            response = None
+            status_code = None
+            error = None
+            try:
+                with stage('network', detail=f'Requested: {file_name}', callback=callback,
+                           quiet=True) as network_stage:
+                    try:
+                        response = requests.get(url, headers=headers, timeout=_REQUEST_TIMEOUT)
+                    except requests.RequestException as exc:
+                        error = f'{type(exc).__name__}: {exc}'
+                    else:
+                        network_stage.nbytes = len(response.content)
+                        status_code = response.status_code
+            finally:
+                if concurrency is not None:
+                    concurrency.record(ticket, status_code, network_stage.seconds)
+            latency += network_stage.seconds
+            # check file is not empty or contains server error 'FileNotFound: No such file or directory'
+            if response is not None and response.status_code == 200:
+                error = _validate_content(response.content, file_name, callback)
+            if status_code in _THROTTLE_STATUS_CODES or (status_code or 0) >= 500:
+                error = f'Status code: {status_code}'
+            if error is None or retries >= max_retries:
+                break
+            retries += 1
+            if status_code == 200:
+                logger.warning(f'<{file_name}> failed validation, retry {retries} of {max_retries}: {error}')
+            else:
+                delay = _retry_delay(response.headers if response is not None else {}, retries - 1)
+                logger.warning(f'<{file_name}> failed, retry {retries} of {max_retries} in {delay:.1f}s: {error}')
+                time.sleep(delay)
         # Check if the request was successful
-        if response.status_code == 200:
-            # write content to folder_file
-            folder_file.write_bytes(response.content)
-            logger.info(f'<{file_name}> downloaded to <{folder_path}>')
-            sys.stdout.write(f'<{file_name}> downloaded to <{folder_path}>')
-            sys.stdout.write('\n')
+        if response is None:
+            event = DownloadEvent(file_name, 'failed', latency=latency, retries=retries,
+                                  folder_path=str(folder_path), error=error or '')
+        elif response.status_code == 304 and cached is not None:
+            if manifest is not None:
+                manifest.touch(file_name)
+            event = DownloadEvent(file_name, 'not_modified', latency=latency, retries=retries,
+                                  status_code=response.status_code, folder_path=str(folder_path))
+        elif response.status_code == 200 and error is None:
+            # the storage replaces a cached file atomically, so it is never left truncated
+            with stage('disk_write', detail=f'Wrote: {file_name}', callback=callback, quiet=True) as write_stage:
+                write_stage.nbytes = storage.write_bytes(stored_name, compress_bytes(response.content, compression))
+                if cached is not None and cached != stored_name:
+                    # a revised file replaces the cached file in another compression
+                    storage.delete(cached)
+            if manifest is not None:
+                rows = _count_data_rows((response.content,))
+                manifest.put(file_name, Validators.from_headers(response.headers, len(response.content), rows))
+            event = DownloadEvent(file_name, 'updated' if cached is not None else 'downloaded',
+                                  nbytes=len(response.content), latency=latency, retries=retries,
+                                  status_code=response.status_code, folder_path=str(folder_path))
+        elif status_code == 200:
+            event = DownloadEvent(file_name, 'failed', latency=latency, retries=retries,
+                                  status_code=response.status_code, folder_path=str(folder_path), error=error or '')
         else:
-            logger.info(f'<{file_name}> Failed to download. Status code: {response.status_code}')
-            sys.stdout.write(f'<{file_name}> Failed to download. Status code: {response.status_code}')
-            sys.stdout.write('\n')
+            event = DownloadEvent(file_name, 'failed', latency=latency, retries=retries,
+                                  status_code=response.status_code, folder_path=str(folder_path))
+    emit(event, callback=callback, quiet=quiet)
+    return event
+
+
+def _open_manifest(
+    folder_path: str | Path | Storage,
+) -> CacheManifest | None:
+    """Manifest of a cache folder, or None if the folder does not exist so _download_file raises, or is not local."""
+    if isinstance(folder_path, LocalStorage):
+        folder_path = folder_path.folder_path
+    elif isinstance(folder_path, Storage):
+        return None
+    return CacheManifest(folder_path) if Path(folder_path).is_dir() else None
 
 
 def download_serial(
-    urlfilenames: list[URLFilenamePair],
-    folder_path: str | Path,
+    urlfilenames: Iterable[URLFilenamePair],
+    folder_path: str | Path | Storage,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+    rate_limit: float | None = None,
+    refresh: bool = False,
+    compression: str | None = None,
 ) -> None:
     """Download all files from urls in list of URLFilenamePairs and save it as folder_path/filename, using a loop.
 
     Args:
-        urlfilenames (list[URLFilenamePair]): A list of URLFilenamePair of the files to be downloaded.
-        folder_path (str | Path): The path where the file should be saved.
+        urlfilenames (Iterable[URLFilenamePair]): A list or PointDataPlan of the files to be downloaded.
+        folder_path (str | Path | Storage): The path where the file should be saved, or a Storage, e.g. an
+            S3Storage shared by many workers.
+        callback (EventCallback | None): Optional callable receiving a DownloadEvent per file and a StageEvent
+            for the total download time, e.g. barra2_dl.instrument.Metrics().
+        quiet (bool): If True nothing is written to stdout.
+        rate_limit (float | None): Optional maximum number of requests per second.
+        refresh (bool): If True revalidate cached files with conditional requests, and download only revised files.
+        compression (str | None): Store files compressed, 'gzip' or 'zstd', see barra2_dl.compression.
 
     Returns: None
 
@@ -250,23 +782,41 @@ def download_serial(
         https://medium.com/towards-data-science/use-python-to-download-multiple-files-or-urls-in-parallel-1759da9d6535
     """
     # download multiple files in loop
-    t0 = time.time()
-    for url, filename in urlfilenames:
-        _download_file(url, filename, folder_path)
-    logger.info(f'Download time <{time.time() - t0}>')
-    sys.stdout.write(f'Download time: <{time.time() - t0}>')
-    sys.stdout.write('\n')
+    rate_limiter = _RateLimiter(rate_limit)
+    manifest = _open_manifest(folder_path)
+    with stage('download', callback=callback, quiet=quiet):
+        for url, filename in urlfilenames:
+            _download_file(url, filename, folder_path, callback, quiet, rate_limiter, manifest=manifest,
+                           refresh=refresh, compression=compression)
 
 
 def download_multithread(
-    urlfilenames: list[URLFilenamePair],
-    folder_path: str | Path,
+    urlfilenames: Iterable[URLFilenamePair],
+    folder_path: str | Path | Storage,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+    max_workers: int | None = None,
+    rate_limit: float | None = None,
+    concurrency: AdaptiveConcurrency | None = None,
+    refresh: bool = False,
+    compression: str | None = None,
 ) -> None:
     """Download all files from urls in list of URLFilenamePairs and save it as folder_path/filename, using multithread.
 
     Args:
-        urlfilenames (list[URLFilenamePair]): A list of URLFilenamePair of the files to be downloaded.
-        folder_path (str | Path): The path where the file should be saved.
+        urlfilenames (Iterable[URLFilenamePair]): A list or PointDataPlan of the files to be downloaded.
+        folder_path (str | Path | Storage): The path where the file should be saved, or a Storage, e.g. an
+            S3Storage shared by many workers.
+        callback (EventCallback | None): Optional thread safe callable receiving a DownloadEvent per file and a
+            StageEvent for the total download time, e.g. barra2_dl.instrument.Metrics().
+        quiet (bool): If True nothing is written to stdout.
+        max_workers (int | None): Number of download threads. Defaults to the number of cpus - 1, minimum 1.
+        rate_limit (float | None): Optional maximum number of requests per second across all threads.
+        concurrency (AdaptiveConcurrency | None): Optional controller adapting the number of requests in flight to
+            the server latency and throttling. A thread is started for each request up to its ceiling, and
+            max_workers is ignored.
+        refresh (bool): If True revalidate cached files with conditional requests, and download only revised files.
+        compression (str | None): Store files compressed, 'gzip' or 'zstd', see barra2_dl.compression.
 
     Returns: None
 
@@ -277,10 +827,17 @@ def download_multithread(
         https://medium.com/towards-data-science/use-python-to-download-multiple-files-or-urls-in-parallel-1759da9d6535
     """
     # download multiple files in parallel
-    cpus = cpu_count()
-    t0 = time.time()
-    with ThreadPool(cpus - 1) as pool:
-        pool.starmap(_download_file, [(url, filename, folder_path) for url, filename in urlfilenames])
-    logger.info(f'Download time <{time.time() - t0}>')
-    sys.stdout.write(f'Download time: <{time.time() - t0}>')
-    sys.stdout.write('\n')
+    from multiprocessing.pool import ThreadPool
+
+    if concurrency is not None:
+        max_workers = concurrency.ceiling
+    elif max_workers is None:
+        max_workers = max(cpu_count() - 1, 1)
+    rate_limiter = _RateLimiter(rate_limit)
+    manifest = _open_manifest(folder_path)
+    with stage('download', callback=callback, quiet=quiet):
+        with ThreadPool(max_workers) as pool:
+            download_file = partial(_download_file, folder_path=folder_path, callback=callback, quiet=quiet,
+                                    rate_limiter=rate_limiter, concurrency=concurrency, manifest=manifest,
+                                    refresh=refresh, compression=compression)
+            pool.starmap(download_file, urlfilenames)
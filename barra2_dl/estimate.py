@@ -0,0 +1,241 @@
+"""This module contains the barra2 download size and duration estimate function(s).
+
+The size of each request in a plan is modelled as a header plus a number of bytes per hour for its variable, with
+the hours read from the file name. The model can be fitted by probing a small sample of the plan, one request per
+variable, whose responses are saved to the cache so the probes are not wasted. Wall time is then predicted from the
+seconds per request for a number of workers and an optional rate limit, and used to size the worker pool.
+"""
+import logging
+import math
+import statistics
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from multiprocessing import cpu_count
+from pathlib import Path
+
+from barra2_dl.compression import cached_path, open_cached
+from barra2_dl.download import PointDataPlan, URLFilenamePair, _download_file, _open_manifest
+from barra2_dl.validate import FILENAME_PATTERN
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'SizeModel',
+    'PlanEstimate',
+    'probe_plan',
+    'estimate_plan',
+    'size_workers',
+]
+
+# thredds csv point data rows are about 80 bytes, e.g. '2023-01-01T00:00:00Z,GridPointRequestedAt[23.553S_133.396E],...'
+_BYTES_PER_HOUR = 80.0
+_HEADER_BYTES = 120.0
+# typical thredds NetCDF Subset Service response time for a month of point data
+_SECONDS_PER_REQUEST = 2.0
+_MAX_WORKERS = 16
+
+
+@lru_cache(maxsize=4096)
+def _period_hours(
+    start: str,
+    end: str,
+) -> int:
+    """Number of hours from the first hour of start to the last hour of end, as YYYYMMDD."""
+    days = (datetime.strptime(end, '%Y%m%d') - datetime.strptime(start, '%Y%m%d')).days + 1
+    return days * 24
+
+
+def _plan_hours(
+    file_name: str,
+) -> tuple[str, int]:
+    """Variable and number of hours of a planned file, from its name."""
+    match = FILENAME_PATTERN.match(file_name)
+    if match is None:
+        raise ValueError(f'Cannot estimate the size of <{file_name}>, not a point_data_urlfilenames file name.')
+    return match['var'], _period_hours(match['start'], match['end'])
+
+
+@dataclass
+class SizeModel:
+    """Model of the response size and time of point data requests.
+
+    Attributes:
+        bytes_per_hour (dict[str, float]): Bytes per hourly row by variable.
+        default_bytes_per_hour (float): Bytes per hourly row of variables not in bytes_per_hour.
+        header_bytes (float): Bytes of the csv header line.
+        seconds_per_request (float): Wall seconds per request for a single worker.
+        probes (int): Number of probed requests the model was fitted to.
+    """
+    bytes_per_hour: dict[str, float] = field(default_factory=dict)
+    default_bytes_per_hour: float = _BYTES_PER_HOUR
+    header_bytes: float = _HEADER_BYTES
+    seconds_per_request: float = _SECONDS_PER_REQUEST
+    probes: int = 0
+
+    def request_bytes(
+        self,
+        file_name: str,
+    ) -> float:
+        """Predicted bytes of a planned file."""
+        var, hours = _plan_hours(file_name)
+        return self.header_bytes + hours * self.bytes_per_hour.get(var, self.default_bytes_per_hour)
+
+
+@dataclass
+class PlanEstimate:
+    """Predicted size and duration of a download plan.
+
+    Attributes:
+        requests (int): Number of requests.
+        total_bytes (int): Predicted bytes downloaded.
+        bytes_by_var (dict[str, int]): Predicted bytes downloaded by variable.
+        workers (int): Number of download workers.
+        rate_limit (float | None): Maximum requests per second.
+        wall_seconds (float): Predicted wall time of the downloads.
+    """
+    requests: int
+    total_bytes: int
+    bytes_by_var: dict[str, int]
+    workers: int
+    rate_limit: float | None
+    wall_seconds: float
+
+    def summary(self) -> str:
+        """Single line summary for the command line."""
+        return (f'Requests: {self.requests}, estimated bytes: {self.total_bytes}, '
+                f'estimated time: {self.wall_seconds:.0f}s with {self.workers} workers')
+
+
+def probe_plan(
+    urlfilenames: Iterable[URLFilenamePair],
+    folder_path: str | Path,
+    per_var: int = 1,
+) -> SizeModel:
+    """Fit a SizeModel by downloading the first per_var requests of each variable in a plan to the cache.
+
+    Files already in the cache are measured without a request.
+
+    Args:
+        urlfilenames (Iterable[URLFilenamePair]): The download plan, e.g. from point_data_urlfilenames.
+        folder_path (str | Path): Cache folder, probed files are saved as in a download.
+        per_var (int): Number of requests probed for each variable.
+
+    Returns:
+        SizeModel: Bytes per hour by variable and seconds per request of the probes, defaults where not probed.
+    """
+    samples: dict[str, list[URLFilenamePair]] = {}
+    for url, file_name in urlfilenames:
+        var, _hours = _plan_hours(file_name)
+        if len(samples.setdefault(var, [])) < per_var:
+            samples[var].append((url, file_name))
+
+    bytes_per_hour: dict[str, list[float]] = {}
+    header_bytes = []
+    seconds = []
+    manifest = _open_manifest(folder_path)
+    for var, pairs in samples.items():
+        for url, file_name in pairs:
+            event = _download_file(url, file_name, folder_path, quiet=True, manifest=manifest)
+            path = cached_path(folder_path, file_name) if event.status != 'failed' else None
+            if path is None:
+                logger.warning(f'Probe of <{file_name}> failed, using default size for {var}.')
+                continue
+            if event.status == 'downloaded':
+                seconds.append(event.latency)
+            with open_cached(path) as file:
+                header_bytes.append(len(file.readline()))
+                data_bytes = len(file.read())
+            _var, hours = _plan_hours(file_name)
+            bytes_per_hour.setdefault(var, []).append(data_bytes / hours)
+
+    model = SizeModel(
+        bytes_per_hour={var: statistics.fmean(values) for var, values in bytes_per_hour.items()},
+        probes=sum(len(values) for values in bytes_per_hour.values()),
+    )
+    if model.bytes_per_hour:
+        model.default_bytes_per_hour = statistics.fmean(model.bytes_per_hour.values())
+        model.header_bytes = statistics.fmean(header_bytes)
+    if seconds:
+        model.seconds_per_request = statistics.median(seconds)
+    logger.info(f'Probed {model.probes} requests: {model}')
+    return model
+
+
+def size_workers(
+    requests: int,
+    seconds_per_request: float = _SECONDS_PER_REQUEST,
+    rate_limit: float | None = None,
+    target_seconds: float | None = None,
+    max_workers: int = _MAX_WORKERS,
+) -> int:
+    """Number of download workers for a plan.
+
+    With a rate limit, enough workers to keep the rate limit busy. With a target time, enough workers to finish within
+    it. Otherwise the number of cpus - 1, as used by download_multithread.
+
+    Args:
+        requests (int): Number of requests in the plan.
+        seconds_per_request (float): Wall seconds per request for a single worker.
+        rate_limit (float | None): Optional maximum requests per second.
+        target_seconds (float | None): Optional target wall time.
+        max_workers (int): Upper limit of workers.
+
+    Returns:
+        int: Number of workers from 1 to min(max_workers, requests).
+
+    Example:
+        >>> size_workers(1000, seconds_per_request=2.0, rate_limit=5.0)
+        10
+    """
+    if rate_limit is not None:
+        workers = math.ceil(rate_limit * seconds_per_request)
+    elif target_seconds is not None:
+        workers = math.ceil(requests * seconds_per_request / target_seconds)
+    else:
+        workers = cpu_count() - 1
+    return max(min(workers, max_workers, requests), 1)
+
+
+def estimate_plan(
+    urlfilenames: Sequence[URLFilenamePair],
+    model: SizeModel | None = None,
+    workers: int | None = None,
+    rate_limit: float | None = None,
+) -> PlanEstimate:
+    """Predict the bytes and wall time of a download plan without any requests.
+
+    Args:
+        urlfilenames (Sequence[URLFilenamePair]): The download plan, e.g. from point_data_urlfilenames, or a
+            PointDataPlan, whose file names are read without formatting the URLs.
+        model (SizeModel | None): Size model, e.g. from probe_plan, defaults to typical thredds csv sizes.
+        workers (int | None): Number of download workers, defaults to size_workers.
+        rate_limit (float | None): Optional maximum requests per second.
+
+    Returns:
+        PlanEstimate: The predicted size and duration.
+    """
+    model = model or SizeModel()
+    bytes_by_var: dict[str, float] = {}
+    if isinstance(urlfilenames, PointDataPlan):
+        file_names: Iterable[str] = urlfilenames.file_names()
+    else:
+        file_names = (file_name for _url, file_name in urlfilenames)
+    for file_name in file_names:
+        var, _hours = _plan_hours(file_name)
+        bytes_by_var[var] = bytes_by_var.get(var, 0.0) + model.request_bytes(file_name)
+    requests = len(urlfilenames)
+    workers = workers or size_workers(requests, model.seconds_per_request, rate_limit)
+    wall_seconds = requests * model.seconds_per_request / workers
+    if rate_limit is not None:
+        wall_seconds = max(wall_seconds, requests / rate_limit)
+    return PlanEstimate(
+        requests=requests,
+        total_bytes=round(sum(bytes_by_var.values())),
+        bytes_by_var={var: round(nbytes) for var, nbytes in bytes_by_var.items()},
+        workers=workers,
+        rate_limit=rate_limit,
+        wall_seconds=wall_seconds,
+    )
@@ -72,3 +72,9 @@ BARRA2_URL_AUST04_1HR = (
     '&timeStride=&vertCoord='
     '&accept={fileout_type}'
 )
+
+# BARRA2 thredds urls by dataset name
+BARRA2_URLS = {
+    'AUS-11': BARRA2_URL_AUS11_1HR,
+    'AUST-04': BARRA2_URL_AUST04_1HR,
+}
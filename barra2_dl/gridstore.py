@@ -0,0 +1,429 @@
+"""This module contains the barra2 Zarr grid store class and function(s).
+
+Cached point data of many grid nodes, e.g. the nodes of a wind farm box or of interpolation_weights, are written to
+a Zarr store with an array per variable and dims (time, height, lat, lon), e.g. ua at 50m and 100m is the array ua.
+Each node is snapped to the nearest node of the grid, so lat and lon are a box of grid nodes around the sites.
+Arrays are chunked as a year of hours at a single node and compressed with Blosc zstd and byte shuffling, so a long
+time series of one node reads a chunk per year and nothing of the other nodes. The time axis grows as months are
+written, so a GridStore can be passed as the callback of the downloaders to append each month as it is cached.
+Downloads to a Storage other than a local folder, e.g. an S3Storage, are appended from its local mirror when the
+store is opened with that storage.
+The store has CF time, height, lat and lon coordinates and dimension names, so it can be opened lazily by zarr or
+xarray.open_zarr. This requires zarr.
+"""
+import logging
+import re
+import threading
+from collections.abc import Sequence
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from barra2_dl.compression import _optional_import, cached_path
+from barra2_dl.download import PointDataPlan
+from barra2_dl.instrument import DownloadEvent, Event, EventCallback, stage
+from barra2_dl.mapping import AUS11_GRID, RegularGrid
+from barra2_dl.merge import _HOUR_NS
+from barra2_dl.panel import _read_file, _read_location, panel_files
+from barra2_dl.storage import Storage
+from barra2_dl.validate import parse_filename
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'GridStore',
+    'write_grid_store',
+]
+
+# variables at a height, e.g. ua50m is ua at 50m
+_HEIGHT_PATTERN = re.compile(r'^(?P<name>[a-z]+?)(?P<height>\d+)m$')
+
+# download statuses of files in the cache appended by the store callback
+_CACHED_STATUSES = ('downloaded', 'updated', 'exists')
+
+
+def _split_var(
+    var: str,
+) -> tuple[str, int | None]:
+    """Array name and height of a variable, or None for variables without a height.
+
+    Example:
+        >>> _split_var('ua100m'), _split_var('pr')
+        (('ua', 100), ('pr', None))
+    """
+    match = _HEIGHT_PATTERN.match(var)
+    return (match['name'], int(match['height'])) if match is not None else (var, None)
+
+
+def _nearest_nodes(
+    grid: RegularGrid,
+    latitudes: Sequence[float],
+    longitudes: Sequence[float],
+) -> tuple[np.ndarray, np.ndarray]:
+    """Grid row and column of the nearest node to each site.
+
+    Raises:
+        ValueError: If any site is outside the grid.
+    """
+    rows, cols, lat_fractions, lon_fractions = grid._cells(np.asarray(latitudes, dtype=np.float64),
+                                                           np.asarray(longitudes, dtype=np.float64))
+    return rows + (lat_fractions >= 0.5), cols + (lon_fractions >= 0.5)
+
+
+class GridStore:
+    """Zarr store of cached point data with dims (time, height, lat, lon), see the module description.
+
+    Attributes:
+        path (Path): Path of the store.
+        grid (RegularGrid): Grid of the nodes.
+        row0 (int): Grid row of the first lat of the store.
+        col0 (int): Grid column of the first lon of the store.
+        origin (pd.Timestamp): UTC hour of the first time of the store.
+        sites (dict[str, tuple[int, int]]): Lat and lon position of each site, by file name prefix.
+        variables (dict[str, tuple[str, int | None]]): Array name and height position of each variable.
+        storage (Storage | None): Storage the download callback reads cached files from, or None for a local cache.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        storage: Storage | None = None,
+    ):
+        """Open a store created by GridStore.create.
+
+        Args:
+            path (str | Path): Path of the store.
+            storage (Storage | None): Storage the downloads passed to the callback are cached in, e.g. an S3Storage
+                with a mirror_dir, or None if they are cached in a local folder.
+        """
+        self.path = Path(path)
+        self.storage = storage
+        self._root = _optional_import('zarr', 'zarr', 'the grid store').open_group(self.path, mode='r+')
+        meta = self._root.attrs['barra2_dl']
+        self.grid = RegularGrid(**meta['grid'])
+        self.row0, self.col0 = meta['row0'], meta['col0']
+        self.origin = pd.Timestamp(meta['origin'])
+        self.sites = {site: tuple(position) for site, position in meta['sites'].items()}
+        self.variables = {var: tuple(array) for var, array in meta['variables'].items()}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(
+        cls,
+        path: str | Path,
+        latitudes: Sequence[float],
+        longitudes: Sequence[float],
+        sites: Sequence[str],
+        variables: Sequence[str],
+        start: str | datetime,
+        grid: RegularGrid = AUS11_GRID,
+        float32: bool = True,
+        time_chunk: int = 8760,
+        node_chunk: int = 1,
+        storage: Storage | None = None,
+    ) -> 'GridStore':
+        """Create an empty store for the box of grid nodes around the sites, replacing any store at path.
+
+        Args:
+            path (str | Path): Path of the store.
+            latitudes (Sequence[float]): Latitude of each site.
+            longitudes (Sequence[float]): Longitude of each site.
+            sites (Sequence[str]): File name prefix of each site.
+            variables (Sequence[str]): Variables, e.g. ['ua50m', 'va50m', 'ua100m', 'va100m'].
+            start (str | datetime): First hour of the time axis, files before it cannot be written.
+            grid (RegularGrid): Grid of the nodes.
+            float32 (bool): Store values as float32.
+            time_chunk (int): Hours in a chunk, a year by default.
+            node_chunk (int): Lat and lon nodes in a chunk, 1 for single node reads.
+            storage (Storage | None): Storage the downloads passed to the callback are cached in, see GridStore.
+
+        Returns:
+            GridStore: The store.
+
+        Raises:
+            ValueError: If the sites do not match or any site is outside the grid.
+        """
+        zarr = _optional_import('zarr', 'zarr', 'the grid store')
+        from zarr.codecs import BloscCodec
+
+        if not len(latitudes) == len(longitudes) == len(sites):
+            raise ValueError('Number of latitudes, longitudes and sites must match.')
+        rows, cols = _nearest_nodes(grid, latitudes, longitudes)
+        row0, col0 = int(rows.min()), int(cols.min())
+        n_lat, n_lon = int(rows.max()) - row0 + 1, int(cols.max()) - col0 + 1
+        split = {var: _split_var(var) for var in dict.fromkeys(variables)}
+        heights = sorted({height for _name, height in split.values() if height is not None})
+        origin = pd.Timestamp(start).floor('h')
+        origin = origin.tz_convert('UTC').tz_localize(None) if origin.tz is not None else origin
+
+        root = zarr.open_group(Path(path), mode='w')
+        time = root.create_array('time', shape=(0,), chunks=(time_chunk,), dtype='int64', dimension_names=('time',))
+        time.attrs.update({'units': f'hours since {origin:%Y-%m-%d %H:%M:%S}', 'calendar': 'proleptic_gregorian',
+                           'standard_name': 'time'})
+        coordinates = [
+            ('height', np.array(heights, dtype=np.int32), {'units': 'm', 'positive': 'up'}),
+            ('lat', np.array([grid.node(row0 + row, 0)[0] for row in range(n_lat)]),
+             {'units': 'degrees_north', 'standard_name': 'latitude'}),
+            ('lon', np.array([grid.node(0, col0 + col)[1] for col in range(n_lon)]),
+             {'units': 'degrees_east', 'standard_name': 'longitude'}),
+        ]
+        for name, values, attrs in coordinates:
+            root.create_array(name, data=values, dimension_names=(name,)).attrs.update(attrs)
+        compressor = BloscCodec(cname='zstd', clevel=5, shuffle='shuffle')
+        for name in dict.fromkeys(name for name, _height in split.values()):
+            has_height = any(height is not None for array, height in split.values() if array == name)
+            root.create_array(
+                name,
+                shape=(0, len(heights), n_lat, n_lon) if has_height else (0, n_lat, n_lon),
+                chunks=(time_chunk, 1, node_chunk, node_chunk) if has_height else (time_chunk, node_chunk, node_chunk),
+                dtype='float32' if float32 else 'float64',
+                fill_value=np.nan,
+                compressors=compressor,
+                dimension_names=('time', 'height', 'lat', 'lon') if has_height else ('time', 'lat', 'lon'),
+            )
+        root.attrs['barra2_dl'] = {
+            'grid': asdict(grid),
+            'row0': row0,
+            'col0': col0,
+            'origin': origin.isoformat(),
+            'sites': {site: [int(row) - row0, int(col) - col0] for site, row, col in zip(sites, rows, cols,
+                                                                                         strict=True)},
+            'variables': {var: [name, heights.index(height) if height is not None else None]
+                          for var, (name, height) in split.items()},
+        }
+        return cls(path, storage)
+
+    @classmethod
+    def from_plan(
+        cls,
+        path: str | Path,
+        plan: PointDataPlan,
+        grid: RegularGrid = AUS11_GRID,
+        **kwargs: Any,
+    ) -> 'GridStore':
+        """Create an empty store for the sites, variables and period of a download plan, see GridStore.create."""
+        year, month = plan._months[0][:2]
+        # files of a plan without prefixes are named None_{var}_..., see PointDataPlan
+        sites = [str(prefix) for prefix in plan.fileout_prefixes]
+        return cls.create(path, plan.latitudes, plan.longitudes, sites, plan.barra2_vars, datetime(year, month, 1),
+                          grid, **kwargs)
+
+    def __len__(self) -> int:
+        """Number of hours in the time axis."""
+        return int(self._root['time'].shape[0])
+
+    def _position(
+        self,
+        latitude: float,
+        longitude: float,
+    ) -> tuple[int, int]:
+        """Lat and lon position of the nearest node to a location.
+
+        Raises:
+            ValueError: If the nearest node is outside the store.
+        """
+        rows, cols = _nearest_nodes(self.grid, [latitude], [longitude])
+        lat_index, lon_index = int(rows[0]) - self.row0, int(cols[0]) - self.col0
+        n_lat, n_lon = self._root['lat'].shape[0], self._root['lon'].shape[0]
+        if not (0 <= lat_index < n_lat and 0 <= lon_index < n_lon):
+            raise ValueError(f'Location <{latitude}, {longitude}> is outside the nodes of the store.')
+        return lat_index, lon_index
+
+    def _site_position(
+        self,
+        site: str,
+        path: Path,
+    ) -> tuple[int, int]:
+        """Lat and lon position of a site, located from its file and recorded if not created with the store."""
+        if site not in self.sites:
+            location = _read_location(path)
+            self.sites[site] = self._position(location['latitude'], location['longitude'])
+            meta = dict(self._root.attrs['barra2_dl'])
+            meta['sites'] = {name: list(position) for name, position in self.sites.items()}
+            self._root.attrs['barra2_dl'] = meta
+        return self.sites[site]
+
+    def _grow(
+        self,
+        length: int,
+    ) -> None:
+        """Extend the time axis of all arrays to length hours."""
+        time = self._root['time']
+        start = time.shape[0]
+        if length <= start:
+            return
+        for var_name, array in self._root.arrays():
+            if var_name not in ('time', 'height', 'lat', 'lon'):
+                array.resize((length, *array.shape[1:]))
+        time.resize((length,))
+        time[start:length] = np.arange(start, length, dtype=np.int64)
+
+    def write_file(
+        self,
+        path: str | Path,
+    ) -> int:
+        """Write a cached file to the store, replacing any values of the same hours.
+
+        Args:
+            path (str | Path): Cached file, compressed or not.
+
+        Returns:
+            int: Number of hours written.
+
+        Raises:
+            ValueError: If the file name is not a cached file name, the variable is not in the store, or the file
+                starts before the store or is outside its nodes.
+        """
+        path = Path(path)
+        parsed = parse_filename(path.name)
+        if parsed is None:
+            raise ValueError(f'<{path.name}> is not a cached file name.')
+        if parsed['var'] not in self.variables:
+            raise ValueError(f"Variable <{parsed['var']}> is not in the store, use one of {list(self.variables)}.")
+        name, height_index = self.variables[parsed['var']]
+        data = _read_file(parsed['prefix'], path, self._root[name].dtype.type)
+        if not len(data.times):
+            return 0
+        positions = (data.times - self.origin.as_unit('ns').value) // _HOUR_NS
+        if positions[0] < 0:
+            raise ValueError(f'<{path.name}> starts before the store at {self.origin}.')
+        with self._lock:
+            lat_index, lon_index = self._site_position(parsed['prefix'], path)
+            node = (lat_index, lon_index) if height_index is None else (height_index, lat_index, lon_index)
+            self._grow(int(positions.max()) + 1)
+            array = self._root[name]
+            if np.all(np.diff(positions) == 1):
+                array[(slice(int(positions[0]), int(positions[-1]) + 1), *node)] = data.values
+            else:
+                array.oindex[(positions, *node)] = data.values
+            array.attrs['units'] = data.unit
+        return len(positions)
+
+    def __call__(
+        self,
+        event: Event,
+    ) -> None:
+        """Download callback writing each cached file of a variable in the store as it is downloaded.
+
+        Files are read from the local folder of the event, or from the local mirror of the storage of the store.
+        """
+        if not isinstance(event, DownloadEvent) or event.status not in _CACHED_STATUSES or not event.folder_path:
+            return
+        if self.storage is not None:
+            paths = self.storage.local_files(event.file_name)
+            path = paths[0] if paths else None
+        else:
+            path = cached_path(event.folder_path, event.file_name)
+        parsed = parse_filename(event.file_name)
+        if path is None or parsed is None or parsed['var'] not in self.variables:
+            logger.warning(f'<{event.file_name}> is not a cached file of a variable in the store, not written.')
+            return
+        self.write_file(path)
+
+    def read_node(
+        self,
+        latitude: float,
+        longitude: float,
+        variables: Sequence[str] | None = None,
+        start: str | datetime | None = None,
+        end: str | datetime | None = None,
+    ) -> pd.DataFrame:
+        """Time series of the nearest node to a location, reading only the chunks of the node and period.
+
+        Args:
+            latitude (float): Latitude of the location.
+            longitude (float): Longitude of the location.
+            variables (Sequence[str] | None): Variables, e.g. ['ua50m'], defaults to all variables.
+            start (str | datetime | None): Start of the inclusive period, UTC if naive, defaults to the first hour.
+            end (str | datetime | None): End of the inclusive period, UTC if naive, defaults to the last hour.
+
+        Returns:
+            pd.DataFrame: A column per variable indexed by UTC time.
+
+        Raises:
+            ValueError: If the location is outside the nodes of the store.
+        """
+        lat_index, lon_index = self._position(latitude, longitude)
+        first = self._hour(start, 0)
+        last = self._hour(end, len(self) - 1)
+        first, last = max(first, 0), min(last, len(self) - 1)
+        hours = np.arange(first, last + 1)
+        columns = {}
+        for var in variables if variables is not None else self.variables:
+            name, height_index = self.variables[var]
+            node = (lat_index, lon_index) if height_index is None else (height_index, lat_index, lon_index)
+            columns[var] = self._root[name][(slice(first, last + 1), *node)] if len(hours) else np.array([])
+        index = pd.DatetimeIndex(self.origin + pd.to_timedelta(hours, unit='h'), name='time')
+        index = index.as_unit('ns').tz_localize('UTC')
+        return pd.DataFrame(columns, index=index)
+
+    def _hour(
+        self,
+        value: str | datetime | None,
+        default: int,
+    ) -> int:
+        """Hour position of a time, or default if None."""
+        if value is None:
+            return default
+        timestamp = pd.Timestamp(value)
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None) if timestamp.tz is not None else timestamp
+        return int((timestamp - self.origin) // pd.Timedelta(hours=1))
+
+
+def write_grid_store(
+    filein_folder: str | Path,
+    store_path: str | Path,
+    sites: Sequence[str] | None = None,
+    filename_pattern: str = '*.csv',
+    grid: RegularGrid = AUS11_GRID,
+    callback: EventCallback | None = None,
+    quiet: bool = True,
+    **kwargs: Any,
+) -> GridStore:
+    """Write the cached files of many sites to a grid store, creating it from the cache if it does not exist.
+
+    Args:
+        filein_folder (str | Path): Cache folder.
+        store_path (str | Path): Path of the store.
+        sites (Sequence[str] | None): File name prefixes of the sites, defaults to all sites in the folder.
+        filename_pattern (str): Filename matching pattern.
+        grid (RegularGrid): Grid of the nodes, used if the store is created.
+        callback (EventCallback | None): Optional callable receiving a StageEvent for each site written.
+        quiet (bool): If True nothing is written to stdout.
+        **kwargs: float32, time_chunk and node_chunk of GridStore.create, used if the store is created.
+
+    Returns:
+        GridStore: The store.
+
+    Raises:
+        ValueError: If there are no cached files, or a file does not fit an existing store.
+    """
+    files = {site: paths for site, paths in panel_files(filein_folder, sites, filename_pattern).items() if paths}
+    if not files:
+        raise ValueError(f'No cached files in <{filein_folder}> for the grid store.')
+    if (Path(store_path) / 'zarr.json').exists():
+        store = GridStore(store_path)
+    else:
+        locations = [_read_location(paths[0]) for paths in files.values()]
+        # panel_files lists only files whose names parse, so nothing is dropped
+        names = [path.name for paths in files.values() for path in paths]
+        parsed = [data for data in map(parse_filename, names) if data is not None]
+        store = GridStore.create(
+            store_path,
+            [location['latitude'] for location in locations],
+            [location['longitude'] for location in locations],
+            list(files),
+            sorted({data['var'] for data in parsed}),
+            min(data['start'] for data in parsed),
+            grid,
+            **kwargs,
+        )
+    for site, paths in files.items():
+        with stage('zarr_write', detail=f'Wrote site {site}', callback=callback, quiet=quiet) as write_stage:
+            write_stage.rows = sum(store.write_file(path) for path in paths)
+    return store
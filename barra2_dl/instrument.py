@@ -0,0 +1,314 @@
+"""This module contains the barra2 instrumentation classes and function(s).
+
+Download, merge and convert functions report progress as events rather than writing directly to stdout. Events are
+passed to an optional callback, which can be any callable accepting a single event, e.g. a Metrics instance or a
+user defined function. By default events are also written to stdout as a single line per event, which can be disabled
+with quiet=True to remove the per-file stdout cost entirely. Listeners added with add_listener receive every event
+from every function, which is used by barra2_dl.profiling to wrap any of the public functions.
+
+Example:
+    >>> metrics = Metrics()
+    >>> emit(DownloadEvent('demo.csv', 'downloaded', nbytes=10), callback=metrics, quiet=True)
+    >>> metrics.counters['files_downloaded']
+    1
+"""
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'DownloadEvent',
+    'StageEvent',
+    'ConcurrencyEvent',
+    'Metrics',
+    'emit',
+    'stage',
+    'add_listener',
+    'remove_listener',
+]
+
+
+@dataclass
+class DownloadEvent:
+    """Event reported for each file handled by the downloaders.
+
+    Attributes:
+        file_name (str): Name of the downloaded file.
+        status (str): One of 'downloaded', 'exists', 'failed', or on refresh 'updated' or 'not_modified'.
+        nbytes (int): Number of bytes downloaded, uncompressed.
+        latency (float): Seconds spent waiting on the network request.
+        retries (int): Number of retries before the final status.
+        status_code (int | None): HTTP status code of the final response, None if no request was made.
+        folder_path (str): Folder the file is saved to.
+        error (str): Validation error of the final response, if the file failed validation, or the error of the
+            final request, if it failed without a response.
+    """
+    file_name: str
+    status: str
+    nbytes: int = 0
+    latency: float = 0.0
+    retries: int = 0
+    status_code: int | None = None
+    folder_path: str = ''
+    error: str = ''
+
+    def message(self) -> str:
+        """Single line message used for stdout and logging."""
+        match self.status:
+            case 'downloaded':
+                return f'<{self.file_name}> downloaded to <{self.folder_path}>'
+            case 'exists':
+                return f'<{self.file_name}> already exists in the folder <{self.folder_path}>. File not downloaded.'
+            case 'updated':
+                return f'<{self.file_name}> revised, updated in <{self.folder_path}>'
+            case 'not_modified':
+                return f'<{self.file_name}> not modified in <{self.folder_path}>'
+            case _ if self.error and self.status_code is None:
+                return f'<{self.file_name}> Failed to download after {self.retries} retries: {self.error}'
+            case _ if self.error:
+                return f'<{self.file_name}> Failed validation after {self.retries} retries: {self.error}'
+            case _:
+                return f'<{self.file_name}> Failed to download. Status code: {self.status_code}'
+
+
+@dataclass
+class StageEvent:
+    """Event reported at the end of a timed stage, e.g. download, csv parse, join or convert.
+
+    Attributes:
+        stage (str): Stage name.
+        seconds (float): Wall time of the stage in seconds.
+        detail (str): Optional message, e.g. the file or columns processed. Defaults to the stage time.
+        cpu_seconds (float): Process CPU time of the stage in seconds.
+        peak_bytes (int): Peak traced memory above the start of the stage, 0 if tracemalloc is not tracing or the
+            stage is not on the main thread.
+        rows (int): Number of rows processed, if set by the stage.
+        nbytes (int): Number of bytes processed, if set by the stage.
+    """
+    stage: str
+    seconds: float = 0.0
+    detail: str = ''
+    cpu_seconds: float = 0.0
+    peak_bytes: int = 0
+    rows: int = 0
+    nbytes: int = 0
+
+    def message(self) -> str:
+        """Single line message used for stdout and logging."""
+        if self.detail:
+            return self.detail
+        return f'{self.stage.capitalize()} time: <{self.seconds}>'
+
+
+@dataclass
+class ConcurrencyEvent:
+    """Event reported when an adaptive downloader changes the number of in-flight requests.
+
+    Attributes:
+        concurrency (int): Number of requests allowed in flight.
+        reason (str): Why the limit changed, e.g. 'start', 'increase', 'throttled', 'error' or 'latency'.
+    """
+    concurrency: int
+    reason: str = ''
+
+    def message(self) -> str:
+        """Single line message used for stdout and logging."""
+        return f'Download concurrency: <{self.concurrency}> ({self.reason})'
+
+
+type Event = DownloadEvent | StageEvent | ConcurrencyEvent
+type EventCallback = Callable[[Event], None]
+
+# stdout writes are serialised so lines from download threads are not interleaved
+_stdout_lock = threading.Lock()
+
+# global listeners receiving every event, e.g. an active barra2_dl.profiling.Profiler
+_listeners: list[EventCallback] = []
+_listeners_lock = threading.Lock()
+
+# stack of [start_current, max_peak] for nested stages on the main thread when tracemalloc is tracing
+_stage_memory = threading.local()
+
+
+def add_listener(
+    listener: EventCallback,
+) -> None:
+    """Add a global listener that receives every event emitted.
+
+    Args:
+        listener (EventCallback): Callable receiving each event.
+
+    Returns: None
+    """
+    with _listeners_lock:
+        _listeners.append(listener)
+
+
+def remove_listener(
+    listener: EventCallback,
+) -> None:
+    """Remove a global listener added with add_listener.
+
+    Args:
+        listener (EventCallback): Listener to remove.
+
+    Returns: None
+
+    Raises:
+        ValueError: If the listener was not added.
+    """
+    with _listeners_lock:
+        _listeners.remove(listener)
+
+
+def emit(
+    event: Event,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+) -> None:
+    """Report an event to the logger, the optional callback and stdout unless quiet.
+
+    Args:
+        event (Event): The event to report.
+        callback (EventCallback | None): Optional callable receiving the event.
+        quiet (bool): If True nothing is written to stdout.
+
+    Returns: None
+    """
+    message = event.message()
+    logger.info(message)
+    if callback is not None:
+        callback(event)
+    for listener in tuple(_listeners):
+        listener(event)
+    if not quiet:
+        with _stdout_lock:
+            sys.stdout.write(message + '\n')
+
+
+@contextmanager
+def stage(
+    name: str,
+    detail: str = '',
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+) -> Iterator[StageEvent]:
+    """Context manager to time a stage and emit a StageEvent on exit.
+
+    The yielded event can be updated with rows and nbytes processed before exit. Peak memory is only recorded when
+    tracemalloc is tracing, nested stages on the same thread are accounted to both the inner and outer stage.
+    tracemalloc has a single process-wide peak, which each stage resets, so peaks are only recorded for stages on the
+    main thread. Stages on other threads, e.g. download threads, report 0 and their memory counts toward the enclosing
+    stage on the main thread.
+
+    Args:
+        name (str): Stage name.
+        detail (str): Optional message, e.g. the file or columns processed.
+        callback (EventCallback | None): Optional callable receiving the event.
+        quiet (bool): If True nothing is written to stdout.
+
+    Yields:
+        StageEvent: The event emitted on exit.
+    """
+    event = StageEvent(name, detail=detail)
+    # concurrent stages on other threads would reset the peak of each other and of the main thread stage
+    tracing = tracemalloc.is_tracing() and threading.current_thread() is threading.main_thread()
+    stack: list[list[int]] = _stage_memory.__dict__.setdefault('stack', [])
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        stack.append([current, 0])
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    try:
+        yield event
+    finally:
+        event.seconds = time.perf_counter() - t0
+        event.cpu_seconds = time.process_time() - c0
+        if tracing:
+            start_current, max_peak = stack.pop()
+            peak = max(max_peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            event.peak_bytes = max(peak - start_current, 0)
+    emit(event, callback=callback, quiet=quiet)
+
+
+@dataclass
+class Metrics:
+    """Thread safe event callback collecting counters and gauges for export in Prometheus/OpenMetrics text format.
+
+    Attributes:
+        counters (dict[str, float]): Accumulated counter values by metric name.
+        gauges (dict[str, float]): Last reported gauge values by metric name, e.g. download_concurrency.
+        events (list[Event]): All events received if keep_events is True.
+        keep_events (bool): Keep a copy of every event received.
+    """
+    counters: dict[str, float] = field(default_factory=dict)
+    gauges: dict[str, float] = field(default_factory=dict)
+    events: list[Event] = field(default_factory=list)
+    keep_events: bool = False
+
+    def __post_init__(self) -> None:
+        """Set lock used by download threads."""
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Event) -> None:
+        """Update counters from an event."""
+        with self._lock:
+            if self.keep_events:
+                self.events.append(event)
+            if isinstance(event, DownloadEvent):
+                self._add(f'files_{event.status}', 1)
+                self._add('bytes_downloaded', event.nbytes)
+                self._add('request_seconds', event.latency)
+                self._add('retries', event.retries)
+            elif isinstance(event, StageEvent):
+                self._add(f'stage_{event.stage}_seconds', event.seconds)
+                self._add(f'stage_{event.stage}_count', 1)
+            elif isinstance(event, ConcurrencyEvent):
+                self.gauges['download_concurrency'] = event.concurrency
+                self._add(f'concurrency_{event.reason}', 1)
+
+    def _add(self, name: str, value: float) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def iter_events(self) -> Iterator[dict[str, Any]]:
+        """Iterate over the kept events as dictionaries."""
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            yield {'type': type(event).__name__, **asdict(event)}
+
+    def to_openmetrics(self, prefix: str = 'barra2_dl') -> str:
+        """Export counters and gauges in Prometheus/OpenMetrics text format.
+
+        Args:
+            prefix (str): Metric name prefix.
+
+        Returns:
+            str: Text exposition of all counters and gauges.
+        """
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f'{prefix}_{name}'
+                lines.append(f'# TYPE {metric} counter')
+                lines.append(f'{metric}_total {value}')
+            for name, value in sorted(self.gauges.items()):
+                metric = f'{prefix}_{name}'
+                lines.append(f'# TYPE {metric} gauge')
+                lines.append(f'{metric} {value}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
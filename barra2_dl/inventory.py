@@ -0,0 +1,217 @@
+"""This module contains the barra2 offline cache inventory class and function(s).
+
+Compute nodes without network access can still plan, merge and convert from a cache filled elsewhere. A
+CacheInventory indexes the planned names of the files in a cache folder in memory, built once by a single scan of
+the folder or from the names recorded in the cache manifest, so each planned file is a dict lookup rather than a stat
+or a glob. Resolving a plan against the inventory fails fast with the list of missing files, before any file is read,
+and download_offline serves a plan from the cache with the same exists DownloadEvents as the downloaders, without
+importing requests, so download callbacks such as a GridStore still receive every file.
+"""
+import fnmatch
+import logging
+import os
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from barra2_dl.compression import COMPRESSIONS, plain_name
+from barra2_dl.download import PointDataPlan, URLFilenamePair
+from barra2_dl.instrument import DownloadEvent, EventCallback, emit, stage
+from barra2_dl.manifest import _MANIFEST_NAME, CacheManifest
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'CacheInventory',
+    'download_offline',
+]
+
+# number of missing files listed in the error message
+_MISSING_LISTED = 10
+
+
+def _plan_file_names(
+    urlfilenames: Iterable[URLFilenamePair],
+) -> Iterator[str]:
+    """Planned file names of a plan, without formatting the URLs of a PointDataPlan."""
+    if isinstance(urlfilenames, PointDataPlan):
+        return urlfilenames.file_names()
+    return (file_name for _url, file_name in urlfilenames)
+
+
+class CacheInventory:
+    """In memory index of the files in a cache folder by planned name, see the module description.
+
+    Attributes:
+        folder_path (Path): Cache folder.
+
+    Example:
+        >>> inventory = CacheInventory('cache', ['a_ua50m_20230101_20230131.csv.gz', 'a_ua50m_20230201_20230228.csv'])
+        >>> 'a_ua50m_20230101_20230131.csv' in inventory, inventory.path('a_ua50m_20230101_20230131.csv').name
+        (True, 'a_ua50m_20230101_20230131.csv.gz')
+        >>> inventory.missing([('url', 'a_ua50m_20230301_20230331.csv')])
+        ['a_ua50m_20230301_20230331.csv']
+    """
+
+    def __init__(
+        self,
+        folder_path: str | Path,
+        file_names: Iterable[str],
+    ):
+        """Index the names of cached files, see CacheInventory.scan and CacheInventory.from_manifest.
+
+        Args:
+            folder_path (str | Path): Cache folder.
+            file_names (Iterable[str]): Names of the cached files, uncompressed or compressed. A file cached in more
+                than one form is indexed once, preferring the uncompressed file.
+        """
+        self.folder_path = Path(folder_path)
+        self._files: dict[str, str] = {}
+        for file_name in sorted(file_names, key=len):
+            self._files.setdefault(plain_name(file_name), file_name)
+
+    @classmethod
+    def scan(
+        cls,
+        folder_path: str | Path,
+    ) -> 'CacheInventory':
+        """Inventory of a cache folder from a single scan of the folder.
+
+        Args:
+            folder_path (str | Path): Cache folder.
+
+        Returns:
+            CacheInventory: The inventory.
+
+        Raises:
+            FileNotFoundError: If the folder does not exist.
+        """
+        if not Path(folder_path).is_dir():
+            raise FileNotFoundError(f'The cache folder <{folder_path}> does not exist.')
+        with os.scandir(folder_path) as entries:
+            # skip the manifest, memoised frames and partial files of downloads in progress
+            file_names = [entry.name for entry in entries
+                          if entry.is_file() and not entry.name.startswith('_') and not entry.name.endswith('.tmp')]
+        return cls(folder_path, file_names)
+
+    @classmethod
+    def from_manifest(
+        cls,
+        folder_path: str | Path,
+        compression: str | None = None,
+    ) -> 'CacheInventory':
+        """Inventory of the files recorded in the cache manifest, without listing the folder.
+
+        The manifest records the planned names of downloaded files, so files are assumed stored with the compression
+        they were downloaded with, and files deleted since they were recorded are not detected.
+
+        Args:
+            folder_path (str | Path): Cache folder.
+            compression (str | None): Compression of the cached files, 'gzip' or 'zstd', or None if uncompressed.
+
+        Returns:
+            CacheInventory: The inventory.
+
+        Raises:
+            FileNotFoundError: If the folder has no manifest.
+            ValueError: If the compression is not supported.
+        """
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f'Unsupported compression <{compression}>, use one of {list(COMPRESSIONS)} or None.')
+        if not (Path(folder_path) / _MANIFEST_NAME).is_file():
+            raise FileNotFoundError(f'The cache folder <{folder_path}> has no manifest.')
+        suffix = COMPRESSIONS[compression] if compression is not None else ''
+        return cls(folder_path, [f'{file_name}{suffix}' for file_name in CacheManifest(folder_path).items()])
+
+    def __len__(self) -> int:
+        """Number of cached files."""
+        return len(self._files)
+
+    def __contains__(self, file_name: str) -> bool:
+        """True if the planned file is cached, uncompressed or compressed."""
+        return plain_name(file_name) in self._files
+
+    def __iter__(self) -> Iterator[str]:
+        """Planned names of the cached files."""
+        return iter(self._files)
+
+    def path(
+        self,
+        file_name: str,
+    ) -> Path | None:
+        """Path of a planned file in the cache, uncompressed or compressed, or None if not cached."""
+        cached = self._files.get(plain_name(file_name))
+        return self.folder_path / cached if cached is not None else None
+
+    def files(
+        self,
+        filename_pattern: str = '*.csv',
+    ) -> list[Path]:
+        """Cached files whose planned name matches filename_pattern, sorted by planned name, see cached_files."""
+        return [self.folder_path / self._files[file_name]
+                for file_name in sorted(fnmatch.filter(self._files, filename_pattern))]
+
+    def missing(
+        self,
+        urlfilenames: Iterable[URLFilenamePair],
+    ) -> list[str]:
+        """Planned file names of a plan that are not cached, in plan order."""
+        return [file_name for file_name in _plan_file_names(urlfilenames) if file_name not in self._files]
+
+    def resolve(
+        self,
+        urlfilenames: Iterable[URLFilenamePair],
+    ) -> list[Path]:
+        """Paths of the cached files of a plan, in plan order.
+
+        Args:
+            urlfilenames (Iterable[URLFilenamePair]): A list or PointDataPlan of the planned files.
+
+        Returns:
+            list[Path]: Path of each planned file.
+
+        Raises:
+            FileNotFoundError: If any planned file is not cached, listing the first missing files.
+        """
+        file_names = list(_plan_file_names(urlfilenames))
+        missing = [file_name for file_name in file_names if file_name not in self._files]
+        if missing:
+            listed = ', '.join(missing[:_MISSING_LISTED]) + (', ...' if len(missing) > _MISSING_LISTED else '')
+            raise FileNotFoundError(f'{len(missing)} of {len(file_names)} planned files are not in the cache '
+                                    f'<{self.folder_path}>: {listed}')
+        return [self.folder_path / self._files[file_name] for file_name in file_names]
+
+
+def download_offline(
+    urlfilenames: Iterable[URLFilenamePair],
+    folder_path: str | Path,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+    inventory: CacheInventory | None = None,
+) -> list[Path]:
+    """Serve a plan from the cache without network access, in place of download_serial or download_multithread.
+
+    Every planned file is resolved against the inventory before any event is emitted, so an incomplete cache fails
+    fast. An exists DownloadEvent is then emitted for each file.
+
+    Args:
+        urlfilenames (Iterable[URLFilenamePair]): A list or PointDataPlan of the planned files.
+        folder_path (str | Path): Cache folder.
+        callback (EventCallback | None): Optional callable receiving a DownloadEvent per file and a StageEvent for
+            the total time.
+        quiet (bool): If True nothing is written to stdout.
+        inventory (CacheInventory | None): Inventory of the cache folder, defaults to a scan of the folder.
+
+    Returns:
+        list[Path]: Path of each planned file.
+
+    Raises:
+        FileNotFoundError: If the folder does not exist or any planned file is not cached.
+    """
+    inventory = inventory if inventory is not None else CacheInventory.scan(folder_path)
+    paths = inventory.resolve(urlfilenames)
+    with stage('download', detail=f'Served {len(paths)} files from the cache', callback=callback, quiet=quiet):
+        for path in paths:
+            emit(DownloadEvent(plain_name(path.name), 'exists', folder_path=str(folder_path)), callback=callback,
+                 quiet=quiet)
+    return paths
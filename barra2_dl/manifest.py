@@ -0,0 +1,200 @@
+"""This module contains the barra2 cache manifest classes.
+
+BARRA2 urls point at the /latest/ version of the data, so recent months can be revised after they are cached. The
+downloaders record the HTTP validators of each cached file, ETag, Last-Modified and Content-Length, in a manifest in
+the cache folder, an SQLite database safe to share between threads, processes and hosts like the distribute work
+queue. Refreshing a cache sends conditional requests with these validators, so unchanged files are answered with a
+304 Not Modified and no content, and only revised files are transferred again. The number of data rows of each
+downloaded file is recorded too, so barra2_dl.cache can check the completeness of unchanged files without reading them.
+"""
+import logging
+import sqlite3
+import time
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+from dataclasses import astuple, dataclass
+from email.utils import formatdate
+from pathlib import Path
+
+from barra2_dl.compression import COMPRESSIONS
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'Validators',
+    'CacheManifest',
+]
+
+_MANIFEST_NAME = '_manifest.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS validators (
+    file_name TEXT PRIMARY KEY,
+    etag TEXT NOT NULL DEFAULT '',
+    last_modified TEXT NOT NULL DEFAULT '',
+    content_length INTEGER,
+    checked REAL NOT NULL DEFAULT 0,
+    rows INTEGER
+);
+"""
+
+_COLUMNS = 'etag, last_modified, content_length, checked, rows'
+
+
+@dataclass
+class Validators:
+    """HTTP validators of a cached file.
+
+    Attributes:
+        etag (str): ETag response header, empty if not sent by the server.
+        last_modified (str): Last-Modified response header, empty if not sent by the server.
+        content_length (int | None): Number of bytes of the cached content.
+        checked (float): Unix time the file was last downloaded or revalidated.
+        rows (int | None): Number of data rows of the cached content, excluding the header line.
+    """
+    etag: str = ''
+    last_modified: str = ''
+    content_length: int | None = None
+    checked: float = 0.0
+    rows: int | None = None
+
+    @classmethod
+    def from_headers(
+        cls,
+        headers: Mapping[str, str],
+        content_length: int,
+        rows: int | None = None,
+    ) -> 'Validators':
+        """Validators from the headers, content length and number of data rows of a 200 response."""
+        return cls(headers.get('ETag', ''), headers.get('Last-Modified', ''), content_length, time.time(), rows)
+
+    def request_headers(self) -> dict[str, str]:
+        """Conditional request headers, If-None-Match and If-Modified-Since.
+
+        Example:
+            >>> Validators(etag='"abc"', last_modified='Wed, 01 Feb 2023 00:00:00 GMT').request_headers()
+            {'If-None-Match': '"abc"', 'If-Modified-Since': 'Wed, 01 Feb 2023 00:00:00 GMT'}
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+def _conditional_headers(
+    path: str | Path,
+    validators: Validators | None,
+    stat: tuple[int, float] | None = None,
+) -> dict[str, str]:
+    """Conditional request headers to revalidate a cached file.
+
+    Files without recorded validators, e.g. downloaded before the manifest, are revalidated by their modification
+    time. Uncompressed files whose size differs from the recorded Content-Length are not revalidated, so they are
+    downloaded again.
+
+    Args:
+        path (str | Path): Path of the cached file, or its name in a Storage.
+        validators (Validators | None): Recorded validators of the file, if any.
+        stat (tuple[int, float] | None): Size and modification time of the file, defaults to those of path.
+
+    Returns:
+        dict[str, str]: Request headers, empty to request the file unconditionally.
+    """
+    path = Path(path)
+    size, mtime = stat if stat is not None else (path.stat().st_size, path.stat().st_mtime)
+    if validators is None:
+        return {'If-Modified-Since': formatdate(mtime, usegmt=True)}
+    compressed = path.suffix in COMPRESSIONS.values()
+    if validators.content_length is not None and not compressed and validators.content_length != size:
+        logger.warning(f'<{path.name}> is {size} bytes, not {validators.content_length}, downloading again.')
+        return {}
+    return validators.request_headers()
+
+
+class CacheManifest:
+    """Validators of the files in a cache folder, in an SQLite database in the folder.
+
+    Attributes:
+        path (Path): Path of the SQLite database.
+        timeout (float): Seconds to wait for a lock held by another thread or process.
+    """
+
+    def __init__(self, folder_path: str | Path, timeout: float = 60.0):
+        """Open or create the manifest of a cache folder.
+
+        Args:
+            folder_path (str | Path): Cache folder, which must exist.
+            timeout (float): Seconds to wait for a lock held by another thread or process.
+        """
+        self.path = Path(folder_path) / _MANIFEST_NAME
+        self.timeout = timeout
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(validators)')}
+            if 'rows' not in columns:
+                # manifests written before row counts were recorded
+                try:
+                    connection.execute('ALTER TABLE validators ADD COLUMN rows INTEGER')
+                except sqlite3.OperationalError:
+                    # added by another process in the meantime
+                    pass
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Autocommit connection closed on exit."""
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def get(
+        self,
+        file_name: str,
+    ) -> Validators | None:
+        """Recorded validators of a cached file, or None if not recorded."""
+        with self._connect() as connection:
+            row = connection.execute(
+                f'SELECT {_COLUMNS} FROM validators WHERE file_name = ?',
+                (file_name,),
+            ).fetchone()
+        return Validators(*row) if row is not None else None
+
+    def put(
+        self,
+        file_name: str,
+        validators: Validators,
+    ) -> None:
+        """Record the validators of a cached file, replacing any recorded before."""
+        with self._connect() as connection:
+            connection.execute(
+                f'INSERT OR REPLACE INTO validators (file_name, {_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+                (file_name, *astuple(validators)),
+            )
+
+    def touch(
+        self,
+        file_name: str,
+    ) -> None:
+        """Record that a cached file was revalidated now."""
+        with self._connect() as connection:
+            connection.execute('UPDATE validators SET checked = ? WHERE file_name = ?', (time.time(), file_name))
+
+    def remove(
+        self,
+        file_name: str,
+    ) -> None:
+        """Forget the validators of a file, e.g. after it is deleted from the cache."""
+        with self._connect() as connection:
+            connection.execute('DELETE FROM validators WHERE file_name = ?', (file_name,))
+
+    def items(self) -> dict[str, Validators]:
+        """Validators of all recorded files by file name."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                f'SELECT file_name, {_COLUMNS} FROM validators ORDER BY file_name',
+            ).fetchall()
+        return {row[0]: Validators(*row[1:]) for row in rows}
@@ -1,5 +1,9 @@
 """This modules contains helper geo and mapping classes, constants and functions.
 
+Sites between grid nodes are interpolated from the surrounding nodes of the model grid. Weights are computed for a
+batch of sites at once, the unique nodes they need are planned for download once each, and the node time series are
+combined into site time series as a single vectorised weighted sum.
+
 References:
     https://stackoverflow.com/questions/79174938/how-to-fix-order-of-inherited-subclasses-in-python-dataclass/79174970
 
@@ -7,10 +11,26 @@ Todo:
     Draft functions to set grid for mapping support.
     Implement _format_lat_lon for converting lat lon for file naming
 """
+from collections.abc import Sequence
 from dataclasses import dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING, TypeVar
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+    from barra2_dl.download import PointDataPlan
+
+# supported methods of interpolation_weights
+_INTERPOLATION_METHODS = ('bilinear', 'idw', 'nearest')
 
-import numpy as np
-import pandas as pd
+# row and column offsets of the four nodes surrounding a site, from the south west node of its cell
+_CORNER_ROWS = (0, 0, 1, 1)
+_CORNER_COLS = (0, 1, 0, 1)
+
+# type of the subclass of _Geodetic created by _Geodetic.__new__
+_GeodeticT = TypeVar('_GeodeticT', bound='_Geodetic')
 
 
 class _Geodetic(float):
@@ -27,12 +47,12 @@ class _Geodetic(float):
     max = 0.0
     name = "Geodetic"
 
-    def __new__(cls, value):
+    def __new__(cls: type[_GeodeticT], value: float) -> _GeodeticT:
         instance = super().__new__(cls, value)
         instance._check_limits()
         return instance
 
-    def _check_limits(self):
+    def _check_limits(self) -> None:
         """We _ARE_ a float, so "self"  can be used directly for the value."""
         if not self.min <= self <= self.max:
             raise ValueError(f"{self.name} must be from {self.min} to {self.max}")
@@ -98,7 +118,7 @@ def _generate_point_grid(
     lat_res: float,
     lon_res: float,
     offset:bool = None,
-) -> pd.DataFrame:
+) -> 'pd.DataFrame':
     """Create a grid of longitude and latitude points between specified minimum and maximum values.
 
     Args:
@@ -118,6 +138,9 @@ def _generate_point_grid(
     Todo:
         Draft function and not yet implemented
     """
+    import numpy as np
+    import pandas as pd
+
     if isinstance(lat_lon_bbox, dict):
         required_keys = ['north', 'south', 'east', 'west']
         if not all(key in lat_lon_bbox for key in required_keys):
@@ -152,10 +175,10 @@ def _generate_point_grid(
 
 
 def _find_nearest_point(
-    df_point_grid: pd.DataFrame,
+    df_point_grid: 'pd.DataFrame',
     target_lat: float,
     target_lon: float,
-) -> pd.Series:
+) -> 'pd.Series':
     """Find the nearest point in a DataFrame of latitude, longitude points to a target point (target_lat, target_lon).
 
     Args:
@@ -176,7 +199,7 @@ def _find_nearest_point(
     if not (min_lat <= target_lat <= max_lat) or not (min_lon <= target_lon <= max_lon):
         raise ValueError("Target latitude and/or longitude are out of the range of the DataFrame's coordinates.")
 
-    distances = np.sqrt((df_point_grid['latitude'] - target_lat) ** 2 + (df_point_grid['longitude'] - target_lon) ** 2)
+    distances = ((df_point_grid['latitude'] - target_lat) ** 2 + (df_point_grid['longitude'] - target_lon) ** 2) ** 0.5
     nearest_index = distances.idxmin()
     return df_point_grid.loc[nearest_index]
 
@@ -204,3 +227,272 @@ def _format_lat_lon(
 
     return [formatted_lat, formatted_lon]
 
+
+@dataclass(frozen=True)
+class RegularGrid:
+    """Regular latitude longitude grid of model nodes.
+
+    Attributes:
+        south (float): Latitude of the southern row of nodes.
+        west (float): Longitude of the western column of nodes.
+        rows (int): Number of rows of nodes.
+        cols (int): Number of columns of nodes.
+        lat_res (float): Latitude spacing of the nodes in degrees.
+        lon_res (float): Longitude spacing of the nodes in degrees.
+
+    Example:
+        >>> AUS11_GRID.node(0, 1)
+        (-57.97, 88.59)
+        >>> AUS11_GRID.north
+        12.98
+    """
+    south: float
+    west: float
+    rows: int
+    cols: int
+    lat_res: float
+    lon_res: float
+
+    @property
+    def north(self) -> float:
+        """Latitude of the northern row of nodes."""
+        return self.node(self.rows - 1, 0)[0]
+
+    @property
+    def east(self) -> float:
+        """Longitude of the eastern column of nodes."""
+        return self.node(0, self.cols - 1)[1]
+
+    def node(
+        self,
+        row: int,
+        col: int,
+    ) -> tuple[float, float]:
+        """Latitude and longitude of the node in a row and column."""
+        return round(self.south + row * self.lat_res, 6), round(self.west + col * self.lon_res, 6)
+
+    def _cells(
+        self,
+        latitudes: 'np.ndarray',
+        longitudes: 'np.ndarray',
+    ) -> tuple['np.ndarray', 'np.ndarray', 'np.ndarray', 'np.ndarray']:
+        """Row and column of the south west node of the cell of each site, and the fractional offsets in the cell.
+
+        Raises:
+            ValueError: If any site is outside the grid.
+        """
+        import numpy as np
+
+        # longitudes west of the grid are wrapped, e.g. -170 is 190 on a grid crossing the antimeridian
+        longitudes = np.where(longitudes < self.west, longitudes + 360, longitudes)
+        # rounded so sites on a node or edge are not moved off it by floating point error
+        lat_positions = np.round((latitudes - self.south) / self.lat_res, 9)
+        lon_positions = np.round((longitudes - self.west) / self.lon_res, 9)
+        outside = ((lat_positions < 0) | (lat_positions > self.rows - 1)
+                   | (lon_positions < 0) | (lon_positions > self.cols - 1) | np.isnan(lat_positions + lon_positions))
+        if outside.any():
+            site = int(np.flatnonzero(outside)[0])
+            raise ValueError(f'Site {site} at <{latitudes[site]}, {longitudes[site]}> is outside the grid.')
+        # sites on the northern or eastern edge use the last cell
+        rows = np.minimum(np.floor(lat_positions).astype(np.int64), self.rows - 2)
+        cols = np.minimum(np.floor(lon_positions).astype(np.int64), self.cols - 2)
+        return rows, cols, lat_positions - rows, lon_positions - cols
+
+
+# BARRA-R2 AUS-11 grid, extents from http://www.bom.gov.au/research/publications/researchreports/BRR-067.pdf
+AUS11_GRID = RegularGrid(south=-57.97, west=88.48, rows=646, cols=1082, lat_res=0.11, lon_res=0.11)
+# No constant is defined for the BARRA-C2 AUST-04 grid until its extents are confirmed from the published data,
+# pass a RegularGrid of its extents to use it.
+
+
+@dataclass
+class InterpolationWeights:
+    """Weights of the grid nodes surrounding each site, from interpolation_weights.
+
+    The weights are a sparse sites x nodes matrix with at most four nodes per site, stored as the positions of the
+    nodes of each site in the unique nodes and their weights.
+
+    Attributes:
+        grid (RegularGrid): Grid of the nodes.
+        sites (list[str]): Name of each site.
+        node_rows (np.ndarray): Grid row of each unique node.
+        node_cols (np.ndarray): Grid column of each unique node.
+        indices (np.ndarray): Sites x 4 positions of the surrounding nodes of each site in the unique nodes.
+        weights (np.ndarray): Sites x 4 weights of the surrounding nodes, which sum to 1 for each site.
+    """
+    grid: RegularGrid
+    sites: list[str]
+    node_rows: 'np.ndarray'
+    node_cols: 'np.ndarray'
+    indices: 'np.ndarray'
+    weights: 'np.ndarray'
+
+    @property
+    def nodes(self) -> list[str]:
+        """File name prefix of each unique node, node_{row}_{col}."""
+        return [f'node_{row}_{col}' for row, col in zip(self.node_rows.tolist(), self.node_cols.tolist(), strict=True)]
+
+    def node_locations(self) -> list[tuple[float, float]]:
+        """Latitude and longitude of each unique node."""
+        return [self.grid.node(row, col) for row, col in zip(self.node_rows.tolist(), self.node_cols.tolist(),
+                                                              strict=True)]
+
+    def node_plan(
+        self,
+        barra2_url: str,
+        barra2_vars: Sequence[str],
+        start_datetime: str | datetime,
+        end_datetime: str | datetime,
+        fileout_type: str = 'csv_file',
+    ) -> 'PointDataPlan':
+        """Plan to download each unique node once, with the node names as file name prefixes.
+
+        Args:
+            barra2_url (str): Use from barra2-dl.globals
+            barra2_vars (Sequence[str]): Use from barra2-dl.globals or set explicitly
+            start_datetime (str | datetime): Used to define start of inclusive download period
+            end_datetime (str | datetime): Used to define end of inclusive download period
+            fileout_type (str): Output file option, 'csv_file'
+
+        Returns:
+            PointDataPlan: The plan of the node files.
+        """
+        from barra2_dl.download import PointDataPlan
+
+        latitudes, longitudes = zip(*self.node_locations(), strict=True)
+        return PointDataPlan(barra2_url, barra2_vars, latitudes, longitudes, start_datetime, end_datetime,
+                             self.nodes, fileout_type)
+
+    def apply(
+        self,
+        values: 'np.ndarray',
+    ) -> 'np.ndarray':
+        """Interpolate node time series to the sites.
+
+        Equivalent to multiplying by the transposed sparse weight matrix, as a weighted sum of the four gathered
+        node columns of each site.
+
+        Args:
+            values (np.ndarray): Time x nodes values, with columns in the order of nodes.
+
+        Returns:
+            np.ndarray: Time x sites interpolated values.
+
+        Raises:
+            ValueError: If the number of columns is not the number of nodes.
+        """
+        import numpy as np
+
+        values = np.asarray(values)
+        if values.ndim != 2 or values.shape[1] != len(self.node_rows):
+            raise ValueError(f'Values must have {len(self.node_rows)} node columns, not shape {values.shape}.')
+        interpolated: np.ndarray = values[:, self.indices[:, 0]] * self.weights[:, 0]
+        for corner in range(1, self.indices.shape[1]):
+            interpolated += values[:, self.indices[:, corner]] * self.weights[:, corner]
+        return interpolated
+
+    def interpolate_panel(
+        self,
+        df_panel: 'pd.DataFrame',
+    ) -> 'pd.DataFrame':
+        """Interpolate a wide panel of the nodes, from build_panel, to the sites.
+
+        Args:
+            df_panel (pd.DataFrame): Wide panel with (site, var) columns including every node for each variable.
+
+        Returns:
+            pd.DataFrame: Wide panel indexed by time with (site, var) columns of the sites.
+
+        Raises:
+            ValueError: If the panel is missing nodes of a variable.
+        """
+        import numpy as np
+        import pandas as pd
+
+        nodes = pd.Index(self.nodes)
+        variables = df_panel.columns.unique(level='var')
+        frames = {}
+        for var in variables:
+            df_var = df_panel.xs(var, axis=1, level='var')
+            missing = nodes.difference(df_var.columns)
+            if len(missing):
+                raise ValueError(f'Panel is missing {len(missing)} nodes of {var}, e.g. <{missing[0]}>.')
+            frames[var] = self.apply(df_var[nodes].to_numpy())
+        columns = pd.MultiIndex.from_product([self.sites, variables], names=['site', 'var'])
+        values = np.stack([frames[var] for var in variables], axis=2).reshape(len(df_panel), -1)
+        df_sites = pd.DataFrame(values, index=df_panel.index, columns=columns, copy=False)
+        df_sites.attrs = {'units': df_panel.attrs.get('units', {})}
+        return df_sites
+
+
+def interpolation_weights(
+    grid: RegularGrid,
+    latitudes: Sequence[float],
+    longitudes: Sequence[float],
+    sites: Sequence[str] | None = None,
+    method: str = 'bilinear',
+    power: float = 2.0,
+) -> InterpolationWeights:
+    """Interpolation weights of the four grid nodes surrounding each of a batch of sites.
+
+    Args:
+        grid (RegularGrid): Grid of the nodes, e.g. AUS11_GRID.
+        latitudes (Sequence[float]): Latitude of each site.
+        longitudes (Sequence[float]): Longitude of each site.
+        sites (Sequence[str] | None): Name of each site, defaults to the position of each site.
+        method (str): 'bilinear', 'idw' for inverse distance weighting, or 'nearest' for the nearest node.
+        power (float): Power of the inverse distances for 'idw'.
+
+    Returns:
+        InterpolationWeights: The weights, with nodes of zero weight left out of the unique nodes.
+
+    Raises:
+        ValueError: If the method is not supported, the sites do not match or any site is outside the grid.
+
+    Example:
+        >>> weights = interpolation_weights(AUS11_GRID, [-23.5, -23.52], [133.4, 133.41])
+        >>> weights.nodes
+        ['node_313_408', 'node_313_409', 'node_314_408', 'node_314_409']
+        >>> weights.weights.sum(axis=1).round(6).tolist()
+        [1.0, 1.0]
+    """
+    import numpy as np
+
+    if method not in _INTERPOLATION_METHODS:
+        raise ValueError(f'Unsupported interpolation method <{method}>, use one of {list(_INTERPOLATION_METHODS)}.')
+    site_lats = np.asarray(latitudes, dtype=np.float64).ravel()
+    site_lons = np.asarray(longitudes, dtype=np.float64).ravel()
+    sites = list(sites) if sites is not None else [str(site) for site in range(len(site_lats))]
+    if not len(site_lats) == len(site_lons) == len(sites):
+        raise ValueError('Number of latitudes, longitudes and sites must match.')
+
+    rows, cols, lat_fractions, lon_fractions = grid._cells(site_lats, site_lons)
+    corner_rows = rows[:, None] + np.array(_CORNER_ROWS)
+    corner_cols = cols[:, None] + np.array(_CORNER_COLS)
+    if method == 'bilinear':
+        lat_weights = np.where(np.array(_CORNER_ROWS), lat_fractions[:, None], 1 - lat_fractions[:, None])
+        lon_weights = np.where(np.array(_CORNER_COLS), lon_fractions[:, None], 1 - lon_fractions[:, None])
+        weights = lat_weights * lon_weights
+    else:
+        # distances in degrees of latitude, with longitude scaled by the cosine of the latitude
+        lon_scale = np.cos(np.radians(site_lats))[:, None] * grid.lon_res / grid.lat_res
+        distances = np.hypot(np.array(_CORNER_ROWS) - lat_fractions[:, None],
+                             (np.array(_CORNER_COLS) - lon_fractions[:, None]) * lon_scale)
+        nearest = distances == distances.min(axis=1, keepdims=True)
+        if method == 'nearest':
+            weights = (np.cumsum(nearest, axis=1) == 1) & nearest
+        else:
+            with np.errstate(divide='ignore'):
+                inverse = distances ** -power
+            # sites on a node take the node value
+            weights = np.where((distances == 0).any(axis=1, keepdims=True), distances == 0, inverse)
+        weights = weights / weights.sum(axis=1, keepdims=True)
+
+    # nodes of zero weight are pointed at the strongest node of the site, so they are not downloaded
+    node_ids = corner_rows * grid.cols + corner_cols
+    strongest = node_ids[np.arange(len(node_ids)), weights.argmax(axis=1)]
+    node_ids = np.where(weights > 0, node_ids, strongest[:, None])
+    unique_ids, positions = np.unique(node_ids.ravel(), return_inverse=True)
+    node_rows, node_cols = np.divmod(unique_ids, grid.cols)
+    return InterpolationWeights(grid, sites, node_rows, node_cols, positions.reshape(node_ids.shape), weights)
+
@@ -1,85 +1,572 @@
-"""This module contains the barra2 merge function(s)."""
+"""This module contains the barra2 merge function(s).
+
+merge_csvs_to_table parses the cached csv files straight to a pyarrow Table and coalesces them in Arrow, for engines
+such as DuckDB or Polars, so the data is never converted to pandas. This requires pyarrow.
+"""
 
 import logging
-import sys
+from collections.abc import Iterable
+from itertools import groupby
 from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
+import numpy as np
 import pandas as pd
 
+from barra2_dl.cache import FrameCache, fingerprint_files
+from barra2_dl.compression import _optional_import, cached_files, open_cached
+from barra2_dl.globals import BARRA2_INDEX
+from barra2_dl.instrument import EventCallback, stage
+from barra2_dl.storage import Storage
+from barra2_dl.validate import parse_filename
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
 __all__ = [
+    'compact_barra2_frame',
+    'missing_hours',
+    'merge_files_to_df',
     'merge_csvs_to_df',
+    'merge_csvs_to_table',
 ]
 
+# one hour in nanoseconds for positional alignment of hourly data
+_HOUR_NS = 3_600_000_000_000
+
+# file precedence policies where cached files overlap, see merge_csvs_to_df
+_PRECEDENCES = ('first', 'last', 'newest')
+
+# memoised merges are invalidated when the merge result format changes
+_CACHE_VERSION = 1
+
+
+def _precedence_order(
+    files: list[Path],
+    precedence: str,
+) -> list[int]:
+    """Positions of files in order of precedence, the first file takes precedence where files overlap.
+
+    Raises:
+        ValueError: If the precedence is not supported.
+    """
+    match precedence:
+        case 'first':
+            return list(range(len(files)))
+        case 'last':
+            return list(range(len(files)))[::-1]
+        case 'newest':
+            # stable, so files with the same modification time keep their sorted order
+            return sorted(range(len(files)), key=lambda position: -files[position].stat().st_mtime_ns)
+        case _:
+            raise ValueError(f'Unsupported precedence <{precedence}>, use one of {list(_PRECEDENCES)}.')
+
+
+def _coalesce(
+    frames: list[pd.DataFrame],
+    keys: list[str],
+) -> pd.DataFrame:
+    """Coalesce frames in order of precedence into one row per key, in a single vectorised pass.
+
+    The frames are concatenated, so a variable in several frames is a single column and never gets suffixes, then
+    grouped by the key columns keeping the first value of each column in order of precedence. This resolves
+    overlapping files and duplicate timestamps within a file alike.
 
-def _merge_suffix_columns(
+    Args:
+        frames (list[pd.DataFrame]): Frames in order of precedence, with the key columns.
+        keys (list[str]): Key columns, the time and site columns.
+
+    Returns:
+        pd.DataFrame: Coalesced frame sorted by the keys, with the key columns first.
+    """
+    df_all = pd.concat(frames, ignore_index=True)
+    # groupby first skips missing values, so lower precedence frames fill gaps like combine_first
+    df_coalesced = df_all.groupby(keys, sort=True, observed=True, dropna=False).first()
+    return df_coalesced.reset_index()
+
+
+def compact_barra2_frame(
     df: pd.DataFrame,
-    suffix_x: str = '_x',
-    suffix_y: str = '_y',
+    float32: bool = False,
+    index_columns: str | list[str] | None = None,
 ) -> pd.DataFrame:
-    """Function to merge DataFrame columns with '_x' and '_y' suffixes.
+    """Convert a barra2 DataFrame to a compact representation indexed by time.
+
+    The time column becomes a UTC DatetimeIndex. Station, latitude and longitude columns that hold a single value are
+    stored once in df.attrs['site'] and dropped, otherwise they are kept as categorical columns. Variables are
+    optionally downcast to float32.
 
     Args:
-        df: The DataFrame that contains columns with suffixes to be merged.
-        suffix_x: The suffix used in the first set of columns (default is '_x').
-        suffix_y: The suffix used in the second set of columns (default is '_y').
+        df (pd.DataFrame): DataFrame with BARRA2_INDEX columns, e.g. a single csv file or the merge_csvs_to_df output.
+        float32 (bool): Downcast float variables to float32.
+        index_columns (str | list[str] | None): Index columns, defaults to BARRA2_INDEX. The first column must be time.
 
     Returns:
-        DataFrame: A DataFrame with the merged columns.
-        If no suffix_x returns the original DataFrame.
+        pd.DataFrame: Compact DataFrame with a DatetimeIndex named time.
+    """
+    index_columns = index_columns if index_columns is not None else BARRA2_INDEX
+    index_columns = [index_columns] if isinstance(index_columns, str) else index_columns
+    time_column, *site_columns = index_columns
+    df_compact = df.set_index(pd.DatetimeIndex(pd.to_datetime(df[time_column], utc=True), name=time_column))
+    df_compact = df_compact.drop(columns=time_column)
+    site = dict(df.attrs.get('site', {}))
+    for column in site_columns:
+        if column not in df_compact.columns:
+            continue
+        values = df_compact[column]
+        if values.nunique(dropna=False) == 1:
+            site[column] = values.iloc[0].item() if isinstance(values.iloc[0], np.generic) else values.iloc[0]
+            df_compact = df_compact.drop(columns=column)
+        else:
+            df_compact[column] = values.astype('category')
+    if float32:
+        float_columns = df_compact.select_dtypes('float64').columns
+        df_compact[float_columns] = df_compact[float_columns].astype(np.float32)
+    df_compact.attrs['site'] = site
+    return df_compact
 
-    Todo:
-        Add checks for multiple and mismatched suffixed columns
+
+def _site_columns(
+    df: pd.DataFrame,
+) -> list[str]:
+    """Site columns of a compact frame, kept as categorical columns where they hold more than one value."""
+    return [str(column) for column, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+
+
+def _coalesce_compact(
+    frames: list[pd.DataFrame],
+) -> pd.DataFrame:
+    """Coalesce compact frames in order of precedence on time, and any site columns kept as columns.
+
+    Raises:
+        ValueError: If the frames are for different sites.
+    """
+    site = _check_same_site(frames)
+    time_column = str(frames[0].index.name)
+    site_columns = list(dict.fromkeys(column for df in frames for column in _site_columns(df)))
+    df_coalesced = _coalesce([df.reset_index() for df in frames], [time_column, *site_columns])
+    df_coalesced = df_coalesced.set_index(time_column)
+    for column in site_columns:
+        df_coalesced[column] = df_coalesced[column].astype('category')
+    df_coalesced.attrs['site'] = site
+    return df_coalesced
+
+
+def _check_same_site(
+    frames: list[pd.DataFrame],
+) -> dict[str, Any]:
+    """Site attrs shared by all compact frames.
+
+    Raises:
+        ValueError: If the frames are for different sites.
+    """
+    site: dict[str, Any] = frames[0].attrs['site']
+    for df in frames[1:]:
+        if df.attrs['site'] != site:
+            raise ValueError(f"Cannot merge different sites {site} and {df.attrs['site']}, "
+                             f'use a filename_pattern for a single site.')
+    return site
+
+
+def _align_on_time(
+    frames: list[pd.DataFrame],
+) -> pd.DataFrame:
+    """Outer join compact frames by time position, keeping the first value where frames overlap.
+
+    If every frame is regular hourly data on the same hour phase, rows are placed by their hour offset from the
+    first timestamp on a complete hourly grid, so no hashing or sorting of keys is needed. Otherwise the frames are
+    aligned with a sorted merge on the union of their timestamps. Duplicate timestamps within a frame are coalesced
+    first, keeping the first value.
+
+    Args:
+        frames (list[pd.DataFrame]): Compact frames indexed by time, see compact_barra2_frame.
+
+    Returns:
+        pd.DataFrame: Aligned frame with a DatetimeIndex.
+
+    Raises:
+        ValueError: If the frames are for different sites or a frame of several stations has duplicate timestamps.
     """
+    site = _check_same_site(frames)
+    if any(not df.index.is_unique and _site_columns(df) for df in frames):
+        raise ValueError('Cannot align on time with duplicate timestamps in a file, use one station per file.')
+    frames = [df if df.index.is_unique else _coalesce_compact([df]) for df in frames]
+    indexes = [pd.DatetimeIndex(df.index) for df in frames]
+    tz = indexes[0].tz
+    times = [index.as_unit('ns').values.view(np.int64) for index in indexes]
+    # header only files give an empty grid
+    t0 = min((int(t[0]) for t in times if len(t)), default=0)
+    t1 = max((int(t[-1]) for t in times if len(t)), default=t0 - _HOUR_NS)
+    regular = all(
+        len(t) == 0 or (np.all(np.diff(t) == _HOUR_NS) and (int(t[0]) - t0) % _HOUR_NS == 0) for t in times
+    )
+    if regular:
+        grid = np.arange(t0, t1 + _HOUR_NS, _HOUR_NS, dtype=np.int64)
+        positions = [(t - t0) // _HOUR_NS for t in times]
+    else:
+        logger.info('Irregular time steps, aligning with a sorted merge.')
+        grid = np.unique(np.concatenate(times))
+        positions = [np.searchsorted(grid, t) for t in times]
+
+    columns: dict[str, np.ndarray] = {}
+    for df, position in zip(frames, positions, strict=True):
+        for column in df.columns:
+            values = df[column].to_numpy()
+            if column not in columns:
+                if values.dtype.kind == 'f':
+                    columns[column] = np.full(len(grid), np.nan, dtype=values.dtype)
+                else:
+                    columns[column] = np.full(len(grid), None, dtype=object)
+                columns[column][position] = values
+            else:
+                # fill only positions without a value, so the first frame takes precedence
+                target = columns[column]
+                empty = pd.isna(target[position])
+                target[position[empty]] = values[empty]
+
+    index = pd.DatetimeIndex(grid.view('datetime64[ns]'), name=frames[0].index.name)
+    index = index.tz_localize(tz) if tz is not None else index
+    df_aligned = pd.DataFrame(columns, index=index)
+    df_aligned.attrs['site'] = site
+    return df_aligned
+
+
+def missing_hours(
+    df: pd.DataFrame,
+) -> dict[str, pd.DatetimeIndex]:
+    """Hours between the first and last timestamp without a value, for each column of a frame indexed by time.
+
+    Args:
+        df (pd.DataFrame): Frame with a DatetimeIndex, e.g. from merge_csvs_to_df with compact=True.
+
+    Returns:
+        dict[str, pd.DatetimeIndex]: Missing hours by column, only columns with missing hours are included.
+    """
+    if df.empty:
+        return {}
+    index = pd.DatetimeIndex(df.index)
+    hourly = pd.date_range(index.min().floor('h'), index.max(), freq='h')
+    missing = {}
     for column in df.columns:
-        if column.endswith(suffix_x):
-            base_column = column[:-len(suffix_x)]
-            column_y = base_column + suffix_y
-            if column_y in df.columns:
-                # Create a new column without suffix and merge the values
-                df[base_column] = df[column].combine_first(df[column_y])
-                # Drop the old suffix columns
-                df.drop([column, column_y], axis=1, inplace=True)
-    return df
+        column_missing = hourly.difference(index[df[column].notna()])
+        if len(column_missing):
+            missing[column] = column_missing
+    return missing
+
+
+def _matched_files(
+    filein_folder: str | Path | Storage,
+    filename_pattern: str,
+) -> list[Path]:
+    """Cached files matching filename_pattern in a folder, or mirrored from a Storage to a local folder."""
+    if isinstance(filein_folder, Storage):
+        return filein_folder.local_files(filename_pattern)
+    return cached_files(filein_folder, filename_pattern)
+
+
+def _chunk_files(
+    files: Iterable[Path],
+) -> list[list[Path]]:
+    """Group files by the start of the period in their file name, in time order."""
+    def chunk_key(path: Path) -> pd.Timestamp:
+        parsed = parse_filename(path.name)
+        return parsed['start'] if parsed is not None else pd.Timestamp.min
+
+    return [list(chunk) for _start, chunk in groupby(sorted(files, key=chunk_key), key=chunk_key)]
+
+
+def _read_files(
+    files: list[Path],
+    index_for_join: str | list[str],
+    compact: bool,
+    float32: bool,
+    callback: EventCallback | None,
+) -> list[pd.DataFrame]:
+    """Parse csv files in order, as compact frames if compact."""
+    frames = []
+    for file in files:
+        # read csv file without indexing to retain time as column for join
+        with stage('csv_parse', detail=f'Parsed file: {file}', callback=callback, quiet=True) as parse_stage:
+            df_add = pd.read_csv(file)
+            if compact:
+                df_add = compact_barra2_frame(df_add, float32=float32, index_columns=index_for_join)
+            parse_stage.rows = len(df_add)
+            parse_stage.nbytes = file.stat().st_size
+        frames.append(df_add)
+    return frames
+
+
+def _join_frames(
+    frames: list[pd.DataFrame],
+    order: list[int],
+    keys: list[str],
+    compact: bool,
+    align_on_time: bool,
+    callback: EventCallback | None,
+    quiet: bool,
+) -> pd.DataFrame:
+    """Join frames by the positions of order, the first takes precedence, with columns in order of frames."""
+    with stage('join', detail=f'Merged {len(frames)} files', callback=callback, quiet=quiet) as join_stage:
+        ranked = [frames[position] for position in order]
+        if align_on_time:
+            df_merged = _align_on_time(ranked)
+        elif compact:
+            df_merged = _coalesce_compact(ranked)
+        else:
+            df_merged = _coalesce(ranked, keys)
+        # columns in order of first appearance in the files, whatever the precedence
+        columns = dict.fromkeys(column for df in frames for column in df.columns)
+        attrs = df_merged.attrs
+        df_merged = df_merged[[column for column in columns if column in df_merged.columns]]
+        df_merged.attrs = attrs
+        join_stage.rows = len(df_merged)
+    return df_merged
+
+
+def _read_memoised(
+    files: list[Path],
+    frame_cache: FrameCache,
+    options: tuple[Any, ...],
+    callback: EventCallback | None,
+) -> list[pd.DataFrame]:
+    """Parse csv files in order, as _read_files, reading the memoised frame of each file that did not change."""
+    index_for_join, compact, float32 = options[:3]
+    frames = []
+    for file in files:
+        key = fingerprint_files([file], 'file', *options)
+        # a rewritten file supersedes the frame of the file with the same options
+        group = fingerprint_files([], 'file', str(file), *options[:3])
+        df_file = frame_cache.get(key, group)
+        if df_file is None:
+            df_file = _read_files([file], index_for_join, compact, float32, callback)[0]
+            frame_cache.put(key, df_file, group)
+        frames.append(df_file)
+    return frames
+
+
+def merge_files_to_df(
+    files: Iterable[Path],
+    index_for_join: str | list[str] | None = None,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+    compact: bool = False,
+    float32: bool = False,
+    align_on_time: bool = False,
+    precedence: str = 'first',
+    cache_dir: str | Path | None = None,
+) -> pd.DataFrame:
+    """Merge a list of cached csv files, e.g. the files of a plan from CacheInventory, see merge_csvs_to_df.
+
+    Args:
+        files (Iterable[Path]): Cached csv files, uncompressed or compressed, in filename order for 'first'
+            and 'last' precedence.
+        index_for_join (str | list[str] | None): Pandas <on> parameter, defaults to BARRA2_INDEX.
+        callback (EventCallback | None): Optional callable receiving a StageEvent for each csv parse and join.
+        quiet (bool): If True nothing is written to stdout.
+        compact (bool): Return a compact DataFrame indexed by time, see compact_barra2_frame.
+        float32 (bool): Downcast variables to float32, only used if compact or align_on_time is True.
+        align_on_time (bool): Join compact frames by time position instead of an outer merge, implies compact.
+        precedence (str): File precedence where files overlap, 'first', 'last' or 'newest'.
+        cache_dir (str | Path | None): Folder of memoised merges, or None to not memoise.
+
+    Returns:
+        DataFrame: A DataFrame with the merged csvs.
+
+    Raises:
+        ValueError: If compact is True and the files are for different sites, or the precedence is not supported.
+    """
+    index_for_join = index_for_join if index_for_join is not None else BARRA2_INDEX
+    keys = [index_for_join] if isinstance(index_for_join, str) else list(index_for_join)
+    compact = compact or align_on_time
+    files = list(files)
+    order = _precedence_order(files, precedence)
+    if not files:
+        return pd.DataFrame()
+
+    frame_cache, key, group = None, None, None
+    if cache_dir is None:
+        frames = _read_files(files, index_for_join, compact, float32, callback)
+    else:
+        frame_cache = FrameCache(cache_dir)
+        key = fingerprint_files(files, index_for_join, keys, compact, float32, align_on_time, precedence,
+                                _CACHE_VERSION)
+        group = fingerprint_files([], 'merged', *sorted(str(file) for file in files), index_for_join, keys, compact,
+                                  float32, align_on_time, precedence)
+        df_merged = frame_cache.get(key, group)
+        if df_merged is not None:
+            return df_merged
+        # files are coalesced in precedence order from the frames of each file, so only changed files are parsed
+        frames = _read_memoised(files, frame_cache, (index_for_join, compact, float32, _CACHE_VERSION), callback)
+    df_merged = _join_frames(frames, order, keys, compact, align_on_time, callback, quiet)
+
+    if align_on_time:
+        missing = {column: len(hours) for column, hours in missing_hours(df_merged).items()}
+        df_merged.attrs['missing_hours'] = missing
+        if missing:
+            logger.warning(f'Missing hours in merged data: {missing}')
+    if frame_cache is not None and key is not None:
+        frame_cache.put(key, df_merged, group)
+    return df_merged
 
 
 def merge_csvs_to_df(
-    filein_folder: str,
+    filein_folder: str | Path | Storage,
     filename_pattern: str = '*.csv',
-    index_for_join: str | list[str] = None,
+    index_for_join: str | list[str] | None = None,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+    compact: bool = False,
+    float32: bool = False,
+    align_on_time: bool = False,
+    precedence: str = 'first',
+    cache_dir: str | Path | None = None,
 ) -> pd.DataFrame:
-    """Function to merge csv files iteratively from a folder based on filename wildcard.
+    """Function to merge csv files from a folder based on filename wildcard.
 
     Uses outer join based on index_for_join. If filename wildcard is omitted all csv files in the folder will be merged.
+    The files are coalesced in a single pass, with one column per variable and one row per index_for_join key. Where
+    files overlap, e.g. a re-downloaded month or the same site under two prefixes, or a file repeats a timestamp, the
+    value is taken from the file of highest precedence that has one: 'first' in sorted filename order, 'last' in
+    reverse order, or 'newest' by file modification time.
+    Compressed cache files, e.g. .csv.gz, match the wildcard of their uncompressed name, see barra2_dl.compression.
+    A cache in object storage is merged from a local mirror of the matched files, see barra2_dl.storage.
+    With compact=True each file is converted with compact_barra2_frame as it is read and joined on the time index,
+    which reduces memory several fold and speeds up the join. The site station, latitude and longitude are then
+    in df.attrs['site'].
+
+    With align_on_time=True all files are read as compact frames and joined in a single pass by time position,
+    using the hour offset for regular hourly data and a sorted merge otherwise. The number of missing hours per
+    variable is reported in df.attrs['missing_hours'], use missing_hours for the hours.
+
+    With a cache_dir the merge is memoised in a FrameCache keyed by the fingerprint of the matched files, their names,
+    sizes and modification times, and the merge options, so repeated merges of an unchanged cache return the stored
+    result without parsing. The parsed frame of each file is memoised too, so when files are added or rewritten only
+    those files are parsed again, and all files are still coalesced in order of precedence. Stored frames superseded
+    by a rewritten file are deleted.
 
     Args:
-        filein_folder (str): Folder
+        filein_folder (str | Path | Storage): Folder, or a Storage of the cache.
         filename_pattern (str): Filename matching pattern. Use if multiple location files are in same folder.
-        index_for_join (str | list[str]): Pandas <on> parameter.
+        index_for_join (str | list[str] | None): Pandas <on> parameter, defaults to BARRA2_INDEX.
+        callback (EventCallback | None): Optional callable receiving a StageEvent for each csv parse and join.
+        quiet (bool): If True nothing is written to stdout.
+        compact (bool): Return a compact DataFrame indexed by time, see compact_barra2_frame.
+        float32 (bool): Downcast variables to float32, only used if compact or align_on_time is True.
+        align_on_time (bool): Join compact frames by time position instead of an outer merge, implies compact.
+        precedence (str): File precedence where files overlap, 'first', 'last' or 'newest'.
+        cache_dir (str | Path | None): Folder of memoised merges, e.g. filein_folder/_merged, or None to not memoise.
 
     Returns:
         DataFrame: A DataFrame with the merged csvs.
 
+    Raises:
+        ValueError: If compact is True and the files are for different sites, or the precedence is not supported.
+
     Todo:
         Add csv check for filename_prefix
         Add pandas kwargs
     """
-    # instantiate dataframe for merging csv files
-    df_merged = pd.DataFrame()
+    return merge_files_to_df(
+        _matched_files(filein_folder, filename_pattern),
+        index_for_join,
+        callback=callback,
+        quiet=quiet,
+        compact=compact,
+        float32=float32,
+        align_on_time=align_on_time,
+        precedence=precedence,
+        cache_dir=cache_dir,
+    )
 
-    for file in Path(filein_folder).glob(filename_pattern):
-        if df_merged.empty:
-            # read csv file without indexing to retain time as column for join
-            df_merged = pd.read_csv(file)
-        else:
-            # read next file into new df
-            df_add = pd.read_csv(file)
-            df_merged = pd.merge(df_merged, df_add, how='outer', on=index_for_join)
-            df_merged = _merge_suffix_columns(df_merged)
-            logger.info(f'Merged file: {file}')
-            sys.stdout.write(f'Merged file: {file}')
-            sys.stdout.write('\n')
 
-    return df_merged
+def _read_table(
+    file: Path,
+    keys: list[str],
+    float32: bool,
+) -> 'pa.Table':
+    """Parse a csv file to a Table, with float variables."""
+    pa = _optional_import('pyarrow', 'arrow', 'Arrow output')
+    pa_csv = _optional_import('pyarrow.csv', 'arrow', 'Arrow output')
+    with open_cached(file) as stream:
+        table = pa_csv.read_csv(stream)
+    value_type = pa.float32() if float32 else pa.float64()
+    # variables of whole numbers are parsed as integers
+    schema = pa.schema([
+        field.with_type(value_type)
+        if field.name not in keys and (pa.types.is_integer(field.type) or pa.types.is_floating(field.type)) else field
+        for field in table.schema
+    ])
+    return table.cast(schema)
+
+
+def _coalesce_tables(
+    tables: list['pa.Table'],
+    keys: list[str],
+) -> 'pa.Table':
+    """Coalesce Tables in order of precedence into one row per key, the Arrow equivalent of _coalesce."""
+    pa = _optional_import('pyarrow', 'arrow', 'Arrow output')
+
+    table = pa.concat_tables(tables, promote_options='default')
+    values = [name for name in table.column_names if name not in keys]
+    # without threads the first value of each group is in order of the concatenated tables
+    grouped = table.group_by(keys, use_threads=False).aggregate([(name, 'first') for name in values])
+    grouped = grouped.select([*keys, *(f'{name}_first' for name in values)]).rename_columns([*keys, *values])
+    return grouped.sort_by([(key, 'ascending') for key in keys])
+
+
+def merge_csvs_to_table(
+    filein_folder: str | Path | Storage,
+    filename_pattern: str = '*.csv',
+    index_for_join: str | list[str] | None = None,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+    float32: bool = False,
+    precedence: str = 'first',
+) -> 'pa.Table':
+    """Merge csv files from a folder into a pyarrow Table, without pandas.
+
+    The Arrow equivalent of merge_csvs_to_df, with one row per index_for_join key and one column per variable,
+    coalesced by precedence where files overlap. The time column is a UTC timestamp. Use Table.to_batches or
+    Table.to_reader for a stream of record batches.
+
+    Args:
+        filein_folder (str | Path | Storage): Folder, or a Storage of the cache.
+        filename_pattern (str): Filename matching pattern. Use if multiple location files are in same folder.
+        index_for_join (str | list[str] | None): Key columns, defaults to BARRA2_INDEX.
+        callback (EventCallback | None): Optional callable receiving a StageEvent for each csv parse and the join.
+        quiet (bool): If True nothing is written to stdout.
+        float32 (bool): Store variables as float32.
+        precedence (str): File precedence where files overlap, 'first', 'last' or 'newest'.
+
+    Returns:
+        pa.Table: The merged Table sorted by the key columns.
+
+    Raises:
+        ImportError: If pyarrow is not installed.
+        ValueError: If the precedence is not supported.
+    """
+    pa = _optional_import('pyarrow', 'arrow', 'Arrow output')
+    index_for_join = index_for_join if index_for_join is not None else BARRA2_INDEX
+    keys = [index_for_join] if isinstance(index_for_join, str) else list(index_for_join)
+    files = _matched_files(filein_folder, filename_pattern)
+    order = _precedence_order(files, precedence)
+    if not files:
+        return pa.table({})
+
+    tables = []
+    for file in files:
+        with stage('csv_parse', detail=f'Parsed file: {file}', callback=callback, quiet=True) as parse_stage:
+            table = _read_table(file, keys, float32)
+            parse_stage.rows = table.num_rows
+            parse_stage.nbytes = file.stat().st_size
+        tables.append(table)
+
+    with stage('join', detail=f'Merged {len(tables)} files', callback=callback, quiet=quiet) as join_stage:
+        table = _coalesce_tables([tables[position] for position in order], keys)
+        # columns in order of first appearance in the files, whatever the precedence
+        table = table.select(list(dict.fromkeys(name for table_file in tables for name in table_file.column_names)))
+        join_stage.rows = table.num_rows
+    return table
@@ -0,0 +1,339 @@
+"""This module contains the barra2 multi-site panel function(s).
+
+Cached files of many sites are parsed in parallel and placed by time position into a single preallocated array,
+either a wide frame with (site, var) columns or a long frame with one row per site, time and variable. Panels can
+also be streamed one site at a time to Parquet partitioned by site and year, for query engines such as pyarrow
+datasets, DuckDB or Spark. Writing Parquet requires pyarrow.
+"""
+import logging
+from collections.abc import Iterable
+from dataclasses import dataclass
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from barra2_dl.compression import _optional_import, cached_files
+from barra2_dl.instrument import EventCallback, stage
+from barra2_dl.merge import _HOUR_NS
+from barra2_dl.validate import parse_filename
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'panel_files',
+    'build_panel',
+    'write_panel_parquet',
+    'write_panel_parquet_files',
+]
+
+
+@dataclass
+class _FileData:
+    """Parsed columns of a single cached file."""
+    site: str
+    var: str
+    unit: str
+    times: np.ndarray
+    values: np.ndarray
+
+
+def panel_files(
+    filein_folder: str | Path,
+    sites: Iterable[str] | None = None,
+    filename_pattern: str = '*.csv',
+) -> dict[str, list[Path]]:
+    """Cached files by site, the file name prefix, for sites in a folder.
+
+    Args:
+        filein_folder (str | Path): Cache folder.
+        sites (Iterable[str] | None): File name prefixes of the sites, defaults to all sites in the folder.
+        filename_pattern (str): Filename matching pattern.
+
+    Returns:
+        dict[str, list[Path]]: Sorted files for each site, in the order of sites.
+    """
+    files: dict[str, list[Path]] = {site: [] for site in sites} if sites is not None else {}
+    for path in cached_files(filein_folder, filename_pattern):
+        parsed = parse_filename(path.name)
+        if parsed is None:
+            continue
+        if sites is None:
+            files.setdefault(parsed['prefix'], []).append(path)
+        elif parsed['prefix'] in files:
+            files[parsed['prefix']].append(path)
+    return files
+
+
+def _parse_times(
+    times: pd.Series,
+) -> np.ndarray:
+    """UTC nanoseconds of ISO 8601 times, e.g. '2023-01-01T00:00:00Z', parsed by numpy for the thredds format."""
+    try:
+        return times.to_numpy().astype('U19').astype('datetime64[ns]').view(np.int64)
+    except ValueError:
+        index = pd.DatetimeIndex(pd.to_datetime(times, format='ISO8601', utc=True))
+        return index.as_unit('ns').values.view(np.int64)
+
+
+def _read_location(
+    path: Path,
+) -> dict[str, Any]:
+    """Station, latitude and longitude in the first row of a cached csv file."""
+    row = pd.read_csv(path, nrows=1).iloc[0]
+    return {'station': row.iloc[1], 'latitude': float(row.iloc[2]), 'longitude': float(row.iloc[3])}
+
+
+def _read_file(
+    site: str,
+    path: Path,
+    dtype: type,
+) -> _FileData:
+    """Parse the time and variable columns of a cached csv file."""
+    df = pd.read_csv(path, usecols=[0, 4])
+    var, _bracket, unit = df.columns[1].partition('[')
+    return _FileData(site, var, unit.removeprefix('unit="').removesuffix('"]'), _parse_times(df.iloc[:, 0]),
+                     df.iloc[:, 1].to_numpy(dtype=dtype))
+
+
+def _read_files(
+    files: dict[str, list[Path]],
+    dtype: type,
+    max_workers: int | None,
+    callback: EventCallback | None,
+) -> list[_FileData]:
+    """Parse all files in parallel threads."""
+    tasks = [(site, path, dtype) for site, paths in files.items() for path in paths]
+    if not tasks:
+        raise ValueError('No cached files for the panel.')
+    with stage('csv_parse', detail=f'Parsed {len(tasks)} files', callback=callback, quiet=True) as parse_stage:
+        with ThreadPool(max_workers or max(cpu_count() - 1, 1)) as pool:
+            parsed = pool.starmap(_read_file, tasks)
+        parse_stage.rows = sum(len(data.times) for data in parsed)
+        parse_stage.nbytes = sum(path.stat().st_size for _site, path, _dtype in tasks)
+    return parsed
+
+
+def _time_positions(
+    parsed: list[_FileData],
+) -> tuple[pd.DatetimeIndex, list[np.ndarray]]:
+    """Time index of the panel and the position of each file's rows in it.
+
+    Regular hourly files on the same hour phase are placed by hour offset, otherwise by a sorted union of all times.
+
+    Raises:
+        ValueError: If no file has data rows, e.g. all files are header-only.
+    """
+    if not any(len(data.times) for data in parsed):
+        raise ValueError(f'No data rows in the {len(parsed)} cached files of the panel.')
+    first = min(int(data.times[0]) for data in parsed if len(data.times))
+    last = max(int(data.times[-1]) for data in parsed if len(data.times))
+    hourly = all(
+        len(data.times) == 0
+        or ((data.times[0] - first) % _HOUR_NS == 0 and np.all(np.diff(data.times) == _HOUR_NS))
+        for data in parsed
+    )
+    if hourly:
+        times = np.arange(first, last + _HOUR_NS, _HOUR_NS)
+        positions = [(data.times - first) // _HOUR_NS for data in parsed]
+    else:
+        times = np.unique(np.concatenate([data.times for data in parsed]))
+        positions = [np.searchsorted(times, data.times) for data in parsed]
+    return pd.DatetimeIndex(times.astype('datetime64[ns]'), name='time').tz_localize('UTC'), positions
+
+
+def _panel_attrs(
+    files: dict[str, list[Path]],
+    parsed: list[_FileData],
+) -> dict[str, Any]:
+    """Site locations, from the first file of each site, and variable units of a panel."""
+    return {
+        'sites': {site: _read_location(paths[0]) for site, paths in files.items() if paths},
+        'units': {data.var: data.unit for data in parsed},
+    }
+
+
+def _wide_panel(
+    parsed: list[_FileData],
+    dtype: type,
+) -> pd.DataFrame:
+    """Wide panel indexed by time with (site, var) columns, filled into a single array."""
+    columns = pd.MultiIndex.from_tuples(
+        sorted({(data.site, data.var) for data in parsed}),
+        names=['site', 'var'],
+    )
+    index, positions = _time_positions(parsed)
+    values: np.ndarray = np.full((len(index), len(columns)), np.nan, dtype=dtype)
+    column_positions = columns.get_indexer(pd.Index([(data.site, data.var) for data in parsed]))
+    for data, rows, column in zip(parsed, positions, column_positions, strict=True):
+        values[rows, column] = data.values
+    return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+
+def _long_panel(
+    parsed: list[_FileData],
+    dtype: type,
+) -> pd.DataFrame:
+    """Long panel with site, time, var and value columns sorted by site, time and var."""
+    sites = pd.Index(sorted({data.site for data in parsed}))
+    variables = pd.Index(sorted({data.var for data in parsed}))
+    lengths = np.array([len(data.times) for data in parsed])
+    total = int(lengths.sum())
+    site_codes = np.repeat(sites.get_indexer(pd.Index([data.site for data in parsed])), lengths)
+    var_codes = np.repeat(variables.get_indexer(pd.Index([data.var for data in parsed])), lengths)
+    times = np.empty(total, dtype=np.int64)
+    values: np.ndarray = np.empty(total, dtype=dtype)
+    offset = 0
+    for data, length in zip(parsed, lengths, strict=True):
+        times[offset:offset + length] = data.times
+        values[offset:offset + length] = data.values
+        offset += length
+    order = np.lexsort((var_codes, times, site_codes))
+    return pd.DataFrame({
+        'site': pd.Categorical.from_codes(site_codes[order], categories=sites),
+        'time': pd.DatetimeIndex(times[order].astype('datetime64[ns]')).tz_localize('UTC'),
+        'var': pd.Categorical.from_codes(var_codes[order], categories=variables),
+        'value': values[order],
+    })
+
+
+def _build_panel(
+    files: dict[str, list[Path]],
+    layout: str,
+    float32: bool,
+    max_workers: int | None,
+    callback: EventCallback | None,
+    quiet: bool,
+) -> pd.DataFrame:
+    """Panel of the files of each site, see build_panel."""
+    dtype = np.float32 if float32 else np.float64
+    parsed = _read_files(files, dtype, max_workers, callback)
+    with stage('join', detail=f'Built {layout} panel of {len(parsed)} files', callback=callback,
+               quiet=quiet) as join_stage:
+        df_panel = _wide_panel(parsed, dtype) if layout == 'wide' else _long_panel(parsed, dtype)
+        join_stage.rows = len(df_panel)
+    df_panel.attrs.update(_panel_attrs(files, parsed))
+    return df_panel
+
+
+def build_panel(
+    filein_folder: str | Path,
+    sites: Iterable[str] | None = None,
+    layout: str = 'wide',
+    filename_pattern: str = '*.csv',
+    float32: bool = False,
+    max_workers: int | None = None,
+    callback: EventCallback | None = None,
+    quiet: bool = True,
+) -> pd.DataFrame:
+    """Merge the cached files of many sites into a single panel.
+
+    Args:
+        filein_folder (str | Path): Cache folder.
+        sites (Iterable[str] | None): File name prefixes of the sites, defaults to all sites in the folder.
+        layout (str): 'wide' for a frame indexed by time with (site, var) columns, or 'long' for site, time, var and
+            value columns.
+        filename_pattern (str): Filename matching pattern.
+        float32 (bool): Store values as float32.
+        max_workers (int | None): Number of parsing threads, defaults to the number of cpus - 1.
+        callback (EventCallback | None): Optional callable receiving StageEvents for the parse and join.
+        quiet (bool): If True nothing is written to stdout.
+
+    Returns:
+        pd.DataFrame: The panel, with site locations in df.attrs['sites'] and units in df.attrs['units'].
+
+    Raises:
+        ValueError: If the layout is not supported or there are no files.
+    """
+    if layout not in ('wide', 'long'):
+        raise ValueError(f"Unsupported panel layout <{layout}>, use 'wide' or 'long'.")
+    files = panel_files(filein_folder, sites, filename_pattern)
+    return _build_panel(files, layout, float32, max_workers, callback, quiet)
+
+
+def write_panel_parquet_files(
+    files: dict[str, list[Path]],
+    output_dir: str | Path,
+    float32: bool = False,
+    max_workers: int | None = None,
+    callback: EventCallback | None = None,
+    quiet: bool = True,
+) -> Path:
+    """Stream the files of many sites to Parquet partitioned by site and year, one site at a time.
+
+    Each partition output_dir/site=<site>/year=<year>/ holds a time column and a column per variable. Partitions of
+    sites written again are replaced.
+
+    Args:
+        files (dict[str, list[Path]]): Cached files by site, e.g. the planned files of each site or from panel_files.
+        output_dir (str | Path): Root folder of the partitioned dataset.
+        float32 (bool): Store values as float32.
+        max_workers (int | None): Number of parsing threads, defaults to the number of cpus - 1.
+        callback (EventCallback | None): Optional callable receiving StageEvents for each parse, join and write.
+        quiet (bool): If True nothing is written to stdout.
+
+    Returns:
+        Path: The dataset root folder.
+
+    Raises:
+        ImportError: If pyarrow is not installed.
+    """
+    _optional_import('pyarrow', 'parquet', 'writing Parquet')
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for site, site_files in files.items():
+        if not site_files:
+            logger.warning(f'No cached files for site <{site}>.')
+            continue
+        df_site = _build_panel({site: site_files}, 'wide', float32, max_workers, callback, quiet)
+        df_site = df_site.droplevel('site', axis=1).rename_axis(columns=None).reset_index()
+        df_site.insert(0, 'site', site)
+        df_site.insert(1, 'year', df_site['time'].dt.year)
+        with stage('parquet_write', detail=f'Wrote site {site}', callback=callback, quiet=quiet) as write_stage:
+            df_site.to_parquet(
+                output_dir,
+                index=False,
+                partition_cols=['site', 'year'],
+                existing_data_behavior='delete_matching',
+                basename_template='part-{i}.parquet',
+            )
+            write_stage.rows = len(df_site)
+    return output_dir
+
+
+def write_panel_parquet(
+    filein_folder: str | Path,
+    output_dir: str | Path,
+    sites: Iterable[str] | None = None,
+    filename_pattern: str = '*.csv',
+    float32: bool = False,
+    max_workers: int | None = None,
+    callback: EventCallback | None = None,
+    quiet: bool = True,
+) -> Path:
+    """Stream the cached files of many sites in a folder to Parquet partitioned by site and year, one site at a time.
+
+    See write_panel_parquet_files for the partitions.
+
+    Args:
+        filein_folder (str | Path): Cache folder.
+        output_dir (str | Path): Root folder of the partitioned dataset.
+        sites (Iterable[str] | None): File name prefixes of the sites, defaults to all sites in the folder.
+        filename_pattern (str): Filename matching pattern.
+        float32 (bool): Store values as float32.
+        max_workers (int | None): Number of parsing threads, defaults to the number of cpus - 1.
+        callback (EventCallback | None): Optional callable receiving StageEvents for each parse, join and write.
+        quiet (bool): If True nothing is written to stdout.
+
+    Returns:
+        Path: The dataset root folder.
+
+    Raises:
+        ImportError: If pyarrow is not installed.
+    """
+    return write_panel_parquet_files(panel_files(filein_folder, sites, filename_pattern), output_dir, float32,
+                                     max_workers, callback, quiet)
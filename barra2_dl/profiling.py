@@ -0,0 +1,179 @@
+"""This module contains the barra2 profiling class and function(s).
+
+Profiler is an opt-in context manager that wraps any of the public download, merge and convert functions and
+aggregates the stage events they emit into a per-stage report of wall time, CPU time, peak memory and throughput.
+
+Example:
+    >>> from barra2_dl.instrument import stage
+    >>> with Profiler() as profiler:
+    ...     with stage('convert', quiet=True) as convert_stage:
+    ...         convert_stage.rows = 10
+    >>> profiler.report()['stages']['convert']['rows']
+    10
+"""
+import html
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+from barra2_dl.instrument import Event, StageEvent, add_listener, remove_listener
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'StageStats',
+    'Profiler',
+]
+
+
+@dataclass
+class StageStats:
+    """Aggregated statistics for all events of a single stage.
+
+    Attributes:
+        count (int): Number of times the stage was run.
+        seconds (float): Total wall time in seconds.
+        cpu_seconds (float): Total process CPU time in seconds.
+        peak_bytes (int): Largest peak traced memory of any single run of the stage.
+        rows (int): Total rows processed.
+        nbytes (int): Total bytes processed.
+    """
+    count: int = 0
+    seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_bytes: int = 0
+    rows: int = 0
+    nbytes: int = 0
+
+    def add(self, event: StageEvent) -> None:
+        """Add a stage event to the totals."""
+        self.count += 1
+        self.seconds += event.seconds
+        self.cpu_seconds += event.cpu_seconds
+        self.peak_bytes = max(self.peak_bytes, event.peak_bytes)
+        self.rows += event.rows
+        self.nbytes += event.nbytes
+
+    def to_dict(self) -> dict[str, Any]:
+        """Statistics including throughput in rows/s and MB/s."""
+        stats = asdict(self)
+        stats['rows_per_second'] = self.rows / self.seconds if self.seconds else 0.0
+        stats['mb_per_second'] = self.nbytes / 1e6 / self.seconds if self.seconds else 0.0
+        return stats
+
+
+class Profiler:
+    """Context manager recording per-stage timings and memory of any barra2_dl function run inside it.
+
+    Stages reported by barra2_dl are 'plan', 'network', 'disk_write', 'download', 'csv_parse', 'join' and 'convert'.
+    Stages run on download threads are summed, so their total seconds can exceed the wall time of the profile.
+
+    Attributes:
+        stages (dict[str, StageStats]): Statistics by stage name.
+        trace_memory (bool): Start tracemalloc for the duration of the profile to record peak memory.
+        seconds (float): Wall time of the profile.
+        cpu_seconds (float): Process CPU time of the profile.
+        peak_bytes (int): Peak traced memory of the profile.
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        """Set up an empty profile.
+
+        Args:
+            trace_memory (bool): Start tracemalloc to record peak memory, which slows down allocation heavy stages.
+        """
+        self.stages: dict[str, StageStats] = {}
+        self.trace_memory = trace_memory
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_bytes = 0
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def __call__(self, event: Event) -> None:
+        """Listener aggregating stage events."""
+        if isinstance(event, StageEvent):
+            with self._lock:
+                self.stages.setdefault(event.stage, StageStats()).add(event)
+
+    def __enter__(self) -> 'Profiler':
+        """Start recording."""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        add_listener(self)
+        self._t0 = time.perf_counter()
+        self._c0 = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        """Stop recording."""
+        self.seconds = time.perf_counter() - self._t0
+        self.cpu_seconds = time.process_time() - self._c0
+        remove_listener(self)
+        if tracemalloc.is_tracing():
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def report(self) -> dict[str, Any]:
+        """Profile report as a dictionary.
+
+        Returns:
+            dict: Totals for the profile and statistics by stage.
+        """
+        with self._lock:
+            stages = {name: stats.to_dict() for name, stats in self.stages.items()}
+        return {
+            'seconds': self.seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'peak_bytes': self.peak_bytes,
+            'stages': stages,
+        }
+
+    def to_json(self, path: str | Path) -> None:
+        """Write the report as a json file.
+
+        Args:
+            path (str | Path): Output file path.
+
+        Returns: None
+        """
+        Path(path).write_text(json.dumps(self.report(), indent=2))
+        logger.info(f'Profile report written to <{path}>')
+
+    def to_html(self, path: str | Path) -> None:
+        """Write the report as a html table.
+
+        Args:
+            path (str | Path): Output file path.
+
+        Returns: None
+        """
+        report = self.report()
+        columns = ['count', 'seconds', 'cpu_seconds', 'peak_bytes', 'rows', 'nbytes', 'rows_per_second',
+                   'mb_per_second']
+        header = ''.join(f'<th>{column}</th>' for column in ['stage', *columns])
+        rows = [
+            '<tr><td>{}</td>{}</tr>'.format(
+                html.escape(name),
+                ''.join(f'<td>{stats[column]:.6g}</td>' for column in columns),
+            )
+            for name, stats in report['stages'].items()
+        ]
+        Path(path).write_text(
+            '<html><head><title>barra2-dl profile</title></head><body>\n'
+            f"<p>Wall time: {report['seconds']:.6g} s, CPU time: {report['cpu_seconds']:.6g} s, "
+            f"peak memory: {report['peak_bytes']} bytes</p>\n"
+            f'<table>\n<tr>{header}</tr>\n' + '\n'.join(rows) + '\n</table>\n</body></html>\n'
+        )
+        logger.info(f'Profile report written to <{path}>')
@@ -0,0 +1,207 @@
+"""This module contains the barra2 cache query function(s).
+
+A query selects sites, variables and a time window. Cached files are named by site, variable and month, so
+query_cache prunes the files by name without opening them, parses only the time and variable columns of the
+remaining files, and keeps only the rows in the window. query_dataset reads the Parquet dataset written by
+panel.write_panel_parquet, pushing the site and year partition filters, the time predicate and the column selection
+down into the pyarrow dataset scanner, so unrelated partitions, row groups and columns are never read. This requires
+pyarrow.
+"""
+import logging
+from collections.abc import Iterable
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from barra2_dl.compression import _optional_import
+from barra2_dl.instrument import EventCallback, stage
+from barra2_dl.panel import _FileData, _long_panel, _panel_attrs, _read_files, _wide_panel, panel_files
+from barra2_dl.validate import parse_filename
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'query_files',
+    'query_cache',
+    'query_dataset',
+]
+
+
+def _window(
+    start: str | datetime | None,
+    end: str | datetime | None,
+) -> tuple[pd.Timestamp, pd.Timestamp]:
+    """Inclusive query window as naive UTC timestamps, unbounded where start or end is None."""
+    def utc(value: str | datetime | None, default: pd.Timestamp) -> pd.Timestamp:
+        if value is None:
+            return default
+        timestamp = pd.Timestamp(value)
+        return timestamp.tz_convert('UTC').tz_localize(None) if timestamp.tz is not None else timestamp
+
+    return utc(start, pd.Timestamp.min), utc(end, pd.Timestamp.max)
+
+
+def query_files(
+    filein_folder: str | Path,
+    sites: Iterable[str] | None = None,
+    variables: Iterable[str] | None = None,
+    start: str | datetime | None = None,
+    end: str | datetime | None = None,
+    filename_pattern: str = '*.csv',
+) -> dict[str, list[Path]]:
+    """Cached files by site of the variables and months in a query, selected by file name without opening files.
+
+    Args:
+        filein_folder (str | Path): Cache folder.
+        sites (Iterable[str] | None): File name prefixes of the sites, defaults to all sites in the folder.
+        variables (Iterable[str] | None): Variables, e.g. ['ua50m', 'va50m'], defaults to all variables.
+        start (str | datetime | None): Start of the inclusive window, UTC if naive, defaults to unbounded.
+        end (str | datetime | None): End of the inclusive window, UTC if naive, defaults to unbounded.
+        filename_pattern (str): Filename matching pattern.
+
+    Returns:
+        dict[str, list[Path]]: Sorted files for each site, in the order of sites.
+    """
+    window_start, window_end = _window(start, end)
+    variables = set(variables) if variables is not None else None
+    files: dict[str, list[Path]] = {}
+    for site, paths in panel_files(filein_folder, sites, filename_pattern).items():
+        files[site] = []
+        for path in paths:
+            parsed = parse_filename(path.name)
+            # panel_files lists only files whose names parse
+            if parsed is None or (variables is not None and parsed['var'] not in variables):
+                continue
+            if parsed['end'] < window_start or parsed['start'] > window_end:
+                continue
+            files[site].append(path)
+    return files
+
+
+def _trim(
+    data: _FileData,
+    window_start: pd.Timestamp,
+    window_end: pd.Timestamp,
+) -> _FileData:
+    """File data with only the rows in the window."""
+    times = data.times
+    keep = np.ones(len(times), dtype=bool)
+    if window_start != pd.Timestamp.min:
+        keep &= times >= window_start.as_unit('ns').value
+    if window_end != pd.Timestamp.max:
+        keep &= times <= window_end.as_unit('ns').value
+    if keep.all():
+        return data
+    return _FileData(data.site, data.var, data.unit, times[keep], data.values[keep])
+
+
+def query_cache(
+    filein_folder: str | Path,
+    sites: Iterable[str] | None = None,
+    variables: Iterable[str] | None = None,
+    start: str | datetime | None = None,
+    end: str | datetime | None = None,
+    layout: str = 'wide',
+    filename_pattern: str = '*.csv',
+    float32: bool = False,
+    max_workers: int | None = None,
+    callback: EventCallback | None = None,
+    quiet: bool = True,
+) -> pd.DataFrame:
+    """Query sites, variables and a time window from the cached csv files, reading only the files and columns needed.
+
+    Args:
+        filein_folder (str | Path): Cache folder.
+        sites (Iterable[str] | None): File name prefixes of the sites, defaults to all sites in the folder.
+        variables (Iterable[str] | None): Variables, e.g. ['ua50m', 'va50m'], defaults to all variables.
+        start (str | datetime | None): Start of the inclusive window, UTC if naive, defaults to unbounded.
+        end (str | datetime | None): End of the inclusive window, UTC if naive, defaults to unbounded.
+        layout (str): 'wide' or 'long', see panel.build_panel.
+        filename_pattern (str): Filename matching pattern.
+        float32 (bool): Store values as float32.
+        max_workers (int | None): Number of parsing threads, defaults to the number of cpus - 1.
+        callback (EventCallback | None): Optional callable receiving StageEvents for the parse and join.
+        quiet (bool): If True nothing is written to stdout.
+
+    Returns:
+        pd.DataFrame: The panel of the query, with site locations in df.attrs['sites'] and units in df.attrs['units'].
+
+    Raises:
+        ValueError: If the layout is not supported or no cached files match the query.
+    """
+    if layout not in ('wide', 'long'):
+        raise ValueError(f"Unsupported panel layout <{layout}>, use 'wide' or 'long'.")
+    window_start, window_end = _window(start, end)
+    files = query_files(filein_folder, sites, variables, start, end, filename_pattern)
+    if not any(files.values()):
+        raise ValueError(f'No cached files in <{filein_folder}> match the query.')
+    dtype = np.float32 if float32 else np.float64
+    parsed = [_trim(data, window_start, window_end) for data in _read_files(files, dtype, max_workers, callback)]
+    parsed = [data for data in parsed if len(data.times)]
+    if not parsed:
+        raise ValueError(f'No cached rows in <{filein_folder}> match the query.')
+    with stage('join', detail=f'Built {layout} panel of {len(parsed)} files', callback=callback,
+               quiet=quiet) as join_stage:
+        df_query = _wide_panel(parsed, dtype) if layout == 'wide' else _long_panel(parsed, dtype)
+        join_stage.rows = len(df_query)
+    df_query.attrs.update(_panel_attrs(files, parsed))
+    return df_query
+
+
+def query_dataset(
+    dataset_dir: str | Path,
+    sites: Iterable[str] | None = None,
+    variables: Iterable[str] | None = None,
+    start: str | datetime | None = None,
+    end: str | datetime | None = None,
+) -> pd.DataFrame:
+    """Query sites, variables and a time window from a Parquet dataset written by panel.write_panel_parquet.
+
+    Args:
+        dataset_dir (str | Path): Root folder of the dataset partitioned by site and year.
+        sites (Iterable[str] | None): Sites, defaults to all sites in the dataset.
+        variables (Iterable[str] | None): Variables, e.g. ['ua50m', 'va50m'], defaults to all variables.
+        start (str | datetime | None): Start of the inclusive window, UTC if naive, defaults to unbounded.
+        end (str | datetime | None): End of the inclusive window, UTC if naive, defaults to unbounded.
+
+    Returns:
+        pd.DataFrame: site, time and variable columns, sorted by site and time.
+
+    Raises:
+        ImportError: If pyarrow is not installed.
+        ValueError: If a variable is not in the dataset.
+    """
+    pa = _optional_import('pyarrow', 'parquet', 'querying a Parquet dataset')
+    pc = _optional_import('pyarrow.compute', 'parquet', 'querying a Parquet dataset')
+    ds = _optional_import('pyarrow.dataset', 'parquet', 'querying a Parquet dataset')
+    dataset = ds.dataset(dataset_dir, format='parquet', partitioning='hive')
+    all_variables = [name for name in dataset.schema.names if name not in ('site', 'year', 'time')]
+    variables = list(variables) if variables is not None else all_variables
+    unknown = set(variables) - set(all_variables)
+    if unknown:
+        raise ValueError(f'Variables {sorted(unknown)} are not in the dataset, use {all_variables}.')
+
+    window_start, window_end = _window(start, end)
+    time_type = dataset.schema.field('time').type
+    predicates = []
+    if sites is not None:
+        predicates.append(ds.field('site').isin(list(sites)))
+    if window_start != pd.Timestamp.min:
+        # the year partition prunes whole files, the time predicate prunes row groups by their statistics
+        predicates.append(ds.field('year') >= window_start.year)
+        predicates.append(ds.field('time') >= pa.scalar(window_start.tz_localize('UTC'), type=time_type))
+    if window_end != pd.Timestamp.max:
+        predicates.append(ds.field('year') <= window_end.year)
+        predicates.append(ds.field('time') <= pa.scalar(window_end.tz_localize('UTC'), type=time_type))
+    expression = None
+    for predicate in predicates:
+        expression = predicate if expression is None else expression & predicate
+
+    table = dataset.to_table(columns=['site', 'time', *variables], filter=expression)
+    table = table.set_column(0, 'site', pc.cast(table['site'], pa.string()))
+    df_query: pd.DataFrame = table.sort_by([('site', 'ascending'), ('time', 'ascending')]).to_pandas()
+    df_query['site'] = df_query['site'].astype('category')
+    return df_query
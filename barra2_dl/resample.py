@@ -0,0 +1,224 @@
+"""This module contains the barra2 resample function(s).
+
+Merged hourly data is resampled one month of cached files at a time, so the full hourly record is never held in
+memory. Wind components ua and va are averaged before conversion to speed and direction, which gives the speed and
+direction of the mean wind vector, instead of averaging directions. Resampled chunks are stored in a FrameCache keyed
+by the fingerprint of their files, so repeated requests, e.g. for monthly means, do not read the hourly data again.
+"""
+import logging
+from collections.abc import Iterable
+from pathlib import Path
+from typing import cast
+
+import pandas as pd
+
+from barra2_dl.cache import FrameCache, fingerprint_files
+from barra2_dl.compression import cached_files
+from barra2_dl.convert import convert_wind_components
+from barra2_dl.instrument import EventCallback, stage
+from barra2_dl.merge import _chunk_files, compact_barra2_frame, merge_files_to_df
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'resample_frame',
+    'resample_files',
+    'resample_csvs',
+]
+
+_HOUR = pd.Timedelta(hours=1)
+
+# cached chunks are invalidated when the chunk format changes
+_CACHE_VERSION = 1
+
+
+def _is_upsample(
+    freq: str,
+) -> bool:
+    """True if freq is a fixed frequency shorter than the hourly data, e.g. '10min'."""
+    try:
+        offset = pd.tseries.frequencies.to_offset(freq)
+    except ValueError:
+        return False
+    return isinstance(offset, pd.offsets.Tick) and pd.Timedelta(offset) < _HOUR
+
+
+def _numeric(
+    df: pd.DataFrame,
+) -> pd.DataFrame:
+    """Compact frame with only the numeric columns, as resampled."""
+    if not isinstance(df.index, pd.DatetimeIndex):
+        df = compact_barra2_frame(df)
+    return df.select_dtypes('number')
+
+
+def _period_sums(
+    df: pd.DataFrame,
+    freq: str,
+) -> pd.DataFrame:
+    """Sum and count of each column by period, with column level 0 of 'sum' and 'count'."""
+    resampler = df.resample(freq)
+    return pd.concat({'sum': resampler.sum(min_count=1), 'count': resampler.count()}, axis=1)
+
+
+def _mean_of_sums(
+    df_sums: pd.DataFrame,
+) -> pd.DataFrame:
+    """Mean by period from combined period sums and counts."""
+    # selecting a column level gives a frame, typed as a Series by pandas-stubs
+    sums, counts = cast(pd.DataFrame, df_sums['sum']), cast(pd.DataFrame, df_sums['count'])
+    df_mean = sums / counts.where(counts > 0)
+    df_mean.attrs = dict(df_sums.attrs)
+    return df_mean
+
+
+def _interpolate(
+    df: pd.DataFrame,
+    freq: str,
+) -> pd.DataFrame:
+    """Interpolate hourly data to a shorter fixed frequency, linear in time between hours."""
+    index = pd.date_range(df.index[0], df.index[-1], freq=freq, name=df.index.name)
+    return df.reindex(df.index.union(index)).interpolate(method='time', limit_area='inside').reindex(index)
+
+
+def resample_frame(
+    df: pd.DataFrame,
+    freq: str,
+    convert: bool = True,
+    callback: EventCallback | None = None,
+    quiet: bool = True,
+) -> pd.DataFrame:
+    """Resample merged hourly data to means by period, or interpolate it to a shorter frequency.
+
+    Args:
+        df (pd.DataFrame): Output of merge_csvs_to_df, compact or not.
+        freq (str): Pandas frequency, e.g. '10min', 'D' or 'MS'.
+        convert (bool): If True convert the resampled wind components with convert_wind_components.
+        callback (EventCallback | None): Optional callable receiving a StageEvent for the resample.
+        quiet (bool): If True nothing is written to stdout.
+
+    Returns:
+        pd.DataFrame: Numeric columns indexed by time at freq, with ua and va averaged as vectors.
+    """
+    with stage('resample', detail=f'Resampled to {freq}', callback=callback, quiet=quiet) as resample_stage:
+        df_numeric = _numeric(df)
+        resample_stage.rows = len(df_numeric)
+        if _is_upsample(freq):
+            df_resampled = _interpolate(df_numeric, freq)
+        else:
+            df_resampled = _mean_of_sums(_period_sums(df_numeric, freq))
+        df_resampled.attrs = dict(df_numeric.attrs)
+    if convert:
+        df_resampled = convert_wind_components(df_resampled, callback=callback, quiet=quiet)
+    return df_resampled
+
+
+def resample_files(
+    files: Iterable[Path],
+    freq: str,
+    convert: bool = True,
+    cache_dir: str | Path | None = None,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+) -> pd.DataFrame:
+    """Merge and resample a list of cached csv files of a single site one month at a time, see resample_csvs.
+
+    Args:
+        files (Iterable[Path]): Cached csv files, uncompressed or compressed, e.g. the files of a plan from
+            CacheInventory.
+        freq (str): Pandas frequency, e.g. '10min', 'D', 'MS' or 'YS'.
+        convert (bool): If True convert the resampled wind components with convert_wind_components.
+        cache_dir (str | Path | None): Folder of cached resampled chunks, or None to resample all chunks without
+            reading or writing a cache.
+        callback (EventCallback | None): Optional callable receiving StageEvents for each parse, join and resample.
+        quiet (bool): If True nothing is written to stdout.
+
+    Returns:
+        pd.DataFrame: Numeric columns indexed by time at freq, with the site in df.attrs['site'].
+
+    Raises:
+        ValueError: If there are no files.
+    """
+    chunks = _chunk_files(files)
+    if not chunks:
+        raise ValueError('No files to resample.')
+    frame_cache = FrameCache(cache_dir) if cache_dir is not None else None
+    upsample = _is_upsample(freq)
+
+    frames: list[pd.DataFrame] = []
+    previous_files: list[Path] = []
+    for chunk_files in chunks:
+        # interpolated chunks start from the last hour of the previous chunk, so depend on its files
+        sources = chunk_files + previous_files if upsample else chunk_files
+        key = fingerprint_files(sources, freq, _CACHE_VERSION)
+        group = fingerprint_files([], 'resampled', *sorted(str(file) for file in sources), freq)
+        df_chunk = frame_cache.get(key, group) if frame_cache is not None else None
+        if df_chunk is None:
+            df_hourly = _numeric(merge_files_to_df(chunk_files, callback=callback, quiet=True, align_on_time=True))
+            with stage('resample', detail=f'Resampled {chunk_files[0].name} to {freq}', callback=callback,
+                       quiet=True) as resample_stage:
+                resample_stage.rows = len(df_hourly)
+                if upsample and frames:
+                    # the last row of an interpolated chunk is its last hour
+                    df_chunk = _interpolate(pd.concat([frames[-1].iloc[-1:], df_hourly]), freq).iloc[1:]
+                elif upsample:
+                    df_chunk = _interpolate(df_hourly, freq)
+                else:
+                    df_chunk = _period_sums(df_hourly, freq)
+                df_chunk.attrs = dict(df_hourly.attrs)
+            if frame_cache is not None:
+                frame_cache.put(key, df_chunk, group)
+        frames.append(df_chunk)
+        previous_files = chunk_files
+
+    # missing hours of a single chunk do not apply to the resampled record
+    attrs = {key: value for key, value in frames[0].attrs.items() if key != 'missing_hours'}
+    df_resampled = pd.concat(frames)
+    if not upsample:
+        # periods longer than a chunk are summed over chunks before the mean
+        df_resampled = _mean_of_sums(df_resampled.groupby(level=0).sum(min_count=1))
+    df_resampled.attrs = attrs
+    if convert:
+        df_resampled = convert_wind_components(df_resampled, callback=callback, quiet=quiet)
+    return df_resampled
+
+
+def resample_csvs(
+    filein_folder: str | Path,
+    freq: str,
+    filename_pattern: str = '*.csv',
+    convert: bool = True,
+    cache_dir: str | Path | None = None,
+    use_cache: bool = False,
+    callback: EventCallback | None = None,
+    quiet: bool = False,
+) -> pd.DataFrame:
+    """Merge and resample cached csv files one month at a time.
+
+    Means over periods longer than a month, e.g. 'QS' or 'YS', are combined from the sums and counts of each month,
+    so they equal the mean of the full hourly record. Interpolation to a shorter frequency, e.g. '10min', includes
+    the hours between the last hour of one month and the first hour of the next.
+
+    Args:
+        filein_folder (str | Path): Folder of cached csv files, as downloaded for a single site.
+        freq (str): Pandas frequency, e.g. '10min', 'D', 'MS' or 'YS'.
+        filename_pattern (str): Filename matching pattern. Use if multiple location files are in same folder.
+        convert (bool): If True convert the resampled wind components with convert_wind_components.
+        cache_dir (str | Path | None): Folder of cached resampled chunks, or None to not cache them unless use_cache.
+        use_cache (bool): If True cache the resampled chunks, in filein_folder/_resampled if cache_dir is None.
+        callback (EventCallback | None): Optional callable receiving StageEvents for each parse, join and resample.
+        quiet (bool): If True nothing is written to stdout.
+
+    Returns:
+        pd.DataFrame: Numeric columns indexed by time at freq, with the site in df.attrs['site'].
+
+    Raises:
+        ValueError: If no files match filename_pattern.
+    """
+    files = cached_files(filein_folder, filename_pattern)
+    if not files:
+        raise ValueError(f'No files matching <{filename_pattern}> in <{filein_folder}>.')
+    if cache_dir is None and use_cache:
+        cache_dir = Path(filein_folder) / '_resampled'
+    return resample_files(files, freq, convert=convert, cache_dir=cache_dir, callback=callback, quiet=quiet)
@@ -0,0 +1,448 @@
+"""This module contains the barra2 cache storage classes.
+
+The downloaders write cached files and the merge finds them through a Storage, so the cache can be a local folder or
+S3 compatible object storage shared by the workers of a cluster. LocalStorage keeps the atomic partial file writes of
+the local cache. S3Storage uses an injected boto3 style client, e.g. boto3.client('s3', endpoint_url=...) for MinIO,
+so no S3 package is a dependency. Objects larger than part_size are uploaded as parallel multipart uploads and read
+as parallel range requests. Listings are fetched in pages of 1000 keys and cached for list_ttl seconds, and updated
+by the writes and deletes of the same Storage, so checking each planned file of a plan costs no request. Remote
+caches are merged from a local mirror of the matched files, refreshed from the cached listing, so merges are
+memoised as for a local cache.
+"""
+import fnmatch
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+from barra2_dl.compression import COMPRESSIONS, cached_files, cached_path, plain_name
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'Storage',
+    'LocalStorage',
+    'S3Storage',
+]
+
+# S3 limits on the size of all but the last part of a multipart upload, and on keys in a page of a listing
+_MIN_PART_SIZE = 5 * 1024 * 1024
+_LIST_PAGE_SIZE = 1000
+
+
+def _preferred_names(
+    names: Iterable[str],
+    filename_pattern: str,
+) -> list[str]:
+    """Names whose planned name matches filename_pattern, one per planned name preferring uncompressed, sorted.
+
+    Example:
+        >>> _preferred_names(['b.csv.gz', 'a.csv.zst', 'a.csv', 'notes.txt'], '*.csv')
+        ['a.csv', 'b.csv.gz']
+    """
+    files: dict[str, str] = {}
+    for name in sorted(names, key=lambda name: (plain_name(name), len(name))):
+        if fnmatch.fnmatch(plain_name(name), filename_pattern):
+            files.setdefault(plain_name(name), name)
+    return list(files.values())
+
+
+class Storage(ABC):
+    """Abstract base class of cache storage backends, with a listing cached for list_ttl seconds.
+
+    Backends implement _list_all, _read, _write, _delete and local_files. Names are file names in the cache, e.g.
+    demo_ua50m_20230101_20230131.csv.gz, as in a local cache folder.
+
+    Attributes:
+        list_ttl (float): Seconds a listing is reused before it is fetched again.
+    """
+
+    def __init__(self, list_ttl: float = 60.0):
+        """Set up the listing cache.
+
+        Args:
+            list_ttl (float): Seconds a listing is reused before it is fetched again.
+        """
+        self.list_ttl = list_ttl
+        self._listing: dict[str, tuple[int, float]] | None = None
+        self._listed = 0.0
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _list_all(self) -> dict[str, tuple[int, float]]:
+        """Size and modification time of every file by name."""
+
+    @abstractmethod
+    def _read(
+        self,
+        name: str,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> bytes:
+        """Content of a file, or of bytes start to end exclusive, or to the end of the file if end is None."""
+
+    @abstractmethod
+    def _write(
+        self,
+        name: str,
+        data: bytes,
+    ) -> None:
+        """Write a file, replacing any file of the same name."""
+
+    @abstractmethod
+    def _delete(
+        self,
+        name: str,
+    ) -> None:
+        """Delete a file."""
+
+    def _cached_listing(
+        self,
+        refresh: bool = False,
+    ) -> dict[str, tuple[int, float]]:
+        """The cached listing itself, fetched again if refresh or expired. Call with the lock held."""
+        if refresh or self._listing is None or time.monotonic() - self._listed > self.list_ttl:
+            self._listing = self._list_all()
+            self._listed = time.monotonic()
+        return self._listing
+
+    def listing(
+        self,
+        refresh: bool = False,
+    ) -> dict[str, tuple[int, float]]:
+        """Size and modification time of every file by name, from the cached listing unless refresh or expired."""
+        with self._lock:
+            return dict(self._cached_listing(refresh))
+
+    def list_names(
+        self,
+        filename_pattern: str = '*.csv',
+    ) -> list[str]:
+        """Names of the cached files whose planned name matches filename_pattern, see compression.cached_files."""
+        return _preferred_names(self.listing(), filename_pattern)
+
+    def stat(
+        self,
+        name: str,
+    ) -> tuple[int, float] | None:
+        """Size and modification time of a file, or None if it does not exist."""
+        with self._lock:
+            return self._cached_listing().get(name)
+
+    def cached_name(
+        self,
+        file_name: str,
+    ) -> str | None:
+        """Name of a planned file in the cache, uncompressed or compressed, or None if not cached."""
+        with self._lock:
+            listing = self._cached_listing()
+            for suffix in ('', *COMPRESSIONS.values()):
+                if f'{file_name}{suffix}' in listing:
+                    return f'{file_name}{suffix}'
+        return None
+
+    def read_bytes(
+        self,
+        name: str,
+    ) -> bytes:
+        """Content of a file."""
+        return self._read(name)
+
+    def read_range(
+        self,
+        name: str,
+        start: int,
+        length: int,
+    ) -> bytes:
+        """Content of length bytes of a file from byte start, fewer at the end of the file."""
+        return self._read(name, start, start + length)
+
+    def write_bytes(
+        self,
+        name: str,
+        data: bytes,
+    ) -> int:
+        """Write a file, replacing any file of the same name, and return the number of bytes written."""
+        self._write(name, data)
+        with self._lock:
+            if self._listing is not None:
+                self._listing[name] = (len(data), time.time())
+        return len(data)
+
+    def delete(
+        self,
+        name: str,
+    ) -> None:
+        """Delete a file."""
+        self._delete(name)
+        with self._lock:
+            if self._listing is not None:
+                self._listing.pop(name, None)
+
+    @abstractmethod
+    def local_files(
+        self,
+        filename_pattern: str = '*.csv',
+    ) -> list[Path]:
+        """Local paths of the cached files whose planned name matches filename_pattern, sorted by planned name."""
+
+
+class LocalStorage(Storage):
+    """Cache in a local folder, written atomically through partial files.
+
+    Files are looked up and listed on the file system rather than from a cached listing, so files written by other
+    processes are seen at once.
+
+    Attributes:
+        folder_path (Path): Cache folder.
+    """
+
+    def __init__(self, folder_path: str | Path):
+        """Set up the storage of a cache folder.
+
+        Args:
+            folder_path (str | Path): Cache folder.
+        """
+        super().__init__(list_ttl=0.0)
+        self.folder_path = Path(folder_path)
+
+    def __str__(self) -> str:
+        """Path of the cache folder."""
+        return str(self.folder_path)
+
+    def _list_all(self) -> dict[str, tuple[int, float]]:
+        entries = {}
+        with os.scandir(self.folder_path) as scan:
+            for entry in scan:
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries[entry.name] = (stat.st_size, stat.st_mtime)
+        return entries
+
+    def _read(
+        self,
+        name: str,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> bytes:
+        with open(self.folder_path / name, 'rb') as file:
+            if start is None:
+                return file.read()
+            file.seek(start)
+            return file.read(end - start if end is not None else -1)
+
+    def _write(
+        self,
+        name: str,
+        data: bytes,
+    ) -> None:
+        # write to a partial file replacing the file, so a cached file is never left truncated
+        path = self.folder_path / name
+        partial = path.with_name(f'{name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        partial.write_bytes(data)
+        os.replace(partial, path)
+
+    def _delete(
+        self,
+        name: str,
+    ) -> None:
+        (self.folder_path / name).unlink(missing_ok=True)
+
+    def stat(
+        self,
+        name: str,
+    ) -> tuple[int, float] | None:
+        """Size and modification time of a file on the file system, or None if it does not exist."""
+        try:
+            stat = (self.folder_path / name).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def cached_name(
+        self,
+        file_name: str,
+    ) -> str | None:
+        """Name of a planned file in the folder, uncompressed or compressed, or None if not cached."""
+        path = cached_path(self.folder_path, file_name)
+        return path.name if path is not None else None
+
+    def local_files(
+        self,
+        filename_pattern: str = '*.csv',
+    ) -> list[Path]:
+        """Cached files whose planned name matches filename_pattern, see compression.cached_files."""
+        return cached_files(self.folder_path, filename_pattern)
+
+
+class S3Storage(Storage):
+    """Cache in an S3 compatible bucket through an injected boto3 style client, see the module description.
+
+    The client is used from several threads, as boto3 clients are thread safe. Only list_objects_v2, get_object,
+    put_object, delete_object and the multipart upload methods are used.
+
+    Attributes:
+        client (Any): S3 client, e.g. boto3.client('s3', endpoint_url='http://minio:9000').
+        bucket (str): Bucket name.
+        prefix (str): Key prefix of the cache, e.g. 'barra2/cache/'.
+        part_size (int): Bytes in each part of multipart uploads and ranged reads.
+        max_workers (int): Number of threads uploading or reading parts, or mirroring files.
+        mirror_dir (Path | None): Local folder the matched files are mirrored to for merging.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        bucket: str,
+        prefix: str = '',
+        part_size: int = 8 * 1024 * 1024,
+        max_workers: int = 8,
+        list_ttl: float = 60.0,
+        mirror_dir: str | Path | None = None,
+    ):
+        """Set up the storage of a bucket.
+
+        Args:
+            client (Any): S3 client, e.g. boto3.client('s3', endpoint_url='http://minio:9000').
+            bucket (str): Bucket name.
+            prefix (str): Key prefix of the cache, a trailing / is added if missing.
+            part_size (int): Bytes in each part of multipart uploads and ranged reads, at least 5 MiB.
+            max_workers (int): Number of threads uploading or reading parts, or mirroring files.
+            list_ttl (float): Seconds a listing is reused before it is fetched again.
+            mirror_dir (str | Path | None): Local folder the matched files are mirrored to for merging.
+
+        Raises:
+            ValueError: If part_size is less than 5 MiB.
+        """
+        if part_size < _MIN_PART_SIZE:
+            raise ValueError(f'part_size must be at least {_MIN_PART_SIZE} bytes, got {part_size}.')
+        super().__init__(list_ttl)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix if not prefix or prefix.endswith('/') else f'{prefix}/'
+        self.part_size = part_size
+        self.max_workers = max_workers
+        self.mirror_dir = Path(mirror_dir) if mirror_dir is not None else None
+
+    def __str__(self) -> str:
+        """URL of the cache, s3://bucket/prefix."""
+        return f's3://{self.bucket}/{self.prefix}'
+
+    def _list_all(self) -> dict[str, tuple[int, float]]:
+        entries = {}
+        request = {'Bucket': self.bucket, 'Prefix': self.prefix, 'MaxKeys': _LIST_PAGE_SIZE}
+        while True:
+            page = self.client.list_objects_v2(**request)
+            for item in page.get('Contents', []):
+                name = item['Key'][len(self.prefix):]
+                if '/' not in name:
+                    entries[name] = (item['Size'], item['LastModified'].timestamp())
+            if not page.get('IsTruncated'):
+                return entries
+            request['ContinuationToken'] = page['NextContinuationToken']
+
+    def _read(
+        self,
+        name: str,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> bytes:
+        request = {'Bucket': self.bucket, 'Key': f'{self.prefix}{name}'}
+        if start is not None:
+            request['Range'] = f"bytes={start}-{end - 1 if end is not None else ''}"
+        body: bytes = self.client.get_object(**request)['Body'].read()
+        return body
+
+    def read_bytes(
+        self,
+        name: str,
+    ) -> bytes:
+        """Content of a file, read as parallel range requests of part_size if larger."""
+        stat = self.stat(name)
+        if stat is None or stat[0] <= self.part_size:
+            return self._read(name)
+        from concurrent.futures import ThreadPoolExecutor
+
+        starts = range(0, stat[0], self.part_size)
+        with ThreadPoolExecutor(min(self.max_workers, len(starts))) as pool:
+            return b''.join(pool.map(lambda start: self.read_range(name, start, self.part_size), starts))
+
+    def _write(
+        self,
+        name: str,
+        data: bytes,
+    ) -> None:
+        key = f'{self.prefix}{name}'
+        if len(data) <= self.part_size:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+            return
+        from concurrent.futures import ThreadPoolExecutor
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+
+        def upload_part(part_number: int) -> dict[str, Any]:
+            start = (part_number - 1) * self.part_size
+            response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                               PartNumber=part_number, Body=data[start:start + self.part_size])
+            return {'ETag': response['ETag'], 'PartNumber': part_number}
+
+        try:
+            part_numbers = range(1, -(-len(data) // self.part_size) + 1)
+            with ThreadPoolExecutor(min(self.max_workers, len(part_numbers))) as pool:
+                parts = list(pool.map(upload_part, part_numbers))
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                                  MultipartUpload={'Parts': parts})
+        except BaseException:
+            # abort so the parts uploaded are not kept, and billed, by the bucket
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def _delete(
+        self,
+        name: str,
+    ) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=f'{self.prefix}{name}')
+
+    def local_files(
+        self,
+        filename_pattern: str = '*.csv',
+    ) -> list[Path]:
+        """Mirror the cached files whose planned name matches filename_pattern and return their local paths.
+
+        Only files missing from the mirror or whose size or modification time changed are downloaded, in parallel,
+        and mirrored files keep the modification time of the object, so memoised merges of the mirror stay valid.
+
+        Args:
+            filename_pattern (str): Filename matching pattern of the planned names, e.g. 'demo_*.csv'.
+
+        Returns:
+            list[Path]: The mirrored files sorted by planned name.
+
+        Raises:
+            ValueError: If the storage has no mirror_dir.
+        """
+        mirror_dir = self.mirror_dir
+        if mirror_dir is None:
+            raise ValueError(f'<{self}> has no mirror_dir to mirror files to.')
+        from concurrent.futures import ThreadPoolExecutor
+
+        mirror_dir.mkdir(parents=True, exist_ok=True)
+        listing = self.listing()
+        names = _preferred_names(listing, filename_pattern)
+
+        def mirror(name: str) -> None:
+            size, mtime = listing[name]
+            path = mirror_dir / name
+            if path.exists() and path.stat().st_size == size and path.stat().st_mtime == mtime:
+                return
+            LocalStorage(mirror_dir).write_bytes(name, self.read_bytes(name))
+            os.utime(path, (mtime, mtime))
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            list(pool.map(mirror, names))
+        return [mirror_dir / name for name in names]
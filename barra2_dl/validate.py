@@ -0,0 +1,200 @@
+"""This module contains the barra2 file validation function(s).
+
+Thredds can respond with status 200 and an error message as the body, e.g. 'FileNotFound: No such file or directory',
+or a truncated csv file. These checks read only the header line, the first data row and the last data row of a file,
+from the first and last few KB, so files can be validated inline as they are downloaded without a pandas parse.
+"""
+import logging
+import os
+import re
+from collections.abc import Iterable
+from datetime import timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from barra2_dl.compression import COMPRESSIONS, open_cached
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'FILENAME_PATTERN',
+    'parse_filename',
+    'validate_csv_bytes',
+    'validate_csv_file',
+]
+
+# e.g. barra2_aus11_1hr_ua50m_20230101_20230131.csv, the prefix may contain underscores but the variable does not,
+# optionally with the suffix of a compressed cache file, see barra2_dl.compression. Matching the pattern directly,
+# rather than with parse_filename, does not import pandas.
+FILENAME_PATTERN = re.compile(
+    r'^(?P<prefix>.+)_(?P<var>[^_]+)_(?P<start>\d{8})_(?P<end>\d{8})\.(?P<ext>csv)(?:\.gz|\.zst)?$'
+)
+
+# Leading columns of the thredds NetCDF Subset Service csv point data, followed by one column per variable
+_HEADER_TOKENS = ('time', 'station', 'latitude', 'longitude')
+
+_BLOCK_SIZE = 4096
+
+
+def parse_filename(
+    file_name: str,
+) -> dict[str, Any] | None:
+    """Parse the prefix, variable and period of a cached file name.
+
+    Args:
+        file_name (str): File name as created by point_data_urlfilenames.
+
+    Returns:
+        dict[str, Any] | None: prefix, var, start and end (pd.Timestamp of the first and last hour), or None if not
+        matched.
+
+    Example:
+        >>> parse_filename('barra2_aus11_1hr_ua50m_20230201_20230228.csv')['end']
+        Timestamp('2023-02-28 23:00:00')
+    """
+    match = FILENAME_PATTERN.match(file_name)
+    if match is None:
+        return None
+    import pandas as pd
+
+    return {
+        'prefix': match['prefix'],
+        'var': match['var'],
+        'start': pd.Timestamp(match['start']),
+        'end': pd.Timestamp(match['end']) + pd.Timedelta(hours=23),
+    }
+
+
+def _row_time(
+    line: bytes,
+) -> 'pd.Timestamp | None':
+    """Timestamp in the first column of a data row, floored to the hour, or None if not a timestamp."""
+    import pandas as pd
+
+    try:
+        return pd.Timestamp(line.split(b',', 1)[0].decode()).tz_localize(None).floor('h')
+    except ValueError:
+        return None
+
+
+def _read_head_tail(
+    path: str | Path,
+    block_size: int = _BLOCK_SIZE,
+) -> tuple[bytes, bytes]:
+    """First and last block_size bytes of an uncompressed file, seeking past the rest."""
+    with open(path, 'rb') as file:
+        head = file.read(block_size)
+        size = file.seek(0, os.SEEK_END)
+        file.seek(max(size - block_size, 0))
+        return head, file.read(block_size)
+
+
+def _count_data_rows(
+    chunks: Iterable[bytes],
+) -> int:
+    """Number of data rows of csv content read in chunks, the lines after the header line."""
+    lines = 0
+    last = b'\n'
+    for chunk in chunks:
+        lines += chunk.count(b'\n')
+        last = chunk[-1:] or last
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def validate_csv_bytes(
+    head: bytes,
+    tail: bytes,
+    var: str | None = None,
+    start: 'pd.Timestamp | None' = None,
+    end: 'pd.Timestamp | None' = None,
+    rows: int | None = None,
+) -> str | None:
+    """Check the start and end of csv point data for a single variable and period.
+
+    Args:
+        head (bytes): The first bytes of the file, including the header line and first data row.
+        tail (bytes): The last bytes of the file, including the last data row.
+        var (str | None): Optional variable expected as a column in the header.
+        start (pd.Timestamp | None): Optional expected hour of the first data row.
+        end (pd.Timestamp | None): Optional expected hour of the last data row.
+        rows (int | None): Optional number of data rows, checked against the hours from start to end.
+
+    Returns:
+        str | None: Description of the first problem found, or None if the file is valid.
+
+    Example:
+        >>> validate_csv_bytes(b'FileNotFound: No such file or directory', b'')
+        'Unexpected header <FileNotFound: No such file or directory>'
+    """
+    lines = head.split(b'\n', 2)
+    header = lines[0].rstrip(b'\r').decode(errors='replace')
+    columns = [column.split('[', 1)[0] for column in header.split(',')]
+    if tuple(columns[:len(_HEADER_TOKENS)]) != _HEADER_TOKENS:
+        return f'Unexpected header <{header[:80]}>'
+    if var is not None and var not in columns:
+        return f'Column <{var}> not in header <{header[:80]}>'
+    if len(lines) < 2 or not lines[1].strip():
+        return 'No data rows'
+
+    first = _row_time(lines[1])
+    last_line = tail.rstrip(b'\r\n').rsplit(b'\n', 1)[-1]
+    last = _row_time(last_line)
+    if first is None or last is None:
+        return 'Invalid time in first or last data row'
+    if start is not None and first != start:
+        return f'First row at {first} not {start}'
+    if end is not None and last != end:
+        return f'Last row at {last} not {end}'
+    if rows is not None:
+        expected_rows = (last - first) // timedelta(hours=1) + 1
+        if rows != expected_rows:
+            return f'{rows} rows for {expected_rows} hours'
+    return None
+
+
+def validate_csv_file(
+    path: str | Path,
+    var: str | None = None,
+    start: 'pd.Timestamp | None' = None,
+    end: 'pd.Timestamp | None' = None,
+    block_size: int = _BLOCK_SIZE,
+) -> str | None:
+    """Check a cached csv file, reading only its first and last block_size bytes.
+
+    The variable and period default to those in the file name if it matches the point_data_urlfilenames format.
+    Compressed files, see barra2_dl.compression, are read through to their last block_size bytes.
+
+    Args:
+        path (str | Path): Path of the csv file.
+        var (str | None): Optional variable expected as a column in the header.
+        start (pd.Timestamp | None): Optional expected hour of the first data row.
+        end (pd.Timestamp | None): Optional expected hour of the last data row.
+        block_size (int): Number of bytes read from the start and end of the file.
+
+    Returns:
+        str | None: Description of the first problem found, or None if the file is valid.
+    """
+    path = Path(path)
+    parsed = parse_filename(path.name) or {}
+    if path.suffix in COMPRESSIONS.values():
+        with open_cached(path) as file:
+            head = file.read(block_size)
+            tail = head
+            while block := file.read(block_size):
+                tail = tail[-block_size:] + block
+        tail = tail[-block_size:]
+    else:
+        head, tail = _read_head_tail(path, block_size)
+    return validate_csv_bytes(
+        head,
+        tail,
+        var=var or parsed.get('var'),
+        start=start or parsed.get('start'),
+        end=end or parsed.get('end'),
+    )
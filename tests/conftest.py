@@ -0,0 +1,161 @@
+"""This module contains shared barra2 test fixture(s)."""
+import calendar
+import hashlib
+import io
+import threading
+import zlib
+from collections import Counter
+from datetime import UTC, datetime
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pytest
+
+_HEADER = 'time,station,latitude[unit="degrees_north"],longitude[unit="degrees_east"],{var}[unit="{unit}"]\n'
+_STATION = 'GridPointRequestedAt[23.553S_133.396E]'
+
+
+def make_barra2_csv(
+    var: str,
+    year: int,
+    month: int,
+    hours: int = None,
+    seed: int = 0,
+) -> str:
+    """Create csv text in the format returned by the thredds NetCDF Subset Service for a single month."""
+    hours = hours if hours is not None else calendar.monthrange(year, month)[1] * 24
+    unit = 'K' if var.startswith('ta') else 'm s-1'
+    values = np.random.default_rng(seed).normal(0, 5, hours)
+    rows = [
+        f'{year}-{month:02d}-{1 + hour // 24:02d}T{hour % 24:02d}:00:00Z,{_STATION},-23.54,133.43,{value:.4f}\n'
+        for hour, value in enumerate(values)
+    ]
+    return _HEADER.format(var=var, unit=unit) + ''.join(rows)
+
+
+class FakeResponse:
+    """Minimal stand in for requests.Response."""
+
+    def __init__(self, content: bytes = b'', status_code: int = 200, headers: dict = None):
+        """Response with content, status_code and headers."""
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def fake_thredds_get(url: str, headers: dict = None, **kwargs) -> FakeResponse:
+    """Stand in for requests.get returning a month of csv data for a thredds point data url, or 304 if unchanged."""
+    query = parse_qs(urlsplit(url).query)
+    time_start = query['time_start'][0]
+    year, month = int(time_start[:4]), int(time_start[5:7])
+    content = make_barra2_csv(query['var'][0], year, month, seed=month).encode()
+    etag = f'"{zlib.crc32(content):08x}"'
+    if (headers or {}).get('If-None-Match') == etag:
+        return FakeResponse(status_code=304, headers={'ETag': etag})
+    return FakeResponse(content, headers={'ETag': etag})
+
+
+class FakeS3Client:
+    """In memory stand in for a boto3 S3 client of an S3 compatible server such as MinIO, counting calls.
+
+    Methods take the keyword arguments of boto3, e.g. put_object(Bucket=..., Key=..., Body=...).
+    """
+
+    def __init__(self, fail_part: int | None = None):
+        """Empty buckets, with upload_part failing for part number fail_part."""
+        self.objects: dict[tuple[str, str], tuple[bytes, datetime]] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        self.calls: Counter = Counter()
+        self.fail_part = fail_part
+        self._lock = threading.Lock()
+
+    def _count(self, method: str) -> None:
+        """Count a call."""
+        with self._lock:
+            self.calls[method] += 1
+
+    def put_object(self, **request) -> dict:
+        """Store an object."""
+        self._count('put_object')
+        self.objects[request['Bucket'], request['Key']] = (bytes(request['Body']), datetime.now(UTC))
+        return {'ETag': f'"{hashlib.md5(request["Body"], usedforsecurity=False).hexdigest()}"'}
+
+    def get_object(self, **request) -> dict:
+        """Object content, or the byte range of a Range request."""
+        self._count('get_object')
+        body = self.objects[request['Bucket'], request['Key']][0]
+        if 'Range' in request:
+            start, end = (int(value) for value in request['Range'].removeprefix('bytes=').split('-'))
+            body = body[start:end + 1]
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+
+    def delete_object(self, **request) -> dict:
+        """Delete an object."""
+        self._count('delete_object')
+        self.objects.pop((request['Bucket'], request['Key']), None)
+        return {}
+
+    def list_objects_v2(self, **request) -> dict:
+        """Page of MaxKeys keys with a prefix, continued from a ContinuationToken."""
+        self._count('list_objects_v2')
+        bucket, max_keys = request['Bucket'], request.get('MaxKeys', 1000)
+        keys = sorted(key for name, key in self.objects if name == bucket and key.startswith(request.get('Prefix', '')))
+        start = int(request.get('ContinuationToken', 0))
+        contents = [{'Key': key, 'Size': len(self.objects[bucket, key][0]),
+                     'LastModified': self.objects[bucket, key][1]} for key in keys[start:start + max_keys]]
+        if start + max_keys < len(keys):
+            return {'Contents': contents, 'IsTruncated': True, 'NextContinuationToken': str(start + max_keys)}
+        return {'Contents': contents, 'IsTruncated': False}
+
+    def create_multipart_upload(self, **request) -> dict:
+        """Start a multipart upload."""
+        self._count('create_multipart_upload')
+        upload_id = f'upload{len(self.uploads)}'
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, **request) -> dict:
+        """Store a part of a multipart upload, failing for part number fail_part."""
+        self._count('upload_part')
+        if request['PartNumber'] == self.fail_part:
+            raise ConnectionError(f"Part {request['PartNumber']} failed.")
+        self.uploads[request['UploadId']][request['PartNumber']] = bytes(request['Body'])
+        return {'ETag': f'"{request["PartNumber"]}"'}
+
+    def complete_multipart_upload(self, **request) -> dict:
+        """Join the parts of a multipart upload into an object."""
+        self._count('complete_multipart_upload')
+        parts = self.uploads.pop(request['UploadId'])
+        body = b''.join(parts[part['PartNumber']] for part in request['MultipartUpload']['Parts'])
+        self.objects[request['Bucket'], request['Key']] = (body, datetime.now(UTC))
+        return {}
+
+    def abort_multipart_upload(self, **request) -> dict:
+        """Discard the parts of a multipart upload."""
+        self._count('abort_multipart_upload')
+        self.uploads.pop(request['UploadId'], None)
+        return {}
+
+
+@pytest.fixture
+def barra2_cache(tmp_path):
+    """Cache folder with two months of ua50m, va50m and ta50m csv files for the prefix demo."""
+    folder = tmp_path / 'cache'
+    folder.mkdir()
+    for seed, var in enumerate(['ua50m', 'va50m', 'ta50m']):
+        for month in (1, 2):
+            last_day = calendar.monthrange(2023, month)[1]
+            file_name = f'demo_{var}_2023{month:02d}01_2023{month:02d}{last_day}.csv'
+            (folder / file_name).write_text(make_barra2_csv(var, 2023, month, seed=seed * 10 + month))
+    return folder
+
+
+@pytest.fixture
+def sites_cache(barra2_cache):
+    """Demo cache with a second site, other, with ua50m and va50m for January 2023 and January 2024."""
+    for var in ('ua50m', 'va50m'):
+        for year in (2023, 2024):
+            last_day = calendar.monthrange(year, 1)[1]
+            file_name = f'other_{var}_{year}0101_{year}01{last_day}.csv'
+            (barra2_cache / file_name).write_text(make_barra2_csv(var, year, 1, seed=year))
+    return barra2_cache
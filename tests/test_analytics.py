@@ -0,0 +1,100 @@
+"""This module contains the barra2.analytics test function(s)."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import barra2_dl.convert
+import barra2_dl.merge
+from barra2_dl.analytics import (
+    WindStatsAccumulator,
+    hub_height_speed,
+    period_statistics,
+    shear_exponent,
+    speed_heights,
+    weibull_fit,
+    wind_rose,
+)
+from barra2_dl.globals import BARRA2_INDEX
+
+
+@pytest.fixture
+def df_converted() -> pd.DataFrame:
+    """Two years of hourly Weibull speeds at 50m, 100m and 150m with power law shear of 0.2."""
+    index = pd.date_range('2020-01-01', '2021-12-31 23:00', freq='h', tz='UTC', name='time')
+    rng = np.random.default_rng(0)
+    speed = 8 * rng.weibull(2.0, len(index))
+    return pd.DataFrame({
+        'v50m[unit="m s-1"]': speed,
+        'v50m_phi_met[unit="degrees"]': rng.uniform(0, 360, len(index)),
+        'v100m[unit="m s-1"]': speed * 2 ** 0.2,
+        'v150m[unit="m s-1"]': speed * 3 ** 0.2,
+    }, index=index)
+
+
+def test_shear_exponent(df_converted):
+    """Pairwise and fitted exponents recover the power law."""
+    df_shear = shear_exponent(df_converted)
+    assert list(df_shear.columns) == ['alpha_50m_100m', 'alpha_100m_150m', 'alpha']
+    np.testing.assert_allclose(df_shear.to_numpy(), 0.2)
+
+
+@pytest.mark.parametrize('hub_height, factor', [
+    (80, 1.6 ** 0.2),
+    (100, 2 ** 0.2),
+    (200, 4 ** 0.2),
+])
+def test_hub_height_speed(df_converted, hub_height, factor):
+    """Hub height speed is interpolated or extrapolated with the power law."""
+    hub_speed = hub_height_speed(df_converted, hub_height)
+    assert hub_speed.name == f'v{hub_height}m[unit="m s-1"]'
+    np.testing.assert_allclose(hub_speed, df_converted['v50m[unit="m s-1"]'] * factor)
+
+
+@pytest.mark.parametrize('method, tolerance', [
+    ('mle', 0.02),
+    ('moments', 0.05),
+])
+def test_weibull_fit(df_converted, method, tolerance):
+    """Weibull fits recover the shape and scale at every height."""
+    fit = weibull_fit(speed_heights(df_converted), method)
+    np.testing.assert_allclose(fit.loc['k'], 2.0, rtol=tolerance)
+    np.testing.assert_allclose(fit.loc['c'], 8 * np.array([1, 2 ** 0.2, 3 ** 0.2]), rtol=tolerance)
+
+
+def test_wind_rose(df_converted):
+    """Rose frequencies sum to one over sectors centred on north."""
+    df_rose = wind_rose(df_converted, 50, sectors=4)
+    assert list(df_rose.index) == [0, 90, 180, 270]
+    assert df_rose.to_numpy().sum() == pytest.approx(1)
+    np.testing.assert_allclose(df_rose.sum(axis=1), 0.25, atol=0.01)
+
+
+def test_period_statistics_matches_groupby(df_converted):
+    """Vectorised group statistics match pandas groupby per period and site."""
+    df_sites = pd.concat([df_converted.assign(site='a'), (df_converted * 1.1).assign(site='b')])
+    df_stats = period_statistics(df_sites, freq='Y', by='site')
+    assert df_stats.index.names == ['site', 'period']
+    assert len(df_stats) == 4
+    expected = df_sites.groupby(['site', df_sites.index.year])['v100m[unit="m s-1"]'].mean()
+    np.testing.assert_allclose(df_stats['mean_100m'], expected)
+    np.testing.assert_allclose(df_stats['alpha'], 0.2)
+    np.testing.assert_allclose(df_stats['k_50m'], 2.0, rtol=0.05)
+
+
+def test_accumulator_matches_period_statistics(df_converted):
+    """Streaming chunks gives the same statistics as the whole record with the moments fit."""
+    accumulator = WindStatsAccumulator(freq='M', rose_height=50)
+    accumulator.update_all(df_converted.iloc[start:start + 1000] for start in range(0, len(df_converted), 1000))
+    expected = period_statistics(df_converted, freq='M', method='moments')
+    pd.testing.assert_frame_equal(accumulator.result(), expected, check_names=False)
+    pd.testing.assert_frame_equal(accumulator.rose(), wind_rose(df_converted, 50))
+
+
+def test_period_statistics_converted(barra2_cache):
+    """Statistics run on the output of merge and convert."""
+    df_merged = barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, quiet=True)
+    df_converted = barra2_dl.convert.convert_wind_components(df_merged, quiet=True)
+    df_stats = period_statistics(df_converted, freq='M')
+    assert df_stats['count_50m'].tolist() == [31 * 24, 28 * 24]
+    with pytest.raises(ValueError, match='at least two heights'):
+        shear_exponent(df_converted)
@@ -0,0 +1,150 @@
+"""This module contains the barra2.cache test function(s)."""
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import fake_thredds_get
+
+import barra2_dl.download
+from barra2_dl.cache import FrameCache, check_completeness, count_rows, parse_filename, scan_cache
+from barra2_dl.download import download_serial, point_data_urlfilenames
+from barra2_dl.globals import BARRA2_URL_AUS11_1HR
+from barra2_dl.manifest import CacheManifest, Validators
+
+
+def _demo_plan(end_month: str = '2023-02') -> list:
+    """Download plan for the demo files in the barra2_cache fixture."""
+    return point_data_urlfilenames(
+        'http://example.com/{var}', ['ua50m', 'va50m', 'ta50m'], -23.5, 133.4, '2023-01', end_month, 'demo',
+    )
+
+
+@pytest.mark.parametrize('file_name, expected', [
+    ('demo_ua50m_20230101_20230131.csv', ('demo', 'ua50m', '2023-01-01 00:00', '2023-01-31 23:00')),
+    ('barra2_aus11_1hr_va50m_20240201_20240229.csv', ('barra2_aus11_1hr', 'va50m', '2024-02-01', '2024-02-29 23:00')),
+    ('demo_ua50m_20230101_20230131.csv.gz', ('demo', 'ua50m', '2023-01-01 00:00', '2023-01-31 23:00')),
+    ('merged.csv', None),
+    ('demo_ua50m_20230101_20230131.csv.bz2', None),
+])
+def test_parse_filename(file_name, expected):
+    """File names are parsed to prefix, variable and first and last hour."""
+    parsed = parse_filename(file_name)
+    if expected is None:
+        assert parsed is None
+    else:
+        prefix, var, start, end = expected
+        assert parsed == {'prefix': prefix, 'var': var, 'start': pd.Timestamp(start), 'end': pd.Timestamp(end)}
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('a,b\n1,2\n3,4\n', 2),
+    ('a,b\n1,2\n3,4', 2),
+    ('a,b\n', 0),
+    ('', 0),
+])
+def test_count_rows(tmp_path, text, expected):
+    """Rows are counted with or without a trailing line break."""
+    path = tmp_path / 'test.csv'
+    path.write_text(text)
+    assert count_rows(path) == expected
+
+
+def test_count_rows_gaps(barra2_cache):
+    """Rows are counted from line breaks, so files with a gap or repeated hours are counted by their rows."""
+    path = barra2_cache / 'demo_ua50m_20230101_20230131.csv'
+    lines = path.read_bytes().split(b'\n')
+    assert count_rows(path) == 744
+    path.write_bytes(b'\n'.join(lines[:3] + lines[-200:]))
+    assert count_rows(path) == 201
+    path.write_bytes(b'\n'.join(lines[:-1] + lines[-3:]))
+    assert count_rows(path) == 746
+
+
+def test_scan_cache_recorded_rows(barra2_cache):
+    """Rows recorded in the manifest are used for files of the recorded size, other files are counted."""
+    file_name = 'demo_ua50m_20230101_20230131.csv'
+    size = (barra2_cache / file_name).stat().st_size
+    CacheManifest(barra2_cache).put(file_name, Validators('"a"', '', size, 1.0, rows=700))
+    CacheManifest(barra2_cache).put('demo_va50m_20230101_20230131.csv', Validators('"b"', '', 1, 1.0, rows=700))
+    rows = scan_cache(barra2_cache).set_index('file_name')['rows']
+    assert rows[file_name] == 700
+    assert rows['demo_va50m_20230101_20230131.csv'] == 744
+
+
+def test_scan_cache(barra2_cache):
+    """All files of a complete cache are found and complete."""
+    df_files = scan_cache(barra2_cache)
+    assert len(df_files) == 6
+    assert df_files['complete'].all()
+    assert df_files['rows'].tolist() == df_files['expected_rows'].tolist()
+    assert set(df_files['var']) == {'ua50m', 'va50m', 'ta50m'}
+
+
+def test_check_completeness(barra2_cache):
+    """Deleted files are missing, truncated files are partial and both are in the re-download plan."""
+    (barra2_cache / 'demo_ua50m_20230201_20230228.csv').unlink()
+    path = barra2_cache / 'demo_va50m_20230101_20230131.csv'
+    path.write_text(''.join(path.read_text().splitlines(keepends=True)[:-5]))
+
+    report = check_completeness(_demo_plan('2023-03'), barra2_cache)
+    assert not report.is_complete
+    missing = {file_name for _url, file_name in report.missing}
+    assert missing == {'demo_ua50m_20230201_20230228.csv'} | {
+        f'demo_{var}_20230301_20230331.csv' for var in ('ua50m', 'va50m', 'ta50m')
+    }
+    assert [file_name for _url, file_name in report.partial] == ['demo_va50m_20230101_20230131.csv']
+    assert report.redownload_plan() == report.missing + report.partial
+
+    summary = report.summary()
+    assert summary.loc[('demo', 'va50m'), 'partial'] == 1
+    assert summary.loc[('demo', 'va50m'), 'missing_hours'] == 5 + 31 * 24
+    assert summary['planned'].sum() == 9
+
+
+def test_delete_partial(barra2_cache, monkeypatch):
+    """Downloading the re-download plan after deleting the partial files completes the cache."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    plan = point_data_urlfilenames(BARRA2_URL_AUS11_1HR, ['ua50m', 'va50m', 'ta50m'], -23.5, 133.4, '2023-01',
+                                   '2023-03', 'demo')
+    path = barra2_cache / 'demo_va50m_20230101_20230131.csv'
+    path.write_text(''.join(path.read_text().splitlines(keepends=True)[:-5]))
+
+    report = check_completeness(plan, barra2_cache)
+    assert report.delete_partial() == 1
+    assert not path.exists()
+    download_serial(report.redownload_plan(), barra2_cache, quiet=True)
+    assert check_completeness(plan, barra2_cache).is_complete
+
+
+def test_check_completeness_complete(barra2_cache):
+    """A complete cache has an empty re-download plan."""
+    report = check_completeness(_demo_plan(), barra2_cache)
+    assert report.is_complete
+    assert report.redownload_plan() == []
+
+
+def test_coverage(barra2_cache):
+    """Missing months are not covered in the bitmap."""
+    (barra2_cache / 'demo_ta50m_20230201_20230228.csv').unlink()
+    report = check_completeness(_demo_plan(), barra2_cache)
+    bitmap, nodes, variables, hours = report.coverage()
+    assert bitmap.dtype == np.uint8
+    covered = np.unpackbits(bitmap, axis=2, count=len(hours)).astype(bool)
+    assert covered.shape == (1, 3, (31 + 28) * 24)
+    assert covered[0, variables.get_loc('ua50m')].all()
+    ta50m = covered[0, variables.get_loc('ta50m')]
+    assert ta50m[:31 * 24].all() and not ta50m[31 * 24:].any()
+
+
+def test_frame_cache_group(tmp_path):
+    """Storing a frame deletes the frames stored before in its group only."""
+    frame_cache = FrameCache(tmp_path)
+    df = pd.DataFrame({'a': [1, 2]})
+    frame_cache.put('old', df, 'file')
+    frame_cache.put('other', df, 'other_file')
+    frame_cache.put('plain', df)
+    frame_cache.put('new', df, 'file')
+    assert frame_cache.get('old', 'file') is None
+    pd.testing.assert_frame_equal(frame_cache.get('new', 'file'), df)
+    assert frame_cache.get('other', 'other_file') is not None
+    assert frame_cache.get('plain') is not None
+    assert frame_cache.clear() == 3
@@ -0,0 +1,192 @@
+"""This module contains the barra2.cli test function(s)."""
+import pandas as pd
+import pytest
+from conftest import fake_thredds_get, make_barra2_csv
+
+import barra2_dl.cli
+import barra2_dl.download
+
+_JOB = """
+dataset = "AUS-11"
+variables = ["ua50m", "va50m"]
+start = 2023-01-01T00:00:00
+end = "2023-02-28T23:00:00"
+cache_dir = "{tmp}/cache"
+output_dir = "{tmp}/output"
+formats = ["csv"]
+workers = 2
+
+[[sites]]
+name = "demo"
+latitude = -23.5527472
+longitude = 133.3961111
+"""
+
+
+@pytest.fixture
+def job_file(tmp_path):
+    """TOML job file for a single site."""
+    path = tmp_path / 'job.toml'
+    path.write_text(_JOB.format(tmp=tmp_path.as_posix()))
+    return path
+
+
+def test_load_job(job_file):
+    """Job file settings are loaded into a Job."""
+    job = barra2_dl.cli.load_job(job_file)
+    assert job.sites[0].name == 'demo'
+    assert job.workers == 2
+    assert len(job.urlfilenames(job.sites[0])) == 4
+
+
+@pytest.mark.parametrize(('config', 'message'), [
+    ({'sites': [], 'start': '2023-01-01', 'end': '2023-01-31'}, 'at least one site'),
+    ({'sites': [{'name': 'a', 'latitude': 0, 'longitude': 0}], 'start': '2023', 'end': '2023', 'dataset': 'X'},
+     'Unknown dataset'),
+    ({'sites': [], 'start': '2023', 'end': '2023', 'threads': 2}, 'Unknown job settings'),
+    ({'sites': [{'name': 'a', 'latitude': 0, 'longitude': 0}], 'start': '2023', 'end': '2023', 'compression': 'xz'},
+     'Unsupported compression'),
+])
+def test_job_invalid(config, message):
+    """Invalid job settings raise ValueError."""
+    with pytest.raises(ValueError, match=message):
+        barra2_dl.cli.Job.from_dict(config)
+
+
+def test_main_dry_run(job_file, capsys, tmp_path):
+    """Dry run prints the plan and estimated bytes without downloading."""
+    assert barra2_dl.cli.main(['run', str(job_file), '--dry-run']) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].startswith('demo_ua50m_20230101_20230131.csv https://thredds.nci.org.au/')
+    assert out[-1].startswith(f'Requests: 4, estimated bytes: {4 * 120 + 2 * (31 + 28) * 24 * 80}, estimated time: ')
+    assert not (tmp_path / 'cache').exists()
+
+
+@pytest.mark.parametrize('options', [
+    ['--serial'],
+    ['--adaptive'],
+])
+def test_main_run(job_file, tmp_path, monkeypatch, capsys, options):
+    """Run downloads, merges and converts each site."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    assert barra2_dl.cli.main(['run', str(job_file), *options]) == 0
+    out = capsys.readouterr().out
+    assert '[4/4]' in out
+    assert ('Download concurrency: <1> (start)' in out) == ('--adaptive' in options)
+    assert len(list((tmp_path / 'cache').glob('demo_*.csv'))) == 4
+    df_converted = pd.read_csv(tmp_path / 'output' / 'demo_converted_20230101_20230228.csv')
+    assert len(df_converted) == (31 + 28) * 24
+    assert 'v50m[unit="m s-1"]' in df_converted.columns
+    assert not (tmp_path / 'cache' / '_merged').exists()
+
+
+def test_main_run_memoise(job_file, tmp_path, monkeypatch):
+    """Merges are only memoised in the cache folder when the job file opts in."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    job_file.write_text(job_file.read_text().replace('workers = 2', 'workers = 2\nmemoise = true'))
+    assert barra2_dl.cli.main(['run', str(job_file), '--quiet']) == 0
+    merged = (tmp_path / 'output' / 'demo_merged_20230101_20230228.csv').read_text()
+    assert len(list((tmp_path / 'cache' / '_merged').glob('*.pkl'))) == 5
+    assert barra2_dl.cli.main(['merge', str(job_file), '--quiet']) == 0
+    assert (tmp_path / 'output' / 'demo_merged_20230101_20230228.csv').read_text() == merged
+
+
+def test_main_run_site_files(job_file, tmp_path, monkeypatch):
+    """Outputs of a site merge only its planned files, not sites sharing its prefix or months outside the job."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    job_file.write_text(job_file.read_text().replace('workers = 2', 'workers = 2\ncompact = true\nresample = ["MS"]')
+                        + '\n[[sites]]\nname = "demo_east"\nlatitude = -23.32\nlongitude = 133.43\n')
+    (tmp_path / 'cache').mkdir()
+    (tmp_path / 'cache' / 'demo_ua50m_20230301_20230331.csv').write_text(make_barra2_csv('ua50m', 2023, 3))
+    assert barra2_dl.cli.main(['run', str(job_file), '--quiet']) == 0
+    for site in ('demo', 'demo_east'):
+        df_merged = pd.read_csv(tmp_path / 'output' / f'{site}_merged_20230101_20230228.csv')
+        assert len(df_merged) == (31 + 28) * 24
+        df_monthly = pd.read_csv(tmp_path / 'output' / f'{site}_converted_MS_20230101_20230228.csv')
+        assert len(df_monthly) == 2
+
+
+def test_main_run_dataset(job_file, tmp_path, monkeypatch):
+    """The dataset output holds only the planned files of each site, not other cached months."""
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    job_file.write_text(job_file.read_text().replace('formats = ["csv"]', 'formats = ["dataset"]'))
+    (tmp_path / 'cache').mkdir()
+    (tmp_path / 'cache' / 'demo_ua50m_20230301_20230331.csv').write_text(make_barra2_csv('ua50m', 2023, 3))
+    assert barra2_dl.cli.main(['run', str(job_file), '--quiet']) == 0
+    df_dataset = pd.read_parquet(tmp_path / 'output' / 'dataset')
+    assert len(df_dataset) == (31 + 28) * 24
+    assert df_dataset['time'].max() == pd.Timestamp('2023-02-28 23:00', tz='UTC')
+
+
+def test_main_error(tmp_path, capsys):
+    """Invalid job files return a non-zero exit code."""
+    path = tmp_path / 'job.json'
+    path.write_text('{}')
+    assert barra2_dl.cli.main(['run', str(path)]) == 2
+    assert 'Unsupported job file type' in capsys.readouterr().err
+
+
+def test_main_queue(job_file, tmp_path, monkeypatch):
+    """Enqueue, work and merge commands download and write outputs through a shared queue."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    queue = str(tmp_path / 'queue.sqlite')
+    assert barra2_dl.cli.main(['enqueue', str(job_file), '--queue', queue]) == 0
+    assert barra2_dl.cli.main(['work', str(job_file), '--queue', queue, '--quiet']) == 0
+    assert barra2_dl.cli.main(['merge', str(job_file), '--queue', queue, '--quiet']) == 0
+    assert (tmp_path / 'output' / 'demo_merged_20230101_20230228.csv').exists()
+
+
+def test_main_shard_dry_run(job_file, capsys):
+    """Shards of the dry run plan cover the full plan."""
+    lines = []
+    for shard in ('0/2', '1/2'):
+        barra2_dl.cli.main(['run', str(job_file), '--dry-run', '--shard', shard])
+        lines += capsys.readouterr().out.splitlines()[:-1]
+    assert len(lines) == 4
+
+
+def test_main_run_resample(job_file, tmp_path, monkeypatch):
+    """Resampled outputs are written for each frequency in the job."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    job_file.write_text(job_file.read_text().replace('workers = 2', 'workers = 2\nresample = ["MS"]'))
+    assert barra2_dl.cli.main(['run', str(job_file), '--quiet']) == 0
+    df_monthly = pd.read_csv(tmp_path / 'output' / 'demo_converted_MS_20230101_20230228.csv', index_col='time')
+    assert len(df_monthly) == 2
+    assert 'v50m_phi_met[unit="degrees"]' in df_monthly.columns
+
+
+def test_main_probe_dry_run(job_file, tmp_path, monkeypatch, capsys):
+    """Probing downloads one file per variable to the cache and fits the estimate to them."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    job_file.write_text(job_file.read_text().replace('workers = 2\n', ''))
+    assert barra2_dl.cli.main(['run', str(job_file), '--dry-run', '--probe', '--rate-limit', '4']) == 0
+    assert sorted(path.name for path in (tmp_path / 'cache').glob('*.csv')) == [
+        'demo_ua50m_20230101_20230131.csv', 'demo_va50m_20230101_20230131.csv',
+    ]
+    summary = capsys.readouterr().out.splitlines()[-1]
+    assert summary.startswith('Requests: 4, estimated bytes: ')
+    assert summary.endswith('with 1 workers')
+
+
+def test_main_run_refresh(job_file, tmp_path, monkeypatch, capsys):
+    """Refresh revalidates the cached files from the first run."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    assert barra2_dl.cli.main(['run', str(job_file), '--quiet']) == 0
+    assert barra2_dl.cli.main(['run', str(job_file), '--refresh']) == 0
+    assert capsys.readouterr().out.count('not modified') == 4
+
+
+def test_main_run_offline(job_file, tmp_path, monkeypatch, capsys):
+    """Offline runs write outputs from a complete cache and fail fast listing the missing files."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    assert barra2_dl.cli.main(['run', str(job_file), '--quiet']) == 0
+    monkeypatch.delattr(barra2_dl.download.requests, 'get')
+    (tmp_path / 'output' / 'demo_merged_20230101_20230228.csv').unlink()
+    assert barra2_dl.cli.main(['run', str(job_file), '--offline']) == 0
+    assert capsys.readouterr().out.count('exists') == 4
+    assert (tmp_path / 'output' / 'demo_merged_20230101_20230228.csv').exists()
+    (tmp_path / 'cache' / 'demo_va50m_20230201_20230228.csv').unlink()
+    for command in (['run', str(job_file), '--offline'], ['merge', str(job_file), '--offline']):
+        assert barra2_dl.cli.main(command) == 2
+        assert '1 of 4 planned files are not in the cache' in capsys.readouterr().err
@@ -0,0 +1,99 @@
+"""This module contains the barra2.compression test function(s)."""
+import sys
+
+import pandas as pd
+import pytest
+from conftest import fake_thredds_get, make_barra2_csv
+
+import barra2_dl.download
+import barra2_dl.merge
+from barra2_dl.cache import check_completeness, count_rows
+from barra2_dl.compression import cached_files, cached_path, compress_bytes, open_cached
+from barra2_dl.globals import BARRA2_INDEX, BARRA2_URL_AUS11_1HR
+from barra2_dl.panel import build_panel
+from barra2_dl.validate import validate_csv_file
+
+_PLAN_ARGS = (BARRA2_URL_AUS11_1HR, ['ua50m', 'va50m'], -23.5, 133.4, '2023-01-01', '2023-02-28', 'demo')
+
+
+@pytest.fixture(params=['gzip', 'zstd'])
+def compression(request) -> str:
+    """Each supported compression, zstd only if zstandard is installed."""
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    return request.param
+
+
+@pytest.fixture
+def compressed_cache(tmp_path, monkeypatch, compression):
+    """Cache folder of two months of ua50m and va50m downloaded compressed."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    folder = tmp_path / 'cache'
+    folder.mkdir()
+    barra2_dl.download.download_serial(barra2_dl.download.PointDataPlan(*_PLAN_ARGS), folder, quiet=True,
+                                       compression=compression)
+    return folder
+
+
+def test_compress_bytes_round_trip(tmp_path, compression):
+    """Compressed content reads back through open_cached."""
+    content = make_barra2_csv('ua50m', 2023, 1).encode()
+    path = tmp_path / f"demo.csv{'.gz' if compression == 'gzip' else '.zst'}"
+    path.write_bytes(compress_bytes(content, compression))
+    assert path.stat().st_size < len(content) / 3
+    header, rows = content.split(b'\n', 1)
+    with open_cached(path) as file:
+        assert file.readline() == header + b'\n'
+        assert file.read() == rows
+
+
+def test_compress_bytes_unsupported():
+    """Unsupported compressions raise ValueError."""
+    with pytest.raises(ValueError, match='Unsupported compression'):
+        compress_bytes(b'', 'xz')
+
+
+def test_optional_import(monkeypatch):
+    """Missing optional dependencies raise ImportError naming the package and the extra."""
+    monkeypatch.setitem(sys.modules, 'zstandard', None)
+    with pytest.raises(ImportError, match=r'zstandard is required for zstd compression, install barra2-dl\[zstd\]'):
+        compress_bytes(b'', 'zstd')
+
+
+def test_cached_files(tmp_path):
+    """Files match the pattern of their planned name once, preferring the uncompressed file."""
+    for name in ('a_ua50m.csv', 'a_ua50m.csv.gz', 'a_va50m.csv.zst', 'b_ua50m.csv.gz', 'a_ua50m.csv.1.tmp'):
+        (tmp_path / name).touch()
+    assert [path.name for path in cached_files(tmp_path, 'a_*.csv')] == ['a_ua50m.csv', 'a_va50m.csv.zst']
+    assert cached_path(tmp_path, 'b_ua50m.csv').name == 'b_ua50m.csv.gz'
+    assert cached_path(tmp_path, 'b_va50m.csv') is None
+
+
+def test_download_compressed(compressed_cache, compression, monkeypatch):
+    """Compressed downloads are found by their planned name and not downloaded again."""
+    plan = barra2_dl.download.PointDataPlan(*_PLAN_ARGS)
+    assert len(cached_files(compressed_cache)) == len(plan)
+    assert all(path.suffix in ('.gz', '.zst') for path in cached_files(compressed_cache))
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', None)
+    event = barra2_dl.download._download_file(*plan[0], compressed_cache, quiet=True)
+    assert event.status == 'exists'
+
+
+def test_read_compressed(compressed_cache, tmp_path):
+    """Merge, panel, validation and completeness read compressed files like uncompressed files."""
+    plan = barra2_dl.download.PointDataPlan(*_PLAN_ARGS)
+    plain_cache = tmp_path / 'plain'
+    plain_cache.mkdir()
+    barra2_dl.download.download_serial(plan, plain_cache, quiet=True)
+    df_merged = barra2_dl.merge.merge_csvs_to_df(compressed_cache, 'demo*.csv', BARRA2_INDEX, quiet=True)
+    expected = barra2_dl.merge.merge_csvs_to_df(plain_cache, 'demo*.csv', BARRA2_INDEX, quiet=True)
+    pd.testing.assert_frame_equal(df_merged, expected)
+    assert sum(path.stat().st_size for path in cached_files(compressed_cache)) < (
+        sum(path.stat().st_size for path in cached_files(plain_cache)) / 3)
+    df_panel = build_panel(compressed_cache)
+    assert df_panel.shape == ((31 + 28) * 24, 2)
+    path = cached_files(compressed_cache)[0]
+    assert count_rows(path) == 31 * 24
+    assert validate_csv_file(path) is None
+    report = check_completeness(plan, compressed_cache)
+    assert report.missing == [] and report.partial == []
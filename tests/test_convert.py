@@ -1,5 +1,6 @@
 """This module contains the barra2.convert test function(s)."""
 import numpy as np
+import pandas as pd
 import pytest
 
 import barra2_dl.convert
@@ -98,3 +99,53 @@ def test_wind_components_to_direction_invalid_input(ua, va):
     """Test the function with inputs not following the correct types."""
     with pytest.raises(ValueError):
         barra2_dl.convert.wind_components_to_direction(ua, va)
+
+
+"""
+convert.convert_wind_components
+"""
+
+def test_convert_wind_components_matches_scalar():
+    """Vectorised conversion matches the scalar functions and retains the index."""
+    df_merged = pd.DataFrame(
+        {'ua50m[unit="m s-1"]': [3.0, 0.0, -1.0, np.nan], 'va50m[unit="m s-1"]': [4.0, 0.0, 1.0, 1.0]},
+        index=pd.date_range('2023-01-01', periods=4, freq='h', tz='UTC'),
+    )
+    df_converted = barra2_dl.convert.convert_wind_components(df_merged, quiet=True)
+    assert df_converted.index.equals(df_merged.index)
+    ua, va = df_merged.iloc[:3, 0].tolist(), df_merged.iloc[:3, 1].tolist()
+    assert np.allclose(df_converted['v50m[unit="m s-1"]'].iloc[:3], barra2_dl.convert.wind_components_to_speed(ua, va))
+    assert np.allclose(df_converted['v50m_phi_met[unit="degrees"]'].iloc[:3],
+                       barra2_dl.convert.wind_components_to_direction(ua, va))
+    assert np.isnan(df_converted['v50m[unit="m s-1"]'].iloc[3])
+
+
+def test_convert_wind_components_float32():
+    """Float32 components are converted to float32 speed and direction."""
+    df_merged = pd.DataFrame({'ua100m': np.ones(3, dtype=np.float32), 'va100m': np.ones(3, dtype=np.float32)})
+    df_converted = barra2_dl.convert.convert_wind_components(df_merged, quiet=True)
+    assert df_converted['v100m[unit="m s-1"]'].dtype == np.float32
+
+
+@pytest.mark.parametrize('float32', [False, True])
+def test_convert_wind_table(float32):
+    """Arrow conversion matches the DataFrame conversion, keeps the chunks and is null where a component is null."""
+    pa = pytest.importorskip('pyarrow')
+    dtype = np.float32 if float32 else np.float64
+    ua = np.array([3.0, 0.0, -1.0, 2.0, 5.0], dtype=dtype)
+    va = np.array([4.0, 0.0, 1.0, 1.0, -2.0], dtype=dtype)
+    batches = [
+        pa.record_batch({'ua50m[unit="m s-1"]': pa.array(ua[:3]), 'va50m[unit="m s-1"]': pa.array(va[:3])}),
+        pa.record_batch({'ua50m[unit="m s-1"]': pa.array(ua[3:], mask=np.array([True, False])),
+                         'va50m[unit="m s-1"]': pa.array(va[3:])}),
+    ]
+    table = barra2_dl.convert.convert_wind_table(pa.Table.from_batches(batches), quiet=True)
+    df_converted = barra2_dl.convert.convert_wind_components(
+        pd.DataFrame({'ua50m[unit="m s-1"]': np.where([0, 0, 0, 1, 0], np.nan, ua),
+                      'va50m[unit="m s-1"]': va}).astype(dtype), quiet=True)
+    assert table.column_names == df_converted.columns.tolist()
+    assert table['v50m[unit="m s-1"]'].num_chunks == 2
+    assert table['v50m[unit="m s-1"]'].type == pa.from_numpy_dtype(dtype)
+    assert table['v50m_phi_met[unit="degrees"]'].null_count == 1
+    for column in df_converted.columns:
+        np.testing.assert_allclose(table[column].to_numpy(), df_converted[column].to_numpy(), rtol=1e-6)
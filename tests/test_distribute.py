@@ -0,0 +1,132 @@
+"""This module contains the barra2.distribute test function(s)."""
+import threading
+
+import pytest
+from conftest import FakeResponse, fake_thredds_get
+
+import barra2_dl.download
+from barra2_dl.distribute import WorkQueue, run_worker, shard_urlfilenames, wait_until_complete
+from barra2_dl.globals import BARRA2_URL_AUS11_1HR, BARRA2_VAR_WIND_50
+
+
+@pytest.fixture
+def urlfilenames():
+    """Download plan of 3 variables for a year."""
+    return barra2_dl.download.point_data_urlfilenames(
+        BARRA2_URL_AUS11_1HR, BARRA2_VAR_WIND_50, -23.5527472, 133.3961111, '2023-01-01', '2023-12-31', 'demo',
+    )
+
+
+@pytest.mark.parametrize('num_shards', [1, 3, 8])
+def test_shard_urlfilenames(urlfilenames, num_shards):
+    """Shards are disjoint, cover the plan and do not depend on the plan order."""
+    shards = [shard_urlfilenames(urlfilenames, num_shards, index) for index in range(num_shards)]
+    assert sorted(pair for shard in shards for pair in shard) == sorted(urlfilenames)
+    assert shard_urlfilenames(reversed(urlfilenames), num_shards, 0) == list(reversed(shards[0]))
+
+
+def test_shard_urlfilenames_invalid(urlfilenames):
+    """Shard index out of range raises ValueError."""
+    with pytest.raises(ValueError):
+        shard_urlfilenames(urlfilenames, 2, 2)
+
+
+def test_work_queue_lease_expiry(tmp_path, urlfilenames):
+    """Expired leases of crashed workers are leased again."""
+    queue = WorkQueue(tmp_path / 'queue.sqlite')
+    assert queue.add(urlfilenames) == 36
+    assert queue.add(urlfilenames) == 0
+
+    crashed = queue.lease('crashed', batch_size=5, lease_seconds=-1)
+    assert len(crashed) == 5
+    assert queue.counts()['pending'] == 36
+
+    leased = queue.lease('worker', batch_size=100)
+    assert sorted(leased) == sorted(urlfilenames)
+    assert queue.counts() == {'pending': 0, 'leased': 36, 'done': 0, 'failed': 0}
+
+
+def test_work_queue_fail(tmp_path):
+    """Tasks are retried until max_attempts then marked failed."""
+    queue = WorkQueue(tmp_path / 'queue.sqlite')
+    queue.add([('url', 'a.csv')])
+    for _attempt in range(2):
+        assert queue.lease('worker') == [('url', 'a.csv')]
+        assert queue.fail('a.csv', 'worker', max_attempts=2)
+    assert queue.lease('worker') == []
+    assert queue.failed() == [('url', 'a.csv')]
+    assert queue.is_complete()
+
+
+def test_run_worker_threads(tmp_path, urlfilenames, monkeypatch):
+    """Concurrent workers download every task exactly once."""
+    requested = []
+
+    def fake_get(url, **kwargs):
+        requested.append(url)
+        return fake_thredds_get(url)
+
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_get)
+    cache = tmp_path / 'cache'
+    cache.mkdir()
+    queue_path = tmp_path / 'queue.sqlite'
+    WorkQueue(queue_path).add(urlfilenames)
+
+    workers = [
+        threading.Thread(target=run_worker, args=(queue_path, cache, f'worker-{index}', 2), kwargs={'quiet': True})
+        for index in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(requested) == sorted(url for url, _filename in urlfilenames)
+    assert wait_until_complete(queue_path, poll_seconds=0) == {'pending': 0, 'leased': 0, 'done': 36, 'failed': 0}
+    assert len(list(cache.glob('demo_*.csv'))) == 36
+
+
+def test_run_worker_failed(tmp_path, monkeypatch):
+    """Failed downloads are returned to the queue."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', lambda url, **kwargs: FakeResponse(status_code=503))
+    monkeypatch.setattr(barra2_dl.download, '_RETRY_BACKOFF', 0.0)
+    queue = WorkQueue(tmp_path / 'queue.sqlite')
+    queue.add([('url', 'a.csv')])
+    assert run_worker(queue, tmp_path, 'worker', max_attempts=2, quiet=True) == 0
+    assert queue.counts()['failed'] == 1
+
+
+def test_work_queue_expired_lease(tmp_path):
+    """A worker whose lease expired cannot complete or fail a task leased again by another worker."""
+    queue = WorkQueue(tmp_path / 'queue.sqlite')
+    queue.add([('url', 'a.csv')])
+    queue.lease('slow', lease_seconds=-1)
+    queue.lease('fast')
+    assert not queue.complete('a.csv', 'slow')
+    assert not queue.fail('a.csv', 'slow')
+    assert queue.counts()['leased'] == 1
+    assert queue.complete('a.csv', 'fast')
+    assert queue.is_complete()
+
+
+def test_run_worker_connection_error(tmp_path, monkeypatch):
+    """Request exceptions fail the task and the worker carries on with the other tasks."""
+    def fake_get(url, **kwargs):
+        if 'ua50m' in url:
+            raise barra2_dl.download.requests.ConnectionError('connection reset')
+        return fake_thredds_get(url)
+
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_get)
+    queue = WorkQueue(tmp_path / 'queue.sqlite')
+    queue.add(barra2_dl.download.point_data_urlfilenames(BARRA2_URL_AUS11_1HR, ['ua50m', 'va50m'], -23.54, 133.43,
+                                                         '2023-01-01', '2023-01-31', 'demo'))
+    assert run_worker(queue, tmp_path, 'worker', max_attempts=1, quiet=True) == 1
+    assert queue.failed()[0][1] == 'demo_ua50m_20230101_20230131.csv'
+
+
+def test_wait_until_complete_timeout(tmp_path):
+    """Waiting on an incomplete queue raises TimeoutError."""
+    queue = WorkQueue(tmp_path / 'queue.sqlite')
+    queue.add([('url', 'a.csv')])
+    with pytest.raises(TimeoutError):
+        wait_until_complete(queue, poll_seconds=0, timeout=0)
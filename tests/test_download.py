@@ -1,8 +1,12 @@
 """This module contains the barra2.download test function(s)."""
+import itertools
 import os
+import threading
+import time
 from datetime import datetime
 
 import pytest
+from conftest import FakeResponse, fake_thredds_get
 from pandas import Timestamp
 
 import barra2_dl.download
@@ -12,6 +16,7 @@ from barra2_dl.globals import (
     BARRA2_URL_AUST04_1HR,
     BARRA2_VAR_WIND_DEFAULT,
 )
+from barra2_dl.instrument import Metrics
 from barra2_dl.mapping import LatLonPoint
 
 
@@ -224,3 +229,185 @@ def test_download_multithread(
 
 
 
+
+
+def test_point_data_plan_matches_list():
+    """Lazy plan items, slices and iteration match point_data_urlfilenames."""
+    args = (BARRA2_URL_AUS11_1HR, BARRA2_VAR_WIND_DEFAULT, -23.5527472, 133.3961111, '2020-01-01', '2022-12-31')
+    expected = barra2_dl.download.point_data_urlfilenames(*args, 'demo')
+    plan = barra2_dl.download.PointDataPlan(*args, 'demo')
+    assert len(plan) == len(expected) == 7 * 36
+    assert list(plan) == expected
+    assert plan[-1] == expected[-1]
+    assert list(plan[5:50:3]) == expected[5:50:3]
+    assert list(plan[5:50][2:4]) == expected[7:9]
+
+
+def test_point_data_plan_sites():
+    """Multi-site plans are ordered by site then var then month."""
+    plan = barra2_dl.download.PointDataPlan(BARRA2_URL_AUST04_1HR, ['ua50m', 'va50m'], [-23.5, -30.1], [133.3, 140.2],
+                                            '2023-01-01', '2023-03-31', ['a', 'b'])
+    assert len(plan) == 12
+    assert plan[6] == barra2_dl.download.point_data_urlfilenames(
+        BARRA2_URL_AUST04_1HR, ['ua50m'], -30.1, 140.2, '2023-01-01', '2023-01-31', 'b')[0]
+    df_plan = plan.to_frame()
+    assert df_plan['file_name'].tolist() == [file_name for _url, file_name in plan]
+    assert df_plan['site'].dtype == 'category'
+    plan = barra2_dl.download.PointDataPlan(BARRA2_URL_AUST04_1HR, ['ua50m'], -23.5, 133.3, '2023-01-01', '2023-01-31')
+    assert plan.to_frame()['file_name'].tolist() == list(plan.file_names()) == ['None_ua50m_20230101_20230131.csv']
+
+
+def test_point_data_plan_prefix():
+    """A single prefix is numbered by site, so every site has its own files."""
+    plan = barra2_dl.download.PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m'], [-23.5, -30.1], [133.3, 140.2],
+                                            '2023-01-01', '2023-01-31', 'farm')
+    assert list(plan.file_names()) == ['farm_0_ua50m_20230101_20230131.csv', 'farm_1_ua50m_20230101_20230131.csv']
+    plan = barra2_dl.download.PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m'], [-23.5], [133.3], '2023-01-01',
+                                            '2023-01-31', 'farm')
+    assert list(plan.file_names()) == ['farm_ua50m_20230101_20230131.csv']
+
+
+def test_point_data_plan_invalid():
+    """Mismatched sites, shared prefixes and unsupported file types raise ValueError."""
+    with pytest.raises(ValueError):
+        barra2_dl.download.PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m'], [-23.5, -30.1], [133.3], '2023', '2023')
+    with pytest.raises(ValueError, match='own fileout_prefix'):
+        barra2_dl.download.PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m'], [-23.5, -30.1], [133.3, 140.2], '2023',
+                                         '2023')
+    with pytest.raises(ValueError, match='own fileout_prefix'):
+        barra2_dl.download.PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m'], [-23.5, -30.1], [133.3, 140.2], '2023',
+                                         '2023', ['a', 'a'])
+    with pytest.raises(ValueError):
+        barra2_dl.download.PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m'], -23.5, 133.3, '2023', '2023',
+                                         fileout_type='netcdf')
+
+
+@pytest.mark.parametrize('status_code, latency, expected_limit', [
+    (200, 0.1, 4),
+    (404, 0.1, 4),
+    (429, 0.1, 2),
+    (503, 0.1, 2),
+    (500, 0.1, 2),
+    (None, 0.1, 2),
+    (200, 5.0, 2),
+])
+def test_adaptive_concurrency_decrease(status_code, latency, expected_limit):
+    """Throttled, failed and slow responses halve the limit, others leave it until a window of successes."""
+    concurrency = barra2_dl.download.AdaptiveConcurrency(ceiling=8, initial=4, target_latency=1.0)
+    concurrency.record(concurrency.acquire(), status_code, latency)
+    assert concurrency.limit == expected_limit
+    assert concurrency.in_flight == 0
+
+
+def test_adaptive_concurrency_increase_and_bounds():
+    """The limit grows by one per window of successes up to the ceiling and falls once per window to the floor."""
+    metrics = Metrics()
+    concurrency = barra2_dl.download.AdaptiveConcurrency(floor=2, ceiling=4, callback=metrics)
+    for _ in range(20):
+        concurrency.record(concurrency.acquire(), 200, 0.1)
+    assert concurrency.limit == 4
+    tickets = [concurrency.acquire() for _ in range(4)]
+    for ticket in tickets:
+        concurrency.record(ticket, 503, 0.1)
+    assert concurrency.limit == 2
+    assert metrics.gauges['download_concurrency'] == 2
+    assert metrics.counters['concurrency_increase'] == 2
+    assert metrics.counters['concurrency_throttled'] == 1
+    assert 'barra2_dl_download_concurrency 2' in metrics.to_openmetrics()
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'floor': 0},
+    {'floor': 4, 'ceiling': 2},
+    {'initial': 20},
+    {'decrease': 1.0},
+])
+def test_adaptive_concurrency_invalid(kwargs):
+    """Out of range settings raise ValueError."""
+    with pytest.raises(ValueError):
+        barra2_dl.download.AdaptiveConcurrency(**kwargs)
+
+
+def test_download_multithread_adaptive(tmp_path, monkeypatch):
+    """Requests in flight never exceed the limit, which backs off from throttling and recovers, retrying files."""
+    lock = threading.Lock()
+    in_flight = []
+    calls = itertools.count()
+
+    def fake_get(url, **kwargs):
+        """Throttle the first requests, and record the requests in flight."""
+        with lock:
+            in_flight.append(concurrency.in_flight)
+        time.sleep(0.005)
+        if next(calls) < 4:
+            return FakeResponse(status_code=503)
+        return fake_thredds_get(url)
+
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_get)
+    monkeypatch.setattr(barra2_dl.download, '_RETRY_BACKOFF', 0.0)
+    metrics = Metrics()
+    concurrency = barra2_dl.download.AdaptiveConcurrency(ceiling=6, initial=4, callback=metrics)
+    plan = barra2_dl.download.PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m', 'va50m'], -23.5, 133.4,
+                                            '2020-01-01', '2021-12-31', 'demo')
+    barra2_dl.download.download_multithread(plan, tmp_path, callback=metrics, quiet=True, concurrency=concurrency)
+    assert max(in_flight) <= 6
+    assert metrics.counters['concurrency_throttled'] >= 1
+    assert metrics.counters['files_failed'] == 0
+    assert metrics.counters['files_downloaded'] == len(plan)
+    assert metrics.gauges['download_concurrency'] == concurrency.limit > 1
+
+
+@pytest.mark.parametrize('headers, retries, expected', [
+    ({'Retry-After': '3'}, 0, 3.0),
+    ({'Retry-After': 'Wed, 01 Feb 2023 00:00:00 GMT'}, 0, 0.0),
+    ({'Retry-After': '3600'}, 0, 60.0),
+    ({}, 0, 1.0),
+    ({}, 2, 4.0),
+    ({'Retry-After': 'soon'}, 1, 2.0),
+])
+def test_retry_delay(headers, retries, expected):
+    """Retries wait for the Retry-After of the response, else back off exponentially, up to a minute."""
+    assert barra2_dl.download._retry_delay(headers, retries) == expected
+
+
+def test_download_retries_throttled(tmp_path, monkeypatch):
+    """Throttled and server error responses are retried after their Retry-After, with a request timeout."""
+    responses = [FakeResponse(status_code=429, headers={'Retry-After': '2'}), FakeResponse(status_code=502)]
+    requests = []
+    sleeps = []
+
+    def fake_get(url, **kwargs):
+        """Throttle, then fail, then respond."""
+        requests.append(kwargs)
+        return responses.pop(0) if responses else fake_thredds_get(url)
+
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_get)
+    monkeypatch.setattr(barra2_dl.download.time, 'sleep', sleeps.append)
+    url, file_name = barra2_dl.download.point_data_urlfilenames(BARRA2_URL_AUS11_1HR, ['ua50m'], -23.5, 133.4,
+                                                                '2023-01', '2023-01', 'demo')[0]
+    event = barra2_dl.download._download_file(url, file_name, tmp_path, quiet=True)
+    assert (event.status, event.retries, event.status_code) == ('downloaded', 2, 200)
+    assert sleeps == [2.0, 2.0]
+    assert all(kwargs['timeout'] == barra2_dl.download._REQUEST_TIMEOUT for kwargs in requests)
+
+
+def test_download_request_exception(tmp_path, monkeypatch, capsys):
+    """Requests failing without a response are retried and reported failed, without aborting other downloads."""
+    import requests
+
+    def fake_get(url, **kwargs):
+        """Time out the ua50m requests."""
+        if 'var=ua50m' in url:
+            raise requests.ConnectTimeout('timed out')
+        return fake_thredds_get(url)
+
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_get)
+    monkeypatch.setattr(barra2_dl.download, '_RETRY_BACKOFF', 0.0)
+    metrics = Metrics()
+    plan = barra2_dl.download.point_data_urlfilenames(BARRA2_URL_AUS11_1HR, ['ua50m', 'va50m'], -23.5, 133.4,
+                                                      '2023-01', '2023-02', 'demo')
+    barra2_dl.download.download_multithread(plan, tmp_path, callback=metrics)
+    assert metrics.counters['files_failed'] == 2
+    assert metrics.counters['files_downloaded'] == 2
+    assert 'Failed to download after 2 retries: ConnectTimeout: timed out' in capsys.readouterr().out
+    assert sorted(path.name for path in tmp_path.glob('*.csv')) == [file_name for _url, file_name in plan[2:]]
@@ -0,0 +1,74 @@
+"""This module contains the barra2.estimate test function(s)."""
+import pytest
+from conftest import fake_thredds_get
+
+import barra2_dl.download
+from barra2_dl.download import point_data_urlfilenames
+from barra2_dl.estimate import SizeModel, estimate_plan, probe_plan, size_workers
+from barra2_dl.globals import BARRA2_URL_AUS11_1HR
+
+
+@pytest.fixture
+def plan() -> list:
+    """Plan of 12 months of ua50m and va50m for 2023."""
+    return point_data_urlfilenames(
+        BARRA2_URL_AUS11_1HR, ['ua50m', 'va50m'], -23.5527472, 133.3961111, '2023-01', '2023-12', 'demo',
+    )
+
+
+def test_estimate_plan_default(plan):
+    """Bytes are predicted from the hours in each file name."""
+    plan_estimate = estimate_plan(plan, workers=4, rate_limit=1.0)
+    assert plan_estimate.requests == 24
+    assert plan_estimate.bytes_by_var == {'ua50m': 12 * 120 + 8760 * 80, 'va50m': 12 * 120 + 8760 * 80}
+    assert plan_estimate.total_bytes == sum(plan_estimate.bytes_by_var.values())
+    # limited by the rate of 1 request per second, not 24 * 2 / 4 seconds
+    assert plan_estimate.wall_seconds == 24
+
+
+def test_estimate_plan_point_data_plan(plan, monkeypatch):
+    """PointDataPlans are estimated from their file names without formatting the URLs."""
+    lazy_plan = barra2_dl.download.PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m', 'va50m'], -23.5527472, 133.3961111,
+                                                 '2023-01', '2023-12', 'demo')
+    monkeypatch.setattr(barra2_dl.download.PointDataPlan, '__getitem__', None)
+    monkeypatch.setattr(barra2_dl.download.PointDataPlan, '__iter__', None)
+    assert estimate_plan(lazy_plan, workers=4) == estimate_plan(plan, workers=4)
+
+
+def test_probe_plan(plan, tmp_path, monkeypatch):
+    """Probes download the first month of each variable and predict the rest of the plan exactly."""
+    requested = []
+
+    def fake_get(url, **kwargs):
+        requested.append(url)
+        return fake_thredds_get(url)
+
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_get)
+    model = probe_plan(plan, tmp_path)
+    assert len(requested) == 2
+    assert model.probes == 2
+    assert set(model.bytes_per_hour) == {'ua50m', 'va50m'}
+
+    probe_plan(plan, tmp_path)
+    assert len(requested) == 2
+
+    predicted = model.request_bytes('demo_ua50m_20230101_20230131.csv')
+    assert predicted == pytest.approx((tmp_path / 'demo_ua50m_20230101_20230131.csv').stat().st_size)
+
+
+@pytest.mark.parametrize('kwargs, expected', [
+    ({'requests': 1000, 'seconds_per_request': 2.0, 'rate_limit': 5.0}, 10),
+    ({'requests': 1000, 'seconds_per_request': 2.0, 'rate_limit': 50.0}, 16),
+    ({'requests': 1000, 'seconds_per_request': 2.0, 'target_seconds': 500}, 4),
+    ({'requests': 3, 'seconds_per_request': 2.0, 'target_seconds': 0.1}, 3),
+    ({'requests': 10, 'seconds_per_request': 0.01, 'rate_limit': 1.0}, 1),
+])
+def test_size_workers(kwargs, expected):
+    """Workers keep the rate limit busy or meet the target time, within limits."""
+    assert size_workers(**kwargs) == expected
+
+
+def test_size_model_invalid_file_name():
+    """Only point_data_urlfilenames file names can be estimated."""
+    with pytest.raises(ValueError, match='Cannot estimate'):
+        SizeModel().request_bytes('merged.csv')
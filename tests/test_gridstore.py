@@ -0,0 +1,106 @@
+"""This module contains the barra2.gridstore test function(s)."""
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import FakeS3Client, fake_thredds_get, make_barra2_csv
+
+import barra2_dl.download
+from barra2_dl.download import PointDataPlan
+from barra2_dl.globals import BARRA2_URL_AUS11_1HR
+from barra2_dl.gridstore import GridStore, write_grid_store
+from barra2_dl.instrument import Metrics
+from barra2_dl.panel import build_panel
+from barra2_dl.storage import S3Storage
+
+zarr = pytest.importorskip('zarr')
+
+_VARS = ['ua50m', 'va50m', 'ua100m']
+
+
+@pytest.fixture
+def plan():
+    """Plan of two sites two nodes apart for January and February 2023."""
+    return PointDataPlan(BARRA2_URL_AUS11_1HR, _VARS, [-23.54, -23.32], [133.43, 133.43], '2023-01-01',
+                         '2023-02-28', fileout_prefix=['a', 'b'])
+
+
+def test_store_layout(plan, tmp_path):
+    """Arrays share the height coordinate and are chunked by year at a single node."""
+    store = GridStore.from_plan(tmp_path / 'store.zarr', plan)
+    root = zarr.open_group(tmp_path / 'store.zarr', mode='r')
+    assert root['ua'].metadata.dimension_names == ('time', 'height', 'lat', 'lon')
+    assert root['ua'].shape == (0, 2, 3, 1)
+    assert root['ua'].chunks == (8760, 1, 1, 1)
+    assert root['va'].shape == (0, 2, 3, 1)
+    assert root['height'][:].tolist() == [50, 100]
+    assert store.variables == {'ua50m': ('ua', 0), 'va50m': ('va', 0), 'ua100m': ('ua', 1)}
+    assert store.sites == {'a': (0, 0), 'b': (2, 0)}
+    assert root['time'].attrs['units'] == 'hours since 2023-01-01 00:00:00'
+
+
+def test_download_callback(plan, tmp_path, monkeypatch):
+    """Store appended by the download callback matches the panel of the cache, reading only chunks of the node."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    store = GridStore.from_plan(tmp_path / 'store.zarr', plan)
+    (tmp_path / 'cache').mkdir()
+    # January of every site and variable, then February
+    barra2_dl.download.download_serial(list(plan)[::2], tmp_path / 'cache', callback=store, quiet=True)
+    assert len(store) == 31 * 24
+    barra2_dl.download.download_serial(list(plan)[1::2], tmp_path / 'cache', callback=store, quiet=True)
+    assert len(store) == (31 + 28) * 24
+
+    df_panel = build_panel(tmp_path / 'cache', float32=True)
+    df_node = GridStore(tmp_path / 'store.zarr').read_node(-23.32, 133.43)
+    pd.testing.assert_frame_equal(df_node, df_panel['b'][_VARS], check_freq=False, check_names=False)
+    df_window = store.read_node(-23.54, 133.43, ['va50m'], '2023-02-01', '2023-02-01 05:00')
+    np.testing.assert_array_equal(df_window['va50m'], df_panel[('a', 'va50m')].iloc[31 * 24:31 * 24 + 6])
+    # a chunk for each height of each site, the node between the sites was never written
+    chunks = [path for path in (tmp_path / 'store.zarr' / 'ua' / 'c').rglob('*') if path.is_file()]
+    assert len(chunks) == 2 * 2
+    assert store.read_node(-23.43, 133.43)['ua50m'].isna().all()
+    assert zarr.open_group(tmp_path / 'store.zarr', mode='r')['ua'].attrs['units'] == 'm s-1'
+
+
+def test_download_callback_s3(plan, tmp_path, monkeypatch):
+    """Store opened with an S3Storage appends downloads to the bucket from the mirror of the storage."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    storage = S3Storage(FakeS3Client(), 'bucket', 'cache', mirror_dir=tmp_path / 'mirror')
+    store = GridStore.from_plan(tmp_path / 'store.zarr', plan, storage=storage)
+    barra2_dl.download.download_serial(plan, storage, callback=store, quiet=True)
+    assert len(store) == (31 + 28) * 24
+    df_panel = build_panel(tmp_path / 'mirror', float32=True)
+    pd.testing.assert_frame_equal(store.read_node(-23.54, 133.43), df_panel['a'][_VARS], check_freq=False,
+                                  check_names=False)
+
+
+def test_write_grid_store(barra2_cache, tmp_path):
+    """Store created from the cache and rewritten in place keeps its time axis and values."""
+    metrics = Metrics()
+    store = write_grid_store(barra2_cache, tmp_path / 'store.zarr', callback=metrics)
+    assert store.variables == {'ta50m': ('ta', 0), 'ua50m': ('ua', 0), 'va50m': ('va', 0)}
+    assert metrics.counters['stage_zarr_write_count'] == 1
+    store = write_grid_store(barra2_cache, tmp_path / 'store.zarr')
+    assert len(store) == (31 + 28) * 24
+    np.testing.assert_array_equal(store.read_node(-23.54, 133.43)['ta50m'],
+                                  build_panel(barra2_cache, float32=True)[('demo', 'ta50m')])
+
+
+@pytest.mark.parametrize(('file_name', 'match'), [
+    ('a_ta50m_20230101_20230131.csv', 'not in the store'),
+    ('a_ua50m_20221201_20221231.csv', 'starts before the store'),
+    ('notes.csv', 'not a cached file name'),
+])
+def test_write_file_invalid(plan, tmp_path, file_name, match):
+    """Files of other variables, before the store or not in the cache raise ValueError."""
+    store = GridStore.from_plan(tmp_path / 'store.zarr', plan)
+    path = tmp_path / file_name
+    path.write_text(make_barra2_csv(file_name.split('_')[1] if '_' in file_name else 'ua50m', 2022, 12))
+    with pytest.raises(ValueError, match=match):
+        store.write_file(path)
+
+
+def test_read_node_outside(plan, tmp_path):
+    """Nodes outside the box of the store raise ValueError."""
+    store = GridStore.from_plan(tmp_path / 'store.zarr', plan)
+    with pytest.raises(ValueError, match='outside the nodes'):
+        store.read_node(-30.0, 133.43)
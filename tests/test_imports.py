@@ -0,0 +1,49 @@
+"""This module contains the barra2_dl package import test function(s)."""
+import subprocess
+import sys
+
+import pytest
+
+import barra2_dl
+
+_HEAVY_MODULES = ('numpy', 'pandas', 'requests', 'multiprocessing.pool')
+
+
+def _import_seconds(
+    module: str,
+) -> float:
+    """Cumulative import time of a module in a new interpreter, from python -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True,
+                            text=True, check=True)
+    lines = [line for line in result.stderr.splitlines() if line.startswith('import time:')]
+    return int(lines[-1].split('|')[1]) / 1e6
+
+
+@pytest.mark.parametrize('module', [
+    'barra2_dl',
+    'barra2_dl.cli',
+    'barra2_dl.distribute',
+    'barra2_dl.download',
+    'barra2_dl.estimate',
+    'barra2_dl.inventory',
+    'barra2_dl.mapping',
+    'barra2_dl.storage',
+])
+def test_import_is_light(module):
+    """The package, command line and URL planner do not import numpy, pandas or requests."""
+    code = f'import sys, {module}; print(*[name for name in {_HEAVY_MODULES!r} if name in sys.modules])'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
+
+
+def test_import_time():
+    """The command line imports in a fraction of the time of pandas."""
+    assert _import_seconds('barra2_dl.cli') < 0.5 * _import_seconds('pandas')
+
+
+def test_lazy_submodules():
+    """Submodules are imported on first attribute access."""
+    assert barra2_dl.merge.__name__ == 'barra2_dl.merge'
+    assert set(barra2_dl.__all__) <= set(dir(barra2_dl))
+    with pytest.raises(AttributeError):
+        barra2_dl.missing  # noqa: B018
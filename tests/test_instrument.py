@@ -0,0 +1,82 @@
+"""This module contains the barra2.instrument test function(s)."""
+import threading
+import tracemalloc
+
+from conftest import FakeResponse, make_barra2_csv
+
+import barra2_dl.download
+import barra2_dl.merge
+from barra2_dl.globals import BARRA2_INDEX
+from barra2_dl.instrument import DownloadEvent, Metrics, StageEvent, emit, stage
+
+
+def test_emit_quiet(capsys):
+    """Quiet mode writes nothing to stdout but still calls back."""
+    events = []
+    emit(DownloadEvent('demo.csv', 'failed', status_code=404), callback=events.append, quiet=True)
+    assert capsys.readouterr().out == ''
+    assert events[0].status_code == 404
+
+
+def test_emit_stdout(capsys):
+    """Default mode keeps the existing stdout messages."""
+    emit(StageEvent('download', 1.5))
+    assert capsys.readouterr().out == 'Download time: <1.5>\n'
+
+
+def test_metrics_openmetrics():
+    """Counters are exported in OpenMetrics text format."""
+    metrics = Metrics(keep_events=True)
+    metrics(DownloadEvent('a.csv', 'downloaded', nbytes=100, latency=0.5))
+    metrics(DownloadEvent('b.csv', 'downloaded', nbytes=50, latency=0.25, retries=1))
+    metrics(StageEvent('join', 0.1))
+    text = metrics.to_openmetrics()
+    assert 'barra2_dl_bytes_downloaded_total 150' in text
+    assert 'barra2_dl_files_downloaded_total 2' in text
+    assert 'barra2_dl_retries_total 1' in text
+    assert text.endswith('# EOF\n')
+    assert [event['type'] for event in metrics.iter_events()] == ['DownloadEvent', 'DownloadEvent', 'StageEvent']
+
+
+def test_download_serial_events(tmp_path, monkeypatch, capsys):
+    """Downloaders report per file events to the callback."""
+    content = make_barra2_csv('ua50m', 2023, 1, hours=2).encode()
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', lambda url, **kwargs: FakeResponse(content))
+    (tmp_path / 'b.csv').write_text('exists')
+    metrics = Metrics()
+    barra2_dl.download.download_serial([('url_a', 'a.csv'), ('url_b', 'b.csv')], tmp_path, metrics, quiet=True)
+    assert capsys.readouterr().out == ''
+    assert metrics.counters['files_downloaded'] == 1
+    assert metrics.counters['files_exists'] == 1
+    assert metrics.counters['bytes_downloaded'] == len(content)
+    assert metrics.counters['stage_download_count'] == 1
+
+
+def test_merge_stage_events(barra2_cache):
+    """Merge reports a csv parse stage per file and a single join stage."""
+    metrics = Metrics()
+    barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, callback=metrics, quiet=True)
+    assert metrics.counters['stage_csv_parse_count'] == 6
+    assert metrics.counters['stage_join_count'] == 1
+
+
+def test_stage_peak_main_thread():
+    """Peak memory is recorded for stages on the main thread, including allocations of other threads."""
+    events = []
+
+    def allocate():
+        """Allocate in a stage on another thread."""
+        with stage('worker', callback=events.append, quiet=True):
+            bytearray(1 << 22)
+
+    tracemalloc.start()
+    try:
+        with stage('main', callback=events.append, quiet=True):
+            worker = threading.Thread(target=allocate)
+            worker.start()
+            worker.join()
+    finally:
+        tracemalloc.stop()
+    peaks = {event.stage: event.peak_bytes for event in events}
+    assert peaks['worker'] == 0
+    assert peaks['main'] >= 1 << 22
@@ -0,0 +1,82 @@
+"""This module contains the barra2.inventory test function(s)."""
+import subprocess
+import sys
+
+import pytest
+
+from barra2_dl.download import PointDataPlan
+from barra2_dl.globals import BARRA2_URL_AUS11_1HR
+from barra2_dl.instrument import Metrics
+from barra2_dl.inventory import CacheInventory, download_offline
+from barra2_dl.manifest import CacheManifest, Validators
+
+
+def _plan(
+    end: str = '2023-02-28',
+) -> PointDataPlan:
+    """Plan of the demo cache, for January and February 2023 by default."""
+    return PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m', 'va50m', 'ta50m'], -23.54, 133.43, '2023-01-01', end,
+                         'demo')
+
+
+def test_scan(barra2_cache):
+    """Scan indexes planned names, preferring uncompressed files, and skips manifests and partial files."""
+    (barra2_cache / 'demo_ua50m_20230101_20230131.csv.gz').write_bytes(b'')
+    (barra2_cache / 'demo_ua50m_20230301_20230331.csv.zst').write_bytes(b'')
+    (barra2_cache / 'demo_ua50m_20230401_20230430.csv.123.tmp').write_bytes(b'')
+    CacheManifest(barra2_cache)
+    inventory = CacheInventory.scan(barra2_cache)
+    assert len(inventory) == 7
+    assert inventory.path('demo_ua50m_20230101_20230131.csv').name == 'demo_ua50m_20230101_20230131.csv'
+    assert inventory.path('demo_ua50m_20230301_20230331.csv').suffix == '.zst'
+    assert inventory.path('demo_ua50m_20230401_20230430.csv') is None
+    assert [path.name for path in inventory.files('demo_ua50m_*.csv')][-1] == 'demo_ua50m_20230301_20230331.csv.zst'
+
+
+def test_resolve(barra2_cache):
+    """Plans resolve to cached paths in plan order, or fail listing the missing files."""
+    inventory = CacheInventory.scan(barra2_cache)
+    plan = _plan()
+    assert [path.name for path in inventory.resolve(plan)] == [file_name for _url, file_name in plan]
+    assert inventory.missing(list(_plan('2023-03-31'))) == [
+        'demo_ua50m_20230301_20230331.csv', 'demo_va50m_20230301_20230331.csv', 'demo_ta50m_20230301_20230331.csv',
+    ]
+    with pytest.raises(FileNotFoundError, match='3 of 9 planned files are not in the cache .*demo_ta50m_20230301'):
+        inventory.resolve(_plan('2023-03-31'))
+
+
+def test_from_manifest(tmp_path):
+    """Manifest inventories index the recorded files with the compression suffix, without listing the folder."""
+    with pytest.raises(FileNotFoundError, match='no manifest'):
+        CacheInventory.from_manifest(tmp_path)
+    CacheManifest(tmp_path).put('demo_ua50m_20230101_20230131.csv', Validators(etag='"a"'))
+    inventory = CacheInventory.from_manifest(tmp_path, 'gzip')
+    assert list(inventory) == ['demo_ua50m_20230101_20230131.csv']
+    assert inventory.path('demo_ua50m_20230101_20230131.csv') == tmp_path / 'demo_ua50m_20230101_20230131.csv.gz'
+
+
+def test_download_offline(barra2_cache):
+    """Offline downloads emit an exists event per planned file, and nothing if any file is missing."""
+    metrics = Metrics(keep_events=True)
+    paths = download_offline(_plan(), barra2_cache, callback=metrics, quiet=True)
+    assert len(paths) == metrics.counters['files_exists'] == 6
+    metrics = Metrics(keep_events=True)
+    with pytest.raises(FileNotFoundError, match='not in the cache'):
+        download_offline(_plan('2023-03-31'), barra2_cache, callback=metrics, quiet=True)
+    assert not metrics.events
+    with pytest.raises(FileNotFoundError, match='does not exist'):
+        download_offline(_plan(), barra2_cache / 'missing')
+
+
+def test_offline_without_network_stack(barra2_cache):
+    """Serving a plan offline does not import requests."""
+    code = ('import sys\n'
+            'from barra2_dl.download import PointDataPlan\n'
+            'from barra2_dl.globals import BARRA2_URL_AUS11_1HR\n'
+            'from barra2_dl.inventory import download_offline\n'
+            "plan = PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m'], -23.54, 133.43, '2023-01-01', '2023-02-28',"
+            " 'demo')\n"
+            f'download_offline(plan, {str(barra2_cache)!r}, quiet=True)\n'
+            "print('requests' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == 'False'
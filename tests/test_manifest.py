@@ -0,0 +1,114 @@
+"""This module contains the barra2.manifest test function(s)."""
+import os
+import sqlite3
+
+import pytest
+from conftest import FakeResponse, make_barra2_csv
+
+import barra2_dl.download
+from barra2_dl.instrument import Metrics
+from barra2_dl.manifest import CacheManifest, Validators, _conditional_headers
+
+_FILE_NAME = 'demo_ua50m_20230101_20230131.csv'
+_JAN = make_barra2_csv('ua50m', 2023, 1).encode()
+_JAN_REVISED = make_barra2_csv('ua50m', 2023, 1, seed=9).encode()
+
+
+class _FakeServer:
+    """Stand in for requests.get serving a single revisable file with an ETag."""
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        """Respond 304 if the If-None-Match header matches the current ETag."""
+        self.requests.append(headers or {})
+        etag = f'"{len(self.content)}-{self.content[-20:].hex()}"'
+        if (headers or {}).get('If-None-Match') == etag:
+            return FakeResponse(status_code=304, headers={'ETag': etag})
+        return FakeResponse(self.content, headers={'ETag': etag, 'Last-Modified': 'Wed, 01 Feb 2023 00:00:00 GMT'})
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Fake server patched into the downloader."""
+    fake_server = _FakeServer(_JAN)
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_server.get)
+    return fake_server
+
+
+def test_manifest_round_trip(tmp_path):
+    """Validators are recorded, revalidated and removed by file name."""
+    manifest = CacheManifest(tmp_path)
+    manifest.put('a.csv', Validators('"x"', '', 10, 1.0))
+    assert manifest.get('a.csv') == Validators('"x"', '', 10, 1.0)
+    manifest.touch('a.csv')
+    assert manifest.get('a.csv').checked > 1.0
+    assert list(CacheManifest(tmp_path).items()) == ['a.csv']
+    manifest.remove('a.csv')
+    assert manifest.get('a.csv') is None
+
+
+def test_manifest_rows_column(tmp_path):
+    """Manifests written before row counts were recorded gain the rows column."""
+    with sqlite3.connect(tmp_path / '_manifest.sqlite') as connection:
+        connection.execute("CREATE TABLE validators (file_name TEXT PRIMARY KEY, etag TEXT NOT NULL DEFAULT '', "
+                           "last_modified TEXT NOT NULL DEFAULT '', content_length INTEGER, "
+                           "checked REAL NOT NULL DEFAULT 0)")
+        connection.execute("INSERT INTO validators VALUES ('a.csv', '\"x\"', '', 10, 1.0)")
+    connection.close()
+    manifest = CacheManifest(tmp_path)
+    assert manifest.get('a.csv') == Validators('"x"', '', 10, 1.0)
+    manifest.put('b.csv', Validators('"y"', '', 10, 1.0, rows=2))
+    assert manifest.get('b.csv').rows == 2
+
+
+@pytest.mark.parametrize('validators, size, expected', [
+    (Validators('"x"', 'Wed, 01 Feb 2023 00:00:00 GMT', 5), 5,
+     {'If-None-Match': '"x"', 'If-Modified-Since': 'Wed, 01 Feb 2023 00:00:00 GMT'}),
+    (Validators('"x"', '', 5), 4, {}),
+    (None, 5, {'If-Modified-Since': 'Sun, 01 Jan 2023 00:00:00 GMT'}),
+])
+def test_conditional_headers(tmp_path, validators, size, expected):
+    """Recorded validators, or the file time if not recorded, are sent unless the size has changed."""
+    path = tmp_path / 'a.csv'
+    path.write_bytes(b'x' * size)
+    os.utime(path, (1672531200, 1672531200))
+    assert _conditional_headers(path, validators) == expected
+
+
+def test_refresh_not_modified(tmp_path, server):
+    """Unchanged files are revalidated with a 304 and not transferred again."""
+    barra2_dl.download.download_serial([('url', _FILE_NAME)], tmp_path, quiet=True)
+    assert CacheManifest(tmp_path).get(_FILE_NAME).content_length == len(_JAN)
+    assert CacheManifest(tmp_path).get(_FILE_NAME).rows == 31 * 24
+    metrics = Metrics()
+    barra2_dl.download.download_multithread([('url', _FILE_NAME)], tmp_path, metrics, quiet=True, refresh=True)
+    assert server.requests[-1]['If-None-Match'].startswith('"')
+    assert metrics.counters['files_not_modified'] == 1
+    assert metrics.counters['bytes_downloaded'] == 0
+    assert (tmp_path / _FILE_NAME).read_bytes() == _JAN
+
+
+def test_refresh_revised(tmp_path, server):
+    """Revised files replace the cached file and their validators."""
+    barra2_dl.download.download_serial([('url', _FILE_NAME)], tmp_path, quiet=True)
+    etag = CacheManifest(tmp_path).get(_FILE_NAME).etag
+    server.content = _JAN_REVISED
+    metrics = Metrics()
+    barra2_dl.download.download_serial([('url', _FILE_NAME)], tmp_path, metrics, quiet=True, refresh=True)
+    assert metrics.counters['files_updated'] == 1
+    assert (tmp_path / _FILE_NAME).read_bytes() == _JAN_REVISED
+    assert CacheManifest(tmp_path).get(_FILE_NAME).etag != etag
+    assert list(tmp_path.glob('*.tmp')) == []
+
+
+def test_refresh_invalid_keeps_cached(tmp_path, server):
+    """A revised response that fails validation leaves the cached file in place."""
+    barra2_dl.download.download_serial([('url', _FILE_NAME)], tmp_path, quiet=True)
+    server.content = _JAN_REVISED[:-200]
+    metrics = Metrics()
+    barra2_dl.download.download_serial([('url', _FILE_NAME)], tmp_path, metrics, quiet=True, refresh=True)
+    assert metrics.counters['files_failed'] == 1
+    assert (tmp_path / _FILE_NAME).read_bytes() == _JAN
@@ -0,0 +1,82 @@
+"""This module contains the barra2.mapping test function(s)."""
+import numpy as np
+import pytest
+from conftest import fake_thredds_get
+
+import barra2_dl.download
+from barra2_dl.globals import BARRA2_URL_AUS11_1HR
+from barra2_dl.mapping import AUS11_GRID, RegularGrid, interpolation_weights
+from barra2_dl.panel import build_panel
+
+_GRID = RegularGrid(south=-30.0, west=130.0, rows=50, cols=60, lat_res=0.1, lon_res=0.1)
+
+
+def _linear_field(
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+) -> np.ndarray:
+    """Time x sites values of a field linear in latitude and longitude, scaled by time."""
+    return np.arange(1, 4)[:, None] * (2.0 + 3.0 * latitudes - 0.5 * longitudes)[None, :]
+
+
+def test_bilinear_linear_field():
+    """Bilinear interpolation of a linear field is exact, for sites anywhere in the grid."""
+    rng = np.random.default_rng(0)
+    latitudes = rng.uniform(_GRID.south, _GRID.north, 1000)
+    longitudes = rng.uniform(_GRID.west, _GRID.east, 1000)
+    weights = interpolation_weights(_GRID, latitudes, longitudes)
+    node_latitudes, node_longitudes = np.array(weights.node_locations()).T
+    interpolated = weights.apply(_linear_field(node_latitudes, node_longitudes))
+    np.testing.assert_allclose(interpolated, _linear_field(latitudes, longitudes))
+    assert len(weights.nodes) == len(set(weights.nodes)) < 4 * 1000
+
+
+@pytest.mark.parametrize('method', ['bilinear', 'idw', 'nearest'])
+def test_weights(method):
+    """Weights sum to 1, sites on a node use only that node and nearest uses a single node."""
+    latitudes, longitudes = [-29.95, -29.9, -25.15, _GRID.north], [130.03, 130.2, 135.05, _GRID.east]
+    weights = interpolation_weights(_GRID, latitudes, longitudes, sites=['a', 'b', 'c', 'd'], method=method)
+    np.testing.assert_allclose(weights.weights.sum(axis=1), 1.0)
+    assert weights.weights.shape == weights.indices.shape == (4, 4)
+    assert [weights.nodes[index] for index in weights.indices[1]] == ['node_1_2'] * 4
+    assert [weights.nodes[index] for index in weights.indices[3]] == ['node_49_59'] * 4
+    if method == 'nearest':
+        assert (np.count_nonzero(weights.weights, axis=1) == 1).all()
+        assert weights.nodes[weights.indices[0, weights.weights[0].argmax()]] == 'node_0_0'
+    else:
+        assert (np.count_nonzero(weights.weights, axis=1) == [4, 1, 4, 1]).all()
+
+
+@pytest.mark.parametrize(('latitudes', 'longitudes', 'kwargs', 'match'), [
+    ([-31.0], [131.0], {}, 'outside the grid'),
+    ([-29.0], [140.0], {}, 'outside the grid'),
+    ([-29.0], [131.0], {'method': 'cubic'}, 'Unsupported interpolation method'),
+    ([-29.0, -28.0], [131.0], {}, 'must match'),
+])
+def test_weights_invalid(latitudes, longitudes, kwargs, match):
+    """Sites outside the grid, unsupported methods and mismatched sites raise ValueError."""
+    with pytest.raises(ValueError, match=match):
+        interpolation_weights(_GRID, latitudes, longitudes, **kwargs)
+
+
+def test_antimeridian():
+    """Longitudes west of a grid crossing the antimeridian are wrapped."""
+    weights = interpolation_weights(AUS11_GRID, [-20.0], [-170.0])
+    assert weights.node_locations()[0][1] > 180
+
+
+def test_interpolate_panel(tmp_path, monkeypatch):
+    """Each unique node is downloaded once and its panel is interpolated to the sites."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    weights = interpolation_weights(AUS11_GRID, [-23.5, -23.52, -23.5], [133.4, 133.41, 133.45],
+                                    sites=['a', 'b', 'c'])
+    plan = weights.node_plan(BARRA2_URL_AUS11_1HR, ['ua50m', 'va50m'], '2023-01-01', '2023-01-31')
+    assert len(plan) == 2 * len(weights.nodes)
+    barra2_dl.download.download_serial(plan, tmp_path, quiet=True)
+    df_nodes = build_panel(tmp_path)
+    df_sites = weights.interpolate_panel(df_nodes)
+    assert list(df_sites.columns) == [(site, var) for site in 'abc' for var in ('ua50m', 'va50m')]
+    # the fake server returns the same series for every node, so every site interpolates to it
+    np.testing.assert_allclose(df_sites[('b', 'va50m')], df_nodes[(weights.nodes[0], 'va50m')])
+    with pytest.raises(ValueError, match='missing 1 nodes'):
+        weights.interpolate_panel(df_nodes.drop(columns=weights.nodes[0], level='site'))
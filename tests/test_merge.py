@@ -0,0 +1,226 @@
+"""This module contains the barra2.merge test function(s)."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import make_barra2_csv
+
+import barra2_dl.merge
+from barra2_dl.globals import BARRA2_INDEX
+from barra2_dl.instrument import Metrics
+
+
+@pytest.fixture
+def df_merged(barra2_cache):
+    """Default merge of the demo cache."""
+    return barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, quiet=True)
+
+
+def test_merge_csvs_to_df(df_merged):
+    """All months and variables are merged on the index."""
+    assert len(df_merged) == (31 + 28) * 24
+    assert df_merged.columns.tolist()[:4] == BARRA2_INDEX
+    assert df_merged.notna().all().all()
+
+
+@pytest.mark.parametrize('float32', [False, True])
+def test_merge_csvs_to_df_compact(barra2_cache, df_merged, float32):
+    """Compact merge has a time index, site attrs, the same values and a fraction of the memory."""
+    df_compact = barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, quiet=True,
+                                                  compact=True, float32=float32)
+    assert isinstance(df_compact.index, pd.DatetimeIndex)
+    assert df_compact.index.is_monotonic_increasing
+    assert df_compact.attrs['site']['latitude[unit="degrees_north"]'] == -23.54
+    assert set(df_compact.dtypes) == {np.dtype(np.float32 if float32 else np.float64)}
+    expected = df_merged.sort_values('time').set_index('time')[df_compact.columns]
+    assert np.allclose(df_compact.to_numpy(), expected.to_numpy(), atol=1e-4)
+    ratio = df_merged.memory_usage(deep=True).sum() / df_compact.memory_usage(deep=True).sum()
+    assert ratio > (5 if float32 else 3)
+
+
+def test_compact_barra2_frame_multiple_stations():
+    """Site columns with multiple values are kept as categorical columns."""
+    df = pd.DataFrame({
+        'time': ['2023-01-01T00:00:00Z', '2023-01-01T00:00:00Z'],
+        'station': ['a', 'b'],
+        'latitude[unit="degrees_north"]': [-23.5, -23.5],
+        'longitude[unit="degrees_east"]': [133.0, 134.0],
+        'ua50m': [1.0, 2.0],
+    })
+    df_compact = barra2_dl.merge.compact_barra2_frame(df)
+    assert df_compact['station'].dtype == 'category'
+    assert df_compact.attrs['site'] == {'latitude[unit="degrees_north"]': -23.5}
+
+
+def test_merge_compact_different_sites(barra2_cache):
+    """Compact merge of different sites raises ValueError."""
+    other = barra2_cache / 'demo_ua50m_20230301_20230331.csv'
+    text = (barra2_cache / 'demo_ua50m_20230101_20230131.csv').read_text()
+    other.write_text(text.replace('2023-01', '2023-03').replace(',-23.54,', ',-30.0,'))
+    with pytest.raises(ValueError, match='different sites'):
+        barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, quiet=True, compact=True)
+
+
+def test_merge_align_on_time(barra2_cache):
+    """Aligned join matches the compact outer join."""
+    kwargs = {'filein_folder': barra2_cache, 'filename_pattern': 'demo*.csv', 'index_for_join': BARRA2_INDEX,
+              'quiet': True}
+    df_compact = barra2_dl.merge.merge_csvs_to_df(**kwargs, compact=True)
+    df_aligned = barra2_dl.merge.merge_csvs_to_df(**kwargs, align_on_time=True)
+    pd.testing.assert_frame_equal(df_aligned[df_compact.columns], df_compact, check_index_type=False)
+    assert df_aligned.attrs['missing_hours'] == {}
+
+
+def _drop_lines(path, start, stop):
+    lines = path.read_text().splitlines(keepends=True)
+    path.write_text(''.join(lines[:start] + lines[stop:]))
+
+
+def test_merge_align_on_time_gaps(barra2_cache):
+    """Gaps in regular hourly data are filled with NaN and reported as missing hours."""
+    _drop_lines(barra2_cache / 'demo_va50m_20230201_20230228.csv', 11, 16)
+    df_aligned = barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, quiet=True,
+                                                  align_on_time=True)
+    assert len(df_aligned) == (31 + 28) * 24
+    assert df_aligned.attrs['missing_hours'] == {'va50m[unit="m s-1"]': 5}
+    missing = barra2_dl.merge.missing_hours(df_aligned)['va50m[unit="m s-1"]']
+    assert missing[0] == pd.Timestamp('2023-02-01T10:00:00Z')
+
+
+def test_merge_align_on_time_irregular(barra2_cache):
+    """Irregular time steps fall back to a sorted merge."""
+    path = barra2_cache / 'demo_ta50m_20230101_20230131.csv'
+    path.write_text(path.read_text().replace('2023-01-01T05:00:00Z', '2023-01-01T05:30:00Z'))
+    df_aligned = barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, quiet=True,
+                                                  align_on_time=True)
+    assert df_aligned.index.is_monotonic_increasing
+    assert len(df_aligned) == (31 + 28) * 24 + 1
+    assert np.isnan(df_aligned.loc['2023-01-01T05:30:00Z', 'ua50m[unit="m s-1"]'])
+
+
+def test_merge_align_on_time_empty(tmp_path):
+    """Header only files align to an empty frame with the columns of the files."""
+    for var in ('ua50m', 'va50m'):
+        (tmp_path / f'demo_{var}_20230101_20230131.csv').write_text(make_barra2_csv(var, 2023, 1, hours=0))
+    df_aligned = barra2_dl.merge.merge_csvs_to_df(tmp_path, 'demo*.csv', BARRA2_INDEX, quiet=True,
+                                                  align_on_time=True)
+    assert df_aligned.empty
+    assert df_aligned.columns.tolist()[-2:] == ['ua50m[unit="m s-1"]', 'va50m[unit="m s-1"]']
+    assert df_aligned.attrs['missing_hours'] == {}
+
+
+@pytest.fixture
+def overlap_cache(barra2_cache):
+    """Demo cache with January ua50m also cached under the prefixes demo_x and demo_y with values 100 and 200."""
+    text = (barra2_cache / 'demo_ua50m_20230101_20230131.csv').read_text()
+    for offset, prefix in enumerate(['demo_x', 'demo_y'], start=1):
+        lines = text.splitlines(keepends=True)
+        lines[1:] = [line.rsplit(',', 1)[0] + f',{100.0 * offset}\n' for line in lines[1:]]
+        (barra2_cache / f'{prefix}_ua50m_20230101_20230131.csv').write_text(''.join(lines))
+    return barra2_cache
+
+
+@pytest.mark.parametrize(('precedence', 'expected'), [
+    ('first', None),
+    ('last', 200.0),
+    ('newest', 100.0),
+])
+@pytest.mark.parametrize('kwargs', [{}, {'compact': True}, {'align_on_time': True}])
+def test_merge_precedence(overlap_cache, precedence, expected, kwargs):
+    """Overlapping files coalesce into one column per variable by precedence, without suffixes."""
+    ua50m = 'ua50m[unit="m s-1"]'
+    os.utime(overlap_cache / 'demo_x_ua50m_20230101_20230131.csv', ns=(2 * 10**18, 2 * 10**18))
+    df_policy = barra2_dl.merge.merge_csvs_to_df(overlap_cache, 'demo*.csv', BARRA2_INDEX, quiet=True,
+                                                 precedence=precedence, **kwargs)
+    assert not any(column.endswith(('_x', '_y')) for column in df_policy.columns)
+    assert len(df_policy) == (31 + 28) * 24
+    january = df_policy[ua50m].to_numpy()[:31 * 24]
+    if expected is None:
+        expected = pd.read_csv(overlap_cache / 'demo_ua50m_20230101_20230131.csv')[ua50m].to_numpy()
+    np.testing.assert_allclose(january, expected, atol=1e-4)
+    # February is only in the demo files
+    february = pd.read_csv(overlap_cache / 'demo_ua50m_20230201_20230228.csv')[ua50m].to_numpy()
+    np.testing.assert_allclose(df_policy[ua50m].to_numpy()[31 * 24:], february)
+
+
+def test_merge_duplicate_timestamps(barra2_cache, df_merged):
+    """Repeated timestamps in a file are coalesced, keeping the first value."""
+    path = barra2_cache / 'demo_va50m_20230101_20230131.csv'
+    lines = path.read_text().splitlines(keepends=True)
+    path.write_text(''.join(lines[:3] + [lines[2].replace(lines[2].rsplit(',', 1)[1], '99.0\n')] + lines[3:]))
+    for kwargs in ({}, {'align_on_time': True}):
+        df_dedup = barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, quiet=True, **kwargs)
+        assert len(df_dedup) == len(df_merged)
+        assert df_dedup['va50m[unit="m s-1"]'].iloc[1] == df_merged['va50m[unit="m s-1"]'].iloc[1] != 99.0
+
+
+def test_merge_invalid_precedence(barra2_cache):
+    """Unsupported precedence raises ValueError."""
+    with pytest.raises(ValueError, match='Unsupported precedence'):
+        barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, quiet=True, precedence='oldest')
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'compact': True, 'float32': True}, {'align_on_time': True}])
+def test_merge_memoised(barra2_cache, tmp_path, kwargs):
+    """Repeated merges are read from the cache, and only rewritten files are parsed again."""
+    merge_kwargs = {'filein_folder': barra2_cache, 'filename_pattern': 'demo*.csv', 'index_for_join': BARRA2_INDEX,
+                    'quiet': True, **kwargs}
+    cache_dir = tmp_path / 'merged'
+    df_first = barra2_dl.merge.merge_csvs_to_df(**merge_kwargs, cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(df_first, barra2_dl.merge.merge_csvs_to_df(**merge_kwargs))
+    assert df_first.attrs == barra2_dl.merge.merge_csvs_to_df(**merge_kwargs).attrs
+
+    metrics = Metrics()
+    df_cached = barra2_dl.merge.merge_csvs_to_df(**merge_kwargs, cache_dir=cache_dir, callback=metrics)
+    pd.testing.assert_frame_equal(df_cached, df_first)
+    assert df_cached.attrs == df_first.attrs
+    assert metrics.counters == {}
+
+    path = barra2_cache / 'demo_ta50m_20230201_20230228.csv'
+    path.write_text(make_barra2_csv('ta50m', 2023, 2, seed=99))
+    df_changed = barra2_dl.merge.merge_csvs_to_df(**merge_kwargs, cache_dir=cache_dir, callback=metrics)
+    assert metrics.counters['stage_csv_parse_count'] == 1
+    pd.testing.assert_frame_equal(df_changed, barra2_dl.merge.merge_csvs_to_df(**merge_kwargs))
+    # the superseded frames of the rewritten file and of the merge are evicted
+    assert len(list(cache_dir.glob('*.pkl'))) == len(list(barra2_cache.glob('demo*.csv'))) + 1
+    df_last = barra2_dl.merge.merge_csvs_to_df(**merge_kwargs, cache_dir=cache_dir, precedence='last',
+                                               callback=metrics)
+    assert metrics.counters['stage_csv_parse_count'] == 1
+    pd.testing.assert_frame_equal(df_last, barra2_dl.merge.merge_csvs_to_df(**merge_kwargs, precedence='last'))
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'compact': True}, {'align_on_time': True}])
+def test_merge_memoised_overlap(tmp_path, kwargs):
+    """Memoised merges of files overlapping across months keep the file precedence of the plain merge."""
+    cache = tmp_path / 'cache'
+    cache.mkdir()
+    (cache / 'a_ua50m_20230101_20230131.csv').write_text(make_barra2_csv('ua50m', 2023, 1, seed=1))
+    (cache / 'b_ua50m_20230201_20230228.csv').write_text(make_barra2_csv('ua50m', 2023, 2, seed=2))
+    february = make_barra2_csv('ua50m', 2023, 2, seed=4).split('\n', 1)[1]
+    (cache / 'c_ua50m_20230101_20230228.csv').write_text(make_barra2_csv('ua50m', 2023, 1, seed=3) + february)
+    merge_kwargs = {'filein_folder': cache, 'filename_pattern': '*.csv', 'quiet': True, **kwargs}
+    for precedence in barra2_dl.merge._PRECEDENCES:
+        df_memoised = barra2_dl.merge.merge_csvs_to_df(**merge_kwargs, precedence=precedence,
+                                                       cache_dir=tmp_path / 'merged')
+        pd.testing.assert_frame_equal(df_memoised, barra2_dl.merge.merge_csvs_to_df(**merge_kwargs,
+                                                                                    precedence=precedence))
+
+
+@pytest.mark.parametrize('precedence', ['first', 'last'])
+def test_merge_csvs_to_table(overlap_cache, precedence):
+    """Arrow merge matches the DataFrame merge, with a UTC timestamp time column."""
+    pa = pytest.importorskip('pyarrow')
+    df_merged = barra2_dl.merge.merge_csvs_to_df(overlap_cache, 'demo*.csv', BARRA2_INDEX, quiet=True,
+                                                 precedence=precedence)
+    metrics = Metrics()
+    table = barra2_dl.merge.merge_csvs_to_table(overlap_cache, 'demo*.csv', callback=metrics, quiet=True,
+                                                precedence=precedence)
+    assert isinstance(table, pa.Table)
+    assert table.column_names == df_merged.columns.tolist()
+    assert table.schema.field('time').type == pa.timestamp('s', tz='UTC')
+    assert metrics.counters['stage_csv_parse_count'] == 8
+    np.testing.assert_array_equal(table['time'].to_numpy().astype('datetime64[ns]'),
+                                  pd.to_datetime(df_merged['time']).dt.tz_localize(None).to_numpy())
+    for column in df_merged.columns[4:]:
+        np.testing.assert_array_equal(table[column].to_numpy(), df_merged[column].to_numpy())
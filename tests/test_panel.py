@@ -0,0 +1,80 @@
+"""This module contains the barra2.panel test function(s)."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import barra2_dl.merge
+import barra2_dl.panel
+from barra2_dl.compression import cached_files
+from barra2_dl.globals import BARRA2_INDEX
+from barra2_dl.panel import build_panel, panel_files, write_panel_parquet, write_panel_parquet_files
+
+
+def test_panel_files(sites_cache):
+    """Files are grouped by site prefix, and listed sites without files are kept."""
+    files = panel_files(sites_cache, ['other', 'missing'])
+    assert [len(paths) for paths in files.values()] == [4, 0]
+    assert set(panel_files(sites_cache)) == {'demo', 'other'}
+
+
+def test_build_panel_wide(sites_cache):
+    """Wide panel columns match the single site merge."""
+    df_panel = build_panel(sites_cache)
+    assert list(df_panel.columns.names) == ['site', 'var']
+    assert df_panel.index[0] == pd.Timestamp('2023-01-01', tz='UTC')
+    assert df_panel.index[-1] == pd.Timestamp('2024-01-31 23:00', tz='UTC')
+    df_demo = barra2_dl.merge.merge_csvs_to_df(sites_cache, 'demo*.csv', BARRA2_INDEX, quiet=True, align_on_time=True)
+    np.testing.assert_array_equal(
+        df_panel.loc[df_demo.index, ('demo', 'ua50m')].to_numpy(), df_demo['ua50m[unit="m s-1"]'].to_numpy(),
+    )
+    assert df_panel[('other', 'ua50m')].notna().sum() == 2 * 31 * 24
+    assert df_panel.attrs['units']['ta50m'] == 'K'
+    assert df_panel.attrs['sites']['demo']['latitude'] == -23.54
+
+
+def test_build_panel_long(sites_cache):
+    """Long panel has a row per site, time and variable, sorted in that order."""
+    df_panel = build_panel(sites_cache, ['demo'], layout='long', float32=True)
+    assert list(df_panel.columns) == ['site', 'time', 'var', 'value']
+    assert len(df_panel) == 3 * (31 + 28) * 24
+    assert df_panel['value'].dtype == np.float32
+    assert df_panel['var'].iloc[:3].tolist() == ['ta50m', 'ua50m', 'va50m']
+    assert df_panel['time'].is_monotonic_increasing
+
+
+def test_build_panel_invalid(sites_cache):
+    """Unsupported layouts, empty selections and header-only files raise ValueError."""
+    with pytest.raises(ValueError, match='layout'):
+        build_panel(sites_cache, layout='tall')
+    with pytest.raises(ValueError, match='No cached files'):
+        build_panel(sites_cache, ['missing'])
+    for path in panel_files(sites_cache, ['other'])['other']:
+        path.write_text(path.read_text().splitlines(keepends=True)[0])
+    with pytest.raises(ValueError, match='No data rows'):
+        build_panel(sites_cache, ['other'])
+
+
+def test_write_panel_parquet(sites_cache, tmp_path, monkeypatch):
+    """Sites are written to partitions by site and year from a single listing, and rewritten partitions are replaced."""
+    pytest.importorskip('pyarrow')
+    listings = []
+    monkeypatch.setattr(barra2_dl.panel, 'cached_files', lambda *args: listings.append(args) or cached_files(*args))
+    output_dir = tmp_path / 'dataset'
+    write_panel_parquet(sites_cache, output_dir)
+    assert len(listings) == 1
+    write_panel_parquet(sites_cache, output_dir, ['other'])
+    partitions = sorted(path.parent.relative_to(output_dir).as_posix() for path in output_dir.rglob('*.parquet'))
+    assert partitions == ['site=demo/year=2023', 'site=other/year=2023', 'site=other/year=2024']
+    df_other = pd.read_parquet(output_dir / 'site=other' / 'year=2024')
+    assert len(df_other) == 31 * 24
+    assert {'time', 'ua50m', 'va50m'} <= set(df_other.columns)
+
+
+def test_write_panel_parquet_files(sites_cache, tmp_path):
+    """Only the given files of each site are written."""
+    pytest.importorskip('pyarrow')
+    files = {'other': [path for path in panel_files(sites_cache, ['other'])['other'] if '2024' not in path.name]}
+    write_panel_parquet_files(files, tmp_path / 'dataset')
+    partitions = sorted(path.parent.relative_to(tmp_path / 'dataset').as_posix()
+                        for path in (tmp_path / 'dataset').rglob('*.parquet'))
+    assert partitions == ['site=other/year=2023']
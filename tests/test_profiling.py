@@ -0,0 +1,34 @@
+"""This module contains the barra2.profiling test function(s)."""
+import json
+
+import barra2_dl.convert
+import barra2_dl.merge
+from barra2_dl.globals import BARRA2_INDEX
+from barra2_dl.profiling import Profiler
+
+
+def test_profiler_merge_convert(barra2_cache, tmp_path):
+    """Profiler records stages of functions run inside it without passing a callback."""
+    with Profiler() as profiler:
+        df_merged = barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, quiet=True)
+        barra2_dl.convert.convert_wind_components(df_merged, quiet=True)
+
+    report = profiler.report()
+    assert report['stages']['csv_parse']['count'] == 6
+    assert report['stages']['csv_parse']['rows'] == 3 * (31 + 28) * 24
+    assert report['stages']['join']['count'] == 1
+    assert report['stages']['convert']['rows'] == len(df_merged)
+    assert report['peak_bytes'] > 0
+
+    profiler.to_json(tmp_path / 'profile.json')
+    profiler.to_html(tmp_path / 'profile.html')
+    assert json.loads((tmp_path / 'profile.json').read_text())['stages'].keys() == report['stages'].keys()
+    assert '<td>join</td>' in (tmp_path / 'profile.html').read_text()
+
+
+def test_profiler_removes_listener(barra2_cache):
+    """Events after the profile are not recorded."""
+    with Profiler(trace_memory=False) as profiler:
+        pass
+    barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, quiet=True)
+    assert profiler.stages == {}
@@ -0,0 +1,78 @@
+"""This module contains the barra2.query test function(s)."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from barra2_dl.instrument import Metrics
+from barra2_dl.panel import build_panel, write_panel_parquet
+from barra2_dl.query import query_cache, query_dataset, query_files
+
+_WINDOW = ('2023-01-15', '2023-02-10 23:00')
+
+
+@pytest.mark.parametrize(('kwargs', 'expected'), [
+    ({}, {'demo': 6, 'other': 4}),
+    ({'sites': ['other']}, {'other': 4}),
+    ({'variables': ['ua50m']}, {'demo': 2, 'other': 2}),
+    ({'start': '2023-02-01'}, {'demo': 3, 'other': 2}),
+    ({'start': '2023-01-31T23:00:00', 'end': '2023-01-31T23:00:00'}, {'demo': 3, 'other': 2}),
+    ({'sites': ['demo', 'missing'], 'variables': ['va50m'], 'end': '2023-01-31T12:00:00+10:00'},
+     {'demo': 1, 'missing': 0}),
+])
+def test_query_files(sites_cache, kwargs, expected):
+    """Files are selected by site, variable and overlap of their month with the window."""
+    files = query_files(sites_cache, **kwargs)
+    assert {site: len(paths) for site, paths in files.items()} == expected
+
+
+def test_query_cache(sites_cache):
+    """Query matches the slice of the full panel and only reads the files of the query."""
+    metrics = Metrics(keep_events=True)
+    df_query = query_cache(sites_cache, ['demo', 'other'], ['ua50m'], *_WINDOW, callback=metrics)
+    df_panel = build_panel(sites_cache)
+    expected = df_panel.loc[pd.Timestamp(_WINDOW[0], tz='UTC'):pd.Timestamp(_WINDOW[1], tz='UTC'),
+                            [('demo', 'ua50m'), ('other', 'ua50m')]]
+    pd.testing.assert_frame_equal(df_query, expected, check_freq=False)
+    files = query_files(sites_cache, ['demo', 'other'], ['ua50m'], *_WINDOW)
+    parse_event = next(event for event in metrics.events if event.stage == 'csv_parse')
+    assert parse_event.nbytes == sum(path.stat().st_size for paths in files.values() for path in paths)
+    assert df_query.attrs['sites']['other']['latitude'] == -23.54
+
+
+def test_query_cache_long(sites_cache):
+    """Long layout has only the rows of the window."""
+    df_query = query_cache(sites_cache, variables=['ta50m', 'va50m'], start=_WINDOW[0], end=_WINDOW[1],
+                           layout='long', float32=True)
+    assert set(df_query['var']) == {'ta50m', 'va50m'}
+    assert df_query['time'].min() == pd.Timestamp(_WINDOW[0], tz='UTC')
+    assert df_query['time'].max() == pd.Timestamp(_WINDOW[1], tz='UTC')
+    assert len(df_query) == 2 * (17 + 10) * 24 + 17 * 24
+    assert df_query['value'].dtype == np.float32
+
+
+@pytest.mark.parametrize(('kwargs', 'match'), [
+    ({'sites': ['missing']}, 'No cached files'),
+    ({'start': '2025-01-01'}, 'No cached files'),
+    ({'start': '2023-01-31 22:30', 'end': '2023-01-31 22:45'}, 'No cached rows'),
+    ({'layout': 'tall'}, 'layout'),
+])
+def test_query_cache_invalid(sites_cache, kwargs, match):
+    """Unsupported layouts and queries without files or rows raise ValueError."""
+    with pytest.raises(ValueError, match=match):
+        query_cache(sites_cache, **kwargs)
+
+
+def test_query_dataset(sites_cache, tmp_path):
+    """Dataset query with pushed down filters matches the cache query."""
+    pytest.importorskip('pyarrow')
+    output_dir = write_panel_parquet(sites_cache, tmp_path / 'dataset')
+    df_query = query_dataset(output_dir, ['other'], ['va50m'], '2023-01-20', '2024-01-02 05:00')
+    assert df_query.columns.tolist() == ['site', 'time', 'va50m']
+    assert set(df_query['site']) == {'other'}
+    df_cache = query_cache(sites_cache, ['other'], ['va50m'], '2023-01-20', '2024-01-02 05:00')
+    np.testing.assert_array_equal(df_query['time'].to_numpy(), df_cache.index.to_numpy())
+    np.testing.assert_array_equal(df_query['va50m'].to_numpy(), df_cache[('other', 'va50m')].to_numpy())
+    # the other partitions hold every hour from January 2023 to January 2024
+    assert len(query_dataset(output_dir)) == (31 + 28) * 24 + (365 + 31) * 24
+    with pytest.raises(ValueError, match='not in the dataset'):
+        query_dataset(output_dir, variables=['ua100m'])
@@ -0,0 +1,66 @@
+"""This module contains the barra2.resample test function(s)."""
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import make_barra2_csv
+
+import barra2_dl.merge
+from barra2_dl.globals import BARRA2_INDEX
+from barra2_dl.instrument import Metrics
+from barra2_dl.resample import resample_csvs, resample_frame
+
+
+@pytest.fixture
+def df_merged(barra2_cache) -> pd.DataFrame:
+    """Full hourly merge of the demo cache."""
+    return barra2_dl.merge.merge_csvs_to_df(barra2_cache, 'demo*.csv', BARRA2_INDEX, quiet=True, align_on_time=True)
+
+
+def test_resample_frame_vector_mean(df_merged):
+    """Components are averaged before conversion, giving the speed of the mean wind vector."""
+    df_daily = resample_frame(df_merged, 'D')
+    assert len(df_daily) == 31 + 28
+    first_day = df_merged.iloc[:24]
+    ua, va = first_day['ua50m[unit="m s-1"]'].mean(), first_day['va50m[unit="m s-1"]'].mean()
+    assert df_daily['v50m[unit="m s-1"]'].iloc[0] == pytest.approx(np.hypot(ua, va))
+    assert df_daily['ta50m[unit="K"]'].iloc[0] == pytest.approx(first_day['ta50m[unit="K"]'].mean())
+
+
+def test_resample_frame_interpolate(df_merged):
+    """Upsampling interpolates linearly between hours."""
+    df_10min = resample_frame(df_merged, '10min', convert=False)
+    assert len(df_10min) == (len(df_merged) - 1) * 6 + 1
+    ua = df_merged['ua50m[unit="m s-1"]']
+    assert df_10min['ua50m[unit="m s-1"]'].iloc[3] == pytest.approx((ua.iloc[0] + ua.iloc[1]) / 2)
+
+
+@pytest.mark.parametrize('freq', ['10min', 'D', 'MS', 'QS'])
+def test_resample_csvs_matches_frame(barra2_cache, df_merged, freq):
+    """Resampling one month at a time matches resampling the full merge, including across months, without caching."""
+    df_chunked = resample_csvs(barra2_cache, freq, 'demo*.csv', quiet=True)
+    pd.testing.assert_frame_equal(df_chunked, resample_frame(df_merged, freq), check_freq=False)
+    assert df_chunked.attrs['site']['station'] == df_merged.attrs['site']['station']
+    assert not (barra2_cache / '_resampled').exists()
+
+
+def test_resample_csvs_cache(barra2_cache, tmp_path):
+    """Repeated requests are read from the cache without parsing csv files, until the files change."""
+    cache_dir = tmp_path / 'resampled'
+    df_first = resample_csvs(barra2_cache, 'MS', 'demo*.csv', cache_dir=cache_dir, quiet=True)
+    assert len(list(cache_dir.glob('*.pkl'))) == 2
+
+    metrics = Metrics()
+    df_cached = resample_csvs(barra2_cache, 'MS', 'demo*.csv', cache_dir=cache_dir, callback=metrics, quiet=True)
+    pd.testing.assert_frame_equal(df_cached, df_first)
+    assert 'stage_csv_parse_count' not in metrics.counters
+
+    path = barra2_cache / 'demo_ta50m_20230201_20230228.csv'
+    path.write_text(make_barra2_csv('ta50m', 2023, 2, seed=99))
+    resample_csvs(barra2_cache, 'MS', 'demo*.csv', cache_dir=cache_dir, callback=metrics, quiet=True)
+    assert metrics.counters['stage_csv_parse_count'] == 3
+
+
+def test_resample_csvs_use_cache(barra2_cache):
+    """use_cache caches the resampled chunks in the cache folder."""
+    resample_csvs(barra2_cache, 'MS', 'demo*.csv', use_cache=True, quiet=True)
+    assert len(list((barra2_cache / '_resampled').glob('*.pkl'))) == 2
@@ -0,0 +1,100 @@
+"""This module contains the barra2.storage test function(s)."""
+import pandas as pd
+import pytest
+from conftest import FakeS3Client, fake_thredds_get
+
+import barra2_dl.download
+from barra2_dl.download import PointDataPlan
+from barra2_dl.globals import BARRA2_URL_AUS11_1HR
+from barra2_dl.merge import merge_csvs_to_df
+from barra2_dl.storage import _MIN_PART_SIZE, LocalStorage, S3Storage
+
+_PLAN = PointDataPlan(BARRA2_URL_AUS11_1HR, ['ua50m', 'va50m'], -23.54, 133.43, '2023-01-01', '2023-02-28', 'demo')
+
+
+@pytest.fixture
+def s3_storage(tmp_path):
+    """S3Storage of a fake S3 client, with a prefix and a local mirror."""
+    return S3Storage(FakeS3Client(), 'bucket', 'barra2/cache', part_size=_MIN_PART_SIZE, max_workers=4,
+                     mirror_dir=tmp_path / 'mirror')
+
+
+@pytest.mark.parametrize('backend', ['local', 's3'])
+def test_storage(tmp_path, s3_storage, backend):
+    """Files are written, listed by planned name preferring uncompressed, read by range and deleted."""
+    storage = LocalStorage(tmp_path) if backend == 'local' else s3_storage
+    for name in ('a_ua50m.csv', 'a_ua50m.csv.gz', 'a_va50m.csv.zst', 'b_ua50m.csv'):
+        assert storage.write_bytes(name, name.encode()) == len(name)
+    assert storage.list_names('a_*.csv') == ['a_ua50m.csv', 'a_va50m.csv.zst']
+    assert storage.cached_name('a_va50m.csv') == 'a_va50m.csv.zst'
+    assert storage.read_bytes('b_ua50m.csv') == b'b_ua50m.csv'
+    assert storage.read_range('b_ua50m.csv', 2, 5) == b'ua50m'
+    assert storage.stat('b_ua50m.csv')[0] == len('b_ua50m.csv')
+    storage.delete('a_va50m.csv.zst')
+    assert storage.cached_name('a_va50m.csv') is None
+
+
+def test_listing_cached(s3_storage):
+    """Listings are fetched in pages once, and updated by writes without listing again."""
+    client = s3_storage.client
+    for index in range(2500):
+        client.put_object(Bucket='bucket', Key=f'barra2/cache/file{index:04d}.csv', Body=b'x')
+    client.put_object(Bucket='bucket', Key='barra2/cache/_merged/frame.pkl', Body=b'x')
+    client.put_object(Bucket='bucket', Key='other/file.csv', Body=b'x')
+    assert len(s3_storage.list_names()) == 2500
+    assert client.calls['list_objects_v2'] == 3
+    s3_storage.write_bytes('new.csv', b'x')
+    assert s3_storage.cached_name('new.csv') == 'new.csv'
+    assert s3_storage.cached_name('file0001.csv') == 'file0001.csv'
+    assert client.calls['list_objects_v2'] == 3
+    s3_storage.listing(refresh=True)
+    assert client.calls['list_objects_v2'] == 6
+
+
+def test_multipart(s3_storage):
+    """Large objects are uploaded in parallel parts and read in parallel ranges."""
+    data = bytes(range(256)) * (_MIN_PART_SIZE * 5 // 2 // 256)
+    s3_storage.write_bytes('large.csv', data)
+    client = s3_storage.client
+    assert client.calls['upload_part'] == 3
+    assert client.calls['complete_multipart_upload'] == 1
+    assert client.calls['put_object'] == 0
+    assert s3_storage.read_bytes('large.csv') == data
+    assert client.calls['get_object'] == 3
+
+
+def test_multipart_abort(tmp_path):
+    """A failed part aborts the upload and leaves no object."""
+    storage = S3Storage(FakeS3Client(fail_part=2), 'bucket', part_size=_MIN_PART_SIZE)
+    with pytest.raises(ConnectionError):
+        storage.write_bytes('large.csv', b'x' * (_MIN_PART_SIZE * 2))
+    assert storage.client.calls['abort_multipart_upload'] == 1
+    assert not storage.client.objects
+    assert storage.cached_name('large.csv') is None
+
+
+def test_part_size_invalid():
+    """Parts smaller than the S3 minimum raise ValueError."""
+    with pytest.raises(ValueError, match='part_size'):
+        S3Storage(FakeS3Client(), 'bucket', part_size=1024)
+
+
+def test_download_merge_s3(tmp_path, s3_storage, monkeypatch):
+    """Downloads to object storage are merged from the mirror as from a local cache, mirroring only new files."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', fake_thredds_get)
+    (tmp_path / 'cache').mkdir()
+    barra2_dl.download.download_serial(_PLAN, tmp_path / 'cache', quiet=True)
+    barra2_dl.download.download_multithread(_PLAN, s3_storage, quiet=True, compression='gzip', max_workers=2)
+    assert s3_storage.list_names() == [f'{file_name}.gz' for file_name in sorted(_PLAN.file_names())]
+    list_calls = s3_storage.client.calls['list_objects_v2']
+    barra2_dl.download.download_serial(_PLAN, s3_storage, quiet=True)
+    assert s3_storage.client.calls['list_objects_v2'] == list_calls
+
+    df_merged = merge_csvs_to_df(s3_storage, 'demo_*.csv', quiet=True, compact=True)
+    pd.testing.assert_frame_equal(df_merged, merge_csvs_to_df(tmp_path / 'cache', 'demo_*.csv', quiet=True,
+                                                              compact=True))
+    get_calls = s3_storage.client.calls['get_object']
+    merge_csvs_to_df(s3_storage, 'demo_*.csv', quiet=True, compact=True)
+    assert s3_storage.client.calls['get_object'] == get_calls
+    with pytest.raises(ValueError, match='no mirror_dir'):
+        S3Storage(s3_storage.client, 'bucket').local_files()
@@ -0,0 +1,66 @@
+"""This module contains the barra2.validate test function(s)."""
+import pandas as pd
+import pytest
+from conftest import FakeResponse, make_barra2_csv
+
+import barra2_dl.download
+from barra2_dl.validate import validate_csv_bytes, validate_csv_file
+
+_JAN = make_barra2_csv('ua50m', 2023, 1)
+
+
+@pytest.mark.parametrize('text, var, expected', [
+    (_JAN, 'ua50m', None),
+    (_JAN, 'va50m', 'Column <va50m> not in header'),
+    ('FileNotFound: No such file or directory', None, 'Unexpected header'),
+    ('<html><body>Internal Server Error</body></html>', None, 'Unexpected header'),
+    (_JAN.split('\n', 1)[0] + '\n', None, 'No data rows'),
+    (_JAN[:-200], 'ua50m', 'Last row at'),
+])
+def test_validate_csv_bytes(text, var, expected):
+    """Error bodies, wrong variables and truncated files are found from the head and tail."""
+    content = text.encode()
+    error = validate_csv_bytes(
+        content[:4096], content[-4096:], var, pd.Timestamp('2023-01-01'), pd.Timestamp('2023-01-31 23:00'),
+    )
+    if expected is None:
+        assert error is None
+    else:
+        assert error.startswith(expected)
+
+
+def test_validate_csv_bytes_rows():
+    """Missing rows between the first and last hour are found from the row count."""
+    lines = _JAN.splitlines(keepends=True)
+    content = ''.join(lines[:100] + lines[101:]).encode()
+    assert validate_csv_bytes(content[:4096], content[-4096:], rows=len(lines) - 2) == '743 rows for 744 hours'
+
+
+def test_validate_csv_file(tmp_path):
+    """The variable and period are taken from the file name."""
+    path = tmp_path / 'demo_ua50m_20230101_20230131.csv'
+    path.write_text(_JAN)
+    assert validate_csv_file(path) is None
+    path.write_text(_JAN[:-1000])
+    assert validate_csv_file(path).startswith('Last row at')
+    path = tmp_path / 'demo_ua50m_20230201_20230228.csv'
+    path.write_text(_JAN)
+    assert validate_csv_file(path).startswith('First row at')
+
+
+def test_download_retries_invalid(tmp_path, monkeypatch):
+    """Invalid responses are requested again and only a valid file is written."""
+    responses = iter([FakeResponse(b'FileNotFound: No such file or directory'), FakeResponse(_JAN.encode())])
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', lambda url, **kwargs: next(responses))
+    event = barra2_dl.download._download_file('url', 'demo_ua50m_20230101_20230131.csv', tmp_path, quiet=True)
+    assert (event.status, event.retries) == ('downloaded', 1)
+    assert (tmp_path / 'demo_ua50m_20230101_20230131.csv').read_text() == _JAN
+
+
+def test_download_invalid_not_written(tmp_path, monkeypatch, capsys):
+    """Files failing validation after all retries are reported failed and not written to the cache."""
+    monkeypatch.setattr(barra2_dl.download.requests, 'get', lambda url, **kwargs: FakeResponse(_JAN[:-200].encode()))
+    event = barra2_dl.download._download_file('url', 'demo_ua50m_20230101_20230131.csv', tmp_path, max_retries=1)
+    assert (event.status, event.retries) == ('failed', 1)
+    assert 'Failed validation after 1 retries: Last row at' in capsys.readouterr().out
+    assert not (tmp_path / 'demo_ua50m_20230101_20230131.csv').exists()